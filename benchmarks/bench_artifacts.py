@@ -0,0 +1,77 @@
+"""Measure how long it takes to create artifacts for large files and sharded directories, the first
+time (when every file must be read) and again once the hash cache knows the files.
+
+Usage: python benchmarks/bench_artifacts.py [--megabytes 256] [--shards 2000] [--algorithm sha1 blake2b]
+
+Each measurement is written to stdout as one JSON object per line.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from pathlib import Path
+
+from yenta.artifacts import FileArtifact, DirectoryArtifact
+from yenta.config import settings
+
+
+def timed(func) -> float:
+
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_file(root: Path, megabytes: int, algorithm: str) -> dict:
+
+    path = root / f'large-{algorithm}.bin'
+    with open(path, 'wb') as f:
+        for _ in range(megabytes):
+            f.write(os.urandom(2 ** 20))
+    # files modified within the last couple of seconds are never cached
+    os.utime(path, ns=(0, time.time_ns() - 10 ** 10))
+
+    cold = timed(lambda: FileArtifact(location=path, hash_algorithm=algorithm))
+    warm = timed(lambda: FileArtifact(location=path, hash_algorithm=algorithm))
+    return {'benchmark': 'artifacts', 'artifact': 'file', 'algorithm': algorithm, 'megabytes': megabytes,
+            'cold_s': cold, 'warm_s': warm}
+
+
+def bench_directory(root: Path, shards: int, algorithm: str) -> dict:
+
+    path = root / f'shards-{algorithm}'
+    path.mkdir()
+    old = time.time_ns() - 10 ** 10
+    for i in range(shards):
+        shard = path / f'shard-{i:05d}'
+        shard.write_bytes(os.urandom(16384))
+        os.utime(shard, ns=(0, old))
+
+    cold = timed(lambda: DirectoryArtifact(location=path, hash_algorithm=algorithm))
+    warm = timed(lambda: DirectoryArtifact(location=path, hash_algorithm=algorithm))
+    (path / 'shard-00000').write_bytes(os.urandom(16384))
+    one_changed = timed(lambda: DirectoryArtifact(location=path, hash_algorithm=algorithm))
+    return {'benchmark': 'artifacts', 'artifact': 'directory', 'algorithm': algorithm, 'shards': shards,
+            'cold_s': cold, 'warm_s': warm, 'one_changed_s': one_changed}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=int, default=256)
+    parser.add_argument('--shards', type=int, default=2000)
+    parser.add_argument('--algorithm', nargs='+', default=['sha1', 'blake2b'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = Path(directory)
+        settings.YENTA_STORE_PATH = root / 'store'
+        for algorithm in args.algorithm:
+            print(json.dumps(bench_file(root, args.megabytes, algorithm)), flush=True)
+            print(json.dumps(bench_directory(root, args.shards, algorithm)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
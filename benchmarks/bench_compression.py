@@ -0,0 +1,103 @@
+"""Compare the disk footprint and the load latency of cached results under each compression codec.
+
+Each workload is written to a `FileStore` and loaded back in the same way as `Pipeline.cache_result` and
+`Pipeline.load_pipeline` do, so the numbers include serialization and the file system but not fingerprinting.
+
+Workloads:
+  text     log-like lines of text
+  table    a list of records mixing strings, integers and floats
+  array    a smooth float64 array, written with the npy serializer
+  random   an array of random floats, which does not compress
+
+Usage: python benchmarks/bench_compression.py [--megabytes 10] [--workloads text table] [--codecs none zlib:1 lzma]
+
+Each measurement is written to stdout as one JSON object per line.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+from yenta.pipeline import Pipeline, TaskResult
+from yenta.store import FileStore, get_serializer, get_codec
+
+WORKLOADS = ['text', 'table', 'array', 'random']
+
+
+def make_result(workload: str, megabytes: int) -> TaskResult:
+
+    rng = np.random.default_rng(0)
+    size = megabytes * 2 ** 20
+    if workload == 'text':
+        levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+        lines, total = [], 0
+        while total < size:
+            line = (f'2021-06-{rng.integers(1, 31):02d} {levels[rng.integers(4)]} worker-{rng.integers(64)} '
+                    f'processed batch {rng.integers(10 ** 6)} in {rng.random():.4f}s\n')
+            lines.append(line)
+            total += len(line)
+        return TaskResult({'log': ''.join(lines)})
+    elif workload == 'table':
+        count = size // 48
+        genes = [f'GENE{i:05d}' for i in range(2000)]
+        return TaskResult({'rows': [(genes[i % 2000], int(i % 97), float(np.round(x, 3)))
+                                    for i, x in enumerate(rng.random(count))]})
+    elif workload == 'array':
+        return TaskResult({'signal': np.round(np.sin(np.linspace(0, 1000, size // 8)), 4)})
+    else:
+        return TaskResult({'noise': rng.random(size // 8)})
+
+
+def bench(workload: str, result: TaskResult, codec_spec: str, megabytes: int, repeat: int) -> dict:
+
+    serializer = get_serializer('npy' if workload in ['array', 'random'] else 'pickle')
+    codec = get_codec(codec_spec)
+
+    serialized = sum(memoryview(chunk).nbytes for chunks in serializer.dumps(result).values() for chunk in chunks)
+
+    dump_times, load_times = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        store = FileStore(Path(directory) / 'default')
+        store.create()
+        for _ in range(repeat):
+            meta = {'inputs': None, 'result': None, 'serializer': serializer.name, 'status': result.status}
+            start = time.perf_counter()
+            entry = Pipeline._write_task_cache(store, workload, result, meta, serializer, codec, threshold=0)
+            dump_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            loaded = Pipeline._load_task_result(store, workload, entry)
+            for value in loaded.values.values():
+                # touch every page of memory mapped arrays
+                if isinstance(value, np.ndarray):
+                    value.sum()
+            load_times.append(time.perf_counter() - start)
+            del loaded
+
+    dump, load = min(dump_times), min(load_times)
+    return {'benchmark': 'compression', 'workload': workload, 'codec': codec_spec, 'megabytes': megabytes,
+            'serialized_mb': serialized / 2 ** 20, 'stored_mb': entry['size'] / 2 ** 20,
+            'ratio': serialized / entry['size'], 'dump_s': dump, 'load_s': load}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workloads', nargs='+', default=WORKLOADS, choices=WORKLOADS)
+    parser.add_argument('--codecs', nargs='+', default=['none', 'zlib:1', 'zlib', 'lzma:1', 'lzma', 'bz2'])
+    args = parser.parse_args()
+
+    for workload in args.workloads:
+        result = make_result(workload, args.megabytes)
+        for codec in args.codecs:
+            print(json.dumps(bench(workload, result, codec, args.megabytes, args.repeat)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Measure the overhead of the framework on synthetic pipelines of various shapes, sizes and payloads.
+
+Two sweeps are run. The size sweep builds pipelines of every shape (see shapes.py) for each number of
+tasks, with trivial payloads. The payload sweep builds a small diamond pipeline whose tasks all return a
+payload of each given size. For every pipeline the following are measured:
+
+    build           constructing the Pipeline, i.e. `build_task_graph` and the execution order
+    run             a first `run_pipeline`, which executes every task and caches its result
+    cache_result    writing the results of every task again with `cache_result`
+    load_lazy       `load_pipeline`, which only lists the cached results
+    load_full       `load_pipeline` and then loading every result
+    reuse_inputs    fingerprinting the inputs of every task and deciding with `reuse_inputs` to reuse it
+    reuse_run       a second `run_pipeline`, in which every task is reused
+
+Usage: python benchmarks/bench_framework.py [--sizes 10 100 1000 10000] [--shapes wide chain diamond random]
+                                            [--payloads 8 1048576 104857600] [--stores file sqlite]
+                                            [--repeat 3] [--output results.jsonl]
+
+Every measurement is written as one JSON object per line, to stdout and optionally appended to a file,
+along with enough about the environment to compare runs over time with benchmarks/compare.py.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+from yenta.config import settings
+from yenta.pipeline import Pipeline, PipelineResult
+
+from shapes import SHAPES, make_tasks, describe
+
+
+def environment() -> dict:
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'date': datetime.now().isoformat(timespec='seconds')}
+
+
+def timed(func) -> float:
+
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def measure(shape: str, n: int, payload_size: int, store_kind: str) -> dict:
+
+    with tempfile.TemporaryDirectory() as store, contextlib.redirect_stdout(io.StringIO()):
+        settings.YENTA_STORE_PATH = Path(store)
+        settings.YENTA_STORE_URL = f'sqlite:///{store}/cache.db' if store_kind == 'sqlite' else None
+        tasks = make_tasks(shape, n, payload_size)
+        times = {}
+
+        pipeline = None
+
+        def build():
+            nonlocal pipeline
+            pipeline = Pipeline(*tasks, name='bench')
+
+        times['build'] = timed(build)
+
+        result = None
+
+        def run():
+            nonlocal result
+            result = pipeline.run_pipeline()
+
+        times['run'] = timed(run)
+
+        def cache():
+            for task_name in pipeline.execution_order:
+                pipeline.cache_result(task_name, result)
+            pipeline.flush_cache()
+
+        times['cache_result'] = timed(cache)
+        times['load_lazy'] = timed(lambda: Pipeline.load_pipeline(pipeline.store))
+
+        def load_full():
+            loaded = Pipeline.load_pipeline(pipeline.store)
+            for task_name in pipeline.execution_order:
+                loaded.task_results[task_name]
+
+        times['load_full'] = timed(load_full)
+
+        previous = Pipeline.load_pipeline(pipeline.store)
+
+        def reuse():
+            for task_name in pipeline.execution_order:
+                args = PipelineResult()
+                for dependency in pipeline.task_graph.predecessors(task_name):
+                    args.task_results[dependency] = previous.task_results[dependency]
+                    args.task_fingerprints[dependency] = previous.task_fingerprints[dependency]
+                assert Pipeline.reuse_inputs(task_name, previous, Pipeline.input_fingerprint(args))
+
+        times['reuse_inputs'] = timed(reuse)
+        times['reuse_run'] = timed(lambda: pipeline.run_pipeline())
+        if store_kind == 'sqlite':
+            pipeline.store.close()
+
+    return times
+
+
+def bench(shape: str, n: int, payload_size: int, store_kind: str, repeat: int, env: dict):
+
+    samples = [measure(shape, n, payload_size, store_kind) for _ in range(repeat)]
+    for operation in samples[0]:
+        seconds = min(sample[operation] for sample in samples)
+        yield {'benchmark': 'framework', 'shape': shape, **describe(shape, n), 'payload_bytes': payload_size,
+               'store': store_kind, 'operation': operation, 'seconds': seconds, 'us_per_task': 1e6 * seconds / n,
+               'repeat': repeat, **env}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10, 100, 1000, 10000],
+                        help='Numbers of tasks for the size sweep; 100000 is supported but slow.')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    parser.add_argument('--payloads', type=int, nargs='*', default=[8, 2 ** 20, 100 * 2 ** 20],
+                        help='Payload sizes in bytes for the payload sweep.')
+    parser.add_argument('--payload-tasks', type=int, default=10,
+                        help='The number of tasks of the pipeline used for the payload sweep.')
+    parser.add_argument('--stores', nargs='+', choices=['file', 'sqlite'], default=['file'],
+                        help='The stores in which to cache the results.')
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many repetitions.')
+    parser.add_argument('--output', type=Path, help='A file to which to append the results.')
+    args = parser.parse_args()
+
+    env = environment()
+    output = open(args.output, 'a') if args.output else None
+    try:
+        runs = [(shape, n, 0, store) for n in args.sizes for shape in args.shapes for store in args.stores]
+        runs += [('diamond', args.payload_tasks, payload, store) for payload in args.payloads for store in args.stores]
+        for shape, n, payload, store in runs:
+            for record in bench(shape, n, payload, store, args.repeat, env):
+                line = json.dumps(record)
+                print(line, flush=True)
+                if output:
+                    output.write(line + '\n')
+                    output.flush()
+    finally:
+        if output:
+            output.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Compare the makespan of synthetic pipelines when ready tasks are prioritized by their remaining
+critical path and when they are taken in execution order, at a fixed number of workers.
+
+Every task sleeps for a random duration, drawn from a heavy-tailed distribution so that a few tasks
+dominate, as they tend to in real pipelines. Besides the shapes of `shapes.py`, the `gated` shape has
+half of its tasks independent of everything, and the other half depending on a single long task that
+comes last among them in execution order. Each pipeline is first run once to record the durations of
+its tasks, and is then rerun with every task forced to execute under each priority.
+
+The pipeline itself spends a few milliseconds on every task, so tasks should take a lot longer than
+that for the order in which they start to matter.
+
+Usage: python benchmarks/bench_priority.py [--tasks 40] [--workers 4] [--shapes wide gated] [--seeds 0 1 2]
+
+Each measurement is written to stdout as one JSON object per line, along with two lower bounds on the
+makespan: the critical path, and the total duration divided by the number of workers.
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import tempfile
+import time
+
+from pathlib import Path
+
+from yenta.config import settings
+from yenta.pipeline import Pipeline, TaskResult
+from yenta.pipeline.critical_path import critical_path
+from yenta.tasks import task
+
+from shapes import SHAPES, dependencies, task_name
+
+GATED = 'gated'
+
+
+def gated_dependencies(n: int) -> list:
+
+    gate = n // 2
+    return [[] if i <= gate else [gate] for i in range(n)]
+
+
+def make_tasks(shape: str, n: int, seed: int, scale: float):
+
+    rng = random.Random(seed)
+    durations = {task_name(i): scale * min(rng.paretovariate(1.5), 20) for i in range(n)}
+    if shape == GATED:
+        durations[task_name(n // 2)] = 20 * scale
+    deps = gated_dependencies(n) if shape == GATED else dependencies(shape, n, seed)
+
+    def make_task(i, depends_on):
+
+        def body():
+            time.sleep(durations[task_name(i)])
+            return TaskResult({'i': i})
+
+        body.__name__ = task_name(i)
+        return task(body, depends_on=[task_name(d) for d in depends_on] or None)
+
+    return [make_task(i, depends_on) for i, depends_on in enumerate(deps)], durations
+
+
+def bench(shape: str, n: int, seed: int, workers: int, scale: float, repeat: int) -> dict:
+
+    with tempfile.TemporaryDirectory() as store, contextlib.redirect_stdout(io.StringIO()):
+        settings.YENTA_STORE_PATH = Path(store)
+        tasks, durations = make_tasks(shape, n, seed, scale)
+        pipeline = Pipeline(*tasks, name='bench')
+        names = list(durations)
+
+        # record the durations that the critical path priority is estimated from
+        pipeline.run_pipeline(max_workers=workers, priority='order')
+
+        makespans = {}
+        for priority in ['order', 'critical-path']:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                pipeline.run_pipeline(force_rerun=names, max_workers=workers, priority=priority)
+                times.append(time.perf_counter() - start)
+            makespans[priority] = min(times)
+
+    bound = critical_path(pipeline.task_graph, durations).makespan
+    return {'benchmark': 'priority', 'shape': shape, 'tasks': n, 'seed': seed, 'workers': workers,
+            'order_s': makespans['order'], 'critical_path_s': makespans['critical-path'],
+            'speedup': makespans['order'] / makespans['critical-path'],
+            'critical_path_bound_s': bound, 'work_bound_s': sum(durations.values()) / workers}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--shapes', nargs='+', default=['wide', 'random', GATED], choices=SHAPES + [GATED])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--scale', type=float, default=0.05, help='The shortest duration of a task, in seconds.')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    for shape in args.shapes:
+        for seed in args.seeds:
+            print(json.dumps(bench(shape, args.tasks, seed, args.workers, args.scale, args.repeat)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
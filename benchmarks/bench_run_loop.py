@@ -0,0 +1,60 @@
+"""Measure the per-task overhead of `Pipeline.run_pipeline` as the number of tasks grows.
+
+Every task has a trivial body, so the time per task is the overhead of the framework:
+scheduling, fingerprinting and caching. It should stay roughly flat as the pipeline grows.
+
+Usage: python benchmarks/bench_run_loop.py [--sizes 100 1000 10000] [--shape wide|chain|diamond|random]
+
+Each measurement is written to stdout as one JSON object per line.
+"""
+import argparse
+import contextlib
+import io
+import json
+import tempfile
+import time
+
+from pathlib import Path
+
+from yenta.config import settings
+from yenta.pipeline import Pipeline
+
+from shapes import SHAPES, make_tasks
+
+
+def bench(n: int, shape: str) -> dict:
+
+    with tempfile.TemporaryDirectory() as store, contextlib.redirect_stdout(io.StringIO()):
+        settings.YENTA_STORE_PATH = Path(store)
+        tasks = make_tasks(shape, n)
+
+        start = time.perf_counter()
+        pipeline = Pipeline(*tasks, name='bench')
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pipeline.run_pipeline()
+        first_run = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pipeline.run_pipeline()
+        reuse_run = time.perf_counter() - start
+
+    return {'benchmark': 'run_loop', 'shape': shape, 'tasks': n,
+            'build_s': build, 'run_s': first_run, 'reuse_s': reuse_run,
+            'run_us_per_task': 1e6 * first_run / n, 'reuse_us_per_task': 1e6 * reuse_run / n}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 20000])
+    parser.add_argument('--shape', choices=SHAPES, default='wide')
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        print(json.dumps(bench(n, args.shape)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
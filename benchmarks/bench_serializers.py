@@ -0,0 +1,66 @@
+"""Compare how quickly each serializer writes and reads a task result holding large numpy arrays.
+
+The result is written to the store in the same way as `Pipeline.cache_result` writes it, and read back with a
+`FilePartReader`, so the numbers include the file system but not fingerprinting.
+
+Usage: python benchmarks/bench_serializers.py [--megabytes 10 100 500] [--arrays 1] [--repeat 3]
+
+Each measurement is written to stdout as one JSON object per line.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+from yenta.pipeline import TaskResult
+from yenta.store import FilePartReader, SERIALIZERS
+from yenta.utils.files import atomic_write
+
+
+def bench(name: str, megabytes: int, arrays: int, repeat: int) -> dict:
+
+    serializer = SERIALIZERS[name]
+    size = megabytes * 2 ** 20 // 8 // arrays
+    rng = np.random.default_rng(0)
+    result = TaskResult({f'array_{i}': rng.random(size) for i in range(arrays)})
+
+    dump_times, load_times = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parts = serializer.dumps(result)
+            for part, chunks in parts.items():
+                atomic_write(directory / part, chunks)
+            dump_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            loaded = serializer.loads(FilePartReader(directory, list(parts)))
+            load_times.append(time.perf_counter() - start)
+            del loaded
+
+    dump, load = min(dump_times), min(load_times)
+    return {'benchmark': 'serializers', 'serializer': name, 'megabytes': megabytes, 'arrays': arrays,
+            'dump_s': dump, 'load_s': load, 'dump_mb_s': megabytes / dump, 'load_mb_s': megabytes / load}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--arrays', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--serializers', nargs='+', default=['pickle', 'pickle5', 'npy'], choices=list(SERIALIZERS))
+    args = parser.parse_args()
+
+    for megabytes in args.megabytes:
+        for name in args.serializers:
+            print(json.dumps(bench(name, megabytes, args.arrays, args.repeat)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
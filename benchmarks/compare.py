@@ -0,0 +1,65 @@
+"""Compare two sets of benchmark results, as written by the benchmarks in this directory, and report
+the measurements that got slower.
+
+Usage: python benchmarks/compare.py baseline.jsonl current.jsonl [--metric seconds] [--threshold 1.2]
+
+Records are matched on all of their fields except the measurements themselves (any floating point field)
+and the description of the environment. If a file holds several records for the same measurement, the
+last one is used. Exits with status 1 if any measurement is slower than the baseline by more than
+`--threshold` times.
+"""
+import argparse
+import json
+import sys
+
+from pathlib import Path
+
+
+ENVIRONMENT_FIELDS = {'commit', 'python', 'platform', 'date', 'repeat'}
+
+
+def load(path: Path, metric: str) -> dict:
+
+    records = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if metric not in record:
+                continue
+            key = tuple(sorted((name, value) for name, value in record.items()
+                               if name not in ENVIRONMENT_FIELDS and not isinstance(value, float)))
+            records[key] = record[metric]
+    return records
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline', type=Path)
+    parser.add_argument('current', type=Path)
+    parser.add_argument('--metric', default='seconds', help='The field to compare.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Report measurements slower than the baseline by more than this factor.')
+    args = parser.parse_args()
+
+    baseline = load(args.baseline, args.metric)
+    current = load(args.current, args.metric)
+
+    regressions = 0
+    for key in sorted(baseline.keys() & current.keys()):
+        ratio = current[key] / baseline[key] if baseline[key] > 0 else float('inf')
+        if ratio > args.threshold:
+            regressions += 1
+        status = 'SLOWER' if ratio > args.threshold else 'faster' if ratio < 1 / args.threshold else 'same'
+        print(json.dumps({**dict(key), 'baseline': baseline[key], 'current': current[key],
+                          'ratio': ratio, 'status': status}))
+
+    print(f'{regressions} of {len(baseline.keys() & current.keys())} measurements are more than '
+          f'{args.threshold}x slower', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
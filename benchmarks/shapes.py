@@ -0,0 +1,95 @@
+"""Synthetic pipelines for the benchmarks, built with the `task` decorator.
+
+Every task has a trivial body that returns the same, preallocated payload, so that timing a pipeline
+measures the overhead of the framework rather than the work of the tasks.
+"""
+import random
+
+from typing import Callable, Dict, List, Optional
+
+from yenta.pipeline import TaskResult
+from yenta.tasks import task
+
+
+SHAPES = ['wide', 'chain', 'diamond', 'random']
+
+
+def make_payload(size: int):
+    """ A payload of `size` bytes: a NumPy array if NumPy is available, since that is what large
+        task results usually are, and otherwise a bytes object. """
+
+    try:
+        import numpy as np
+        return np.zeros(size, dtype=np.uint8)
+    except ImportError:
+        return bytes(size)
+
+
+def task_name(i: int) -> str:
+
+    return f'task_{i:06d}'
+
+
+def dependencies(shape: str, n: int, seed: int = 0, width: int = 4, max_parents: int = 3) -> List[List[int]]:
+    """ The indices of the dependencies of every task of a pipeline of a given shape.
+
+    :param str shape: `wide` (independent tasks), `chain` (each task depends on the previous one),
+        `diamond` (a chain of diamonds: one task fans out to `width` tasks, which fan back in to the
+        next), or `random` (each task depends on up to `max_parents` random earlier tasks).
+    :param int n: The number of tasks.
+    :param int seed: The seed for random shapes.
+    :param int width: The width of each diamond.
+    :param int max_parents: The maximum number of dependencies of a task of a random pipeline.
+    :return: A list whose i-th element lists the indices of the dependencies of task i.
+    """
+
+    if shape == 'wide':
+        return [[] for _ in range(n)]
+    elif shape == 'chain':
+        return [[i - 1] if i > 0 else [] for i in range(n)]
+    elif shape == 'diamond':
+        deps = []
+        for i in range(n):
+            position = i % (width + 1)
+            hub = i - position
+            if position == 0:
+                # the hub of each diamond joins all of the tasks of the previous one
+                deps.append(list(range(max(hub - width, 0), hub)))
+            else:
+                deps.append([hub])
+        return deps
+    elif shape == 'random':
+        rng = random.Random(seed)
+        return [sorted(rng.sample(range(i), min(i, rng.randint(0, max_parents)))) for i in range(n)]
+    else:
+        raise ValueError(f'Unknown shape {shape}, expected one of: {", ".join(SHAPES)}')
+
+
+def make_tasks(shape: str, n: int, payload_size: int = 0, seed: int = 0) -> List[Callable]:
+    """ Build a synthetic pipeline.
+
+    :param str shape: The shape of the pipeline, see `dependencies`.
+    :param int n: The number of tasks.
+    :param int payload_size: The size in bytes of the value returned by every task.
+    :param int seed: The seed for random shapes.
+    :return: The tasks.
+    """
+
+    payload = make_payload(payload_size) if payload_size else None
+
+    def make_task(i: int, depends_on: Optional[List[int]]):
+
+        def body():
+            return TaskResult({'i': i, 'payload': payload})
+
+        body.__name__ = task_name(i)
+        return task(body, depends_on=[task_name(d) for d in depends_on] or None)
+
+    return [make_task(i, deps) for i, deps in enumerate(dependencies(shape, n, seed))]
+
+
+def describe(shape: str, n: int, seed: int = 0) -> Dict[str, int]:
+    """ Summarize the shape of a synthetic pipeline, for the benchmark records. """
+
+    deps = dependencies(shape, n, seed)
+    return {'tasks': n, 'edges': sum(len(d) for d in deps)}
@@ -0,0 +1,24 @@
+import os
+
+from yenta.tasks.Task import task
+from yenta.pipeline.Pipeline import TaskResult
+
+
+@task(executor='process')
+def squares():
+    return TaskResult({'squares': [i * i for i in range(10)], 'pid': os.getpid()})
+
+
+@task(executor='process')
+def cubes():
+    return TaskResult({'cubes': [i * i * i for i in range(10)], 'pid': os.getpid()})
+
+
+@task(depends_on=['squares', 'cubes'], executor='process')
+def total(squares: 'squares__values__squares', cubes: 'cubes__values__cubes'):
+    return TaskResult({'total': sum(squares) + sum(cubes), 'pid': os.getpid()})
+
+
+@task(executor='process')
+def broken():
+    raise ValueError('broken in a worker')
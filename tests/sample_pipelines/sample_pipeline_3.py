@@ -0,0 +1,21 @@
+import os
+
+from pathlib import Path
+
+from yenta.tasks.Task import task
+from yenta.pipeline.Pipeline import TaskResult
+
+
+@task
+def flaky():
+    # the first worker to execute this task dies
+    marker = Path('tests/tmp/pipeline/crashed')
+    if not marker.exists():
+        marker.mkdir(parents=True)
+        os._exit(1)
+    return TaskResult({'pid': os.getpid()})
+
+
+@task
+def doomed():
+    os._exit(1)
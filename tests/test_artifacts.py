@@ -1,9 +1,11 @@
+import pytest
 import string
 
 from datetime import datetime
 from pathlib import Path
 
-from yenta.artifacts import Artifact, FileArtifact
+from yenta.artifacts import Artifact, FileArtifact, DirectoryArtifact, InvalidArtifactError
+from yenta.config import settings
 
 
 def test_artifact_equality():
@@ -42,3 +44,78 @@ def test_file_artifact_hash():
 
     output_file.unlink()
 
+
+def test_file_artifact_hash_algorithm(monkeypatch):
+
+    output_file = Path('tests').resolve() / 'tmp' / 'artifact.test'
+
+    with open(output_file, 'w') as f:
+        f.write('some nice data')
+
+    art = FileArtifact(location=output_file)
+    assert art.hash_algorithm == 'sha1'
+    assert art.hash == '6a52cbb539857eb8c7353cadda0054996dea6de8'
+
+    art = FileArtifact(location=output_file, hash_algorithm='blake2b')
+    assert len(art.hash) == 128
+
+    monkeypatch.setattr(settings, 'YENTA_HASH_ALGORITHM', 'sha256')
+    art = FileArtifact(location=output_file)
+    assert art.hash_algorithm == 'sha256'
+    assert art.hash == 'e45f194049324c17c154b00cd99888e7739d41a57b50c5fcc9b19f3b8e5cd063'
+
+    with pytest.raises(InvalidArtifactError):
+        FileArtifact(location=output_file, hash_algorithm='crc1')
+
+    output_file.unlink()
+
+
+def test_directory_artifact_hash(monkeypatch):
+
+    import os
+    import shutil
+    import yenta.utils.files as files
+
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', Path('tests/tmp/pipeline'))
+    output_dir = Path('tests').resolve() / 'tmp' / 'shards'
+    (output_dir / 'sub').mkdir(parents=True)
+    for i in range(5):
+        (output_dir / f'shard-{i}').write_text(f'shard {i}')
+    (output_dir / 'sub' / 'nested').write_text('nested')
+    for path in output_dir.rglob('*'):
+        os.utime(path, ns=(0, 10 ** 18))
+
+    hashed = []
+    file_hash = files.file_hash
+    monkeypatch.setattr(files, 'file_hash', lambda path, **kwargs: hashed.append(path) or file_hash(path, **kwargs))
+
+    art1 = DirectoryArtifact(location=output_dir)
+    assert art1.hash is not None
+    assert len(hashed) == 6
+    assert FileArtifact(location=output_dir).hash is None
+
+    # unchanged files are not read again
+    art2 = DirectoryArtifact(location=output_dir)
+    assert art2.hash == art1.hash
+    assert len(hashed) == 6
+
+    (output_dir / 'sub' / 'nested').write_text('changed')
+    art3 = DirectoryArtifact(location=output_dir)
+    assert art3.hash != art1.hash
+    assert hashed[6:] == [output_dir / 'sub' / 'nested']
+
+    # renaming a file changes the hash, even though no contents changed
+    (output_dir / 'sub' / 'nested').rename(output_dir / 'sub' / 'renamed')
+    assert DirectoryArtifact(location=output_dir).hash != art3.hash
+
+    # dangling symbolic links are hashed by their target
+    art4 = DirectoryArtifact(location=output_dir)
+    (output_dir / 'missing').symlink_to(output_dir / 'nowhere')
+    art5 = DirectoryArtifact(location=output_dir)
+    assert art5.hash != art4.hash
+    (output_dir / 'missing').unlink()
+    (output_dir / 'missing').symlink_to(output_dir / 'elsewhere')
+    assert DirectoryArtifact(location=output_dir).hash != art5.hash
+
+    shutil.rmtree(output_dir)
+    shutil.rmtree(settings.YENTA_STORE_PATH / '.hash_cache')
@@ -4,6 +4,7 @@
 
 import pytest
 import json
+import os
 import shutil
 
 from pathlib import Path
@@ -54,7 +55,7 @@ def test_list_tasks(store_path):
     runner = CliRunner()
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline', store_path, 'list-tasks'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'list-tasks'])
 
     output_lines = result.output.split('\n')
     assert result.exit_code == 0
@@ -69,7 +70,7 @@ def test_run_tasks(store_path):
     runner = CliRunner()
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline', store_path, 'run'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
 
     assert result.exit_code == 0
 
@@ -80,7 +81,7 @@ def test_run_tasks(store_path):
     assert output_lines[ind + 1] == 'hello from foo task'
     assert output_lines[ind + 2] == '[\u2714] foo'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline', store_path, 'run'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
 
     # bar still errors, foo recycles the old value, baz still not called
     output_lines = result.output.split('\n')
@@ -88,7 +89,7 @@ def test_run_tasks(store_path):
     assert ind >= 0
     assert output_lines[ind + 1] == '[\u2014] foo'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline', store_path, 'list-tasks'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'list-tasks'])
 
     output_lines = result.output.split('\n')
     ind = output_lines.index('The following tasks are available:')
@@ -102,7 +103,7 @@ def test_show_config(store_path):
     runner = CliRunner()
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline', store_path, 'show-config'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'show-config'])
 
     output_lines = result.output.split('\n')
     assert output_lines[0] == 'Yenta is using the following configuration:'
@@ -118,21 +119,21 @@ def test_task_info(store_path):
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'task-info', 'nonexistent-task'])
 
     assert result.exit_code == 0
     assert result.output == 'Unknown task nonexistent-task specified.\n'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'run'])
 
     assert result.exit_code == 0
     assert Path(store_path / 'default').exists()
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'task-info', 'foo'])
 
     output_lines = result.output.split('\n')
@@ -141,7 +142,7 @@ def test_task_info(store_path):
     assert output_lines[2] == 'Previous status: \u2714'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'task-info', 'bar'])
 
     output_lines = result.output.split('\n')
@@ -150,7 +151,7 @@ def test_task_info(store_path):
     assert output_lines[2] == 'Previous status: \u2718 oh noes'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'task-info', 'baz'])
 
     output_lines = result.output.split('\n')
@@ -165,14 +166,14 @@ def test_rm_task(store_path):
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'run'])
 
     assert result.exit_code == 0
     assert Path(store_path / 'default').exists()
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'rm', 'foo'])
 
     assert result.exit_code == 0
@@ -186,28 +187,301 @@ def test_rm_task(store_path):
     assert 'foo' in str(ex.value)
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', store_path,
+                                       '--pipeline-store', store_path,
                                        'rm', 'nonexistent-task'])
 
     assert result.exit_code == 0
     assert result.output == 'Unknown task nonexistent-task specified.\n'
 
 
-def test_dump_task_graph():
+def test_dump_task_graph(store_path):
 
     runner = CliRunner()
     entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
-    pipeline_store = 'tests/sample_pipelines/sample_pipeline_1.json'
-    if Path(pipeline_store).exists():
-        Path(pipeline_store).unlink()
 
     task_graph = 'tests/sample_pipelines/sample_task_graph.png'
 
     result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
-                                       '--pipeline', pipeline_store,
+                                       '--pipeline-store', store_path,
                                        'dump-task-graph', task_graph])
 
     assert result.exit_code == 0
     assert Path(task_graph).exists()
 
     Path(task_graph).unlink()
+
+
+def test_run_process_tasks(store_path):
+
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_2.py'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point,
+                                       '--pipeline-store', store_path,
+                                       'run', '--processes', '2', '--resources', 'cpu=2,mem_gb=0.5'])
+
+    assert result.exit_code == 0
+    output_lines = result.output.split('\n')
+    assert '[✔] squares' in output_lines
+    assert '[✔] cubes' in output_lines
+    assert '[✔] total' in output_lines
+    assert '[✘] broken' in output_lines
+
+    pipeline = Pipeline.load_pipeline(store_path / 'default')
+    assert pipeline.values('total', 'total') == 285 + 2025
+    assert pipeline.values('total', 'pid') != os.getpid()
+    assert pipeline.task_results['broken'].error == 'broken in a worker'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'run', '--resources', 'cpu=many'])
+    assert result.exit_code != 0
+    assert 'expected resource=amount, got cpu=many' in result.output
+
+
+def test_profile(store_path):
+
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_2.py'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'profile'])
+    assert result.exit_code == 0
+    assert 'No runs of pipeline default have been recorded.' in result.output
+
+    for _ in range(2):
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                           'run', '--processes', '2', '--profile-memory'])
+        assert result.exit_code == 0
+
+    runs = Pipeline.load_runs(store_path / 'default')
+    assert len(runs) == 2
+    assert runs[0]['tasks']['squares']['reused'] is False
+    assert runs[0]['tasks']['squares']['peak_memory'] is not None
+    assert runs[1]['tasks']['squares']['reused'] is True
+    assert runs[1]['tasks']['broken']['status'] == 'failure'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'profile', '--runs', '2', '--sort-by', 'queued'])
+    assert result.exit_code == 0
+    assert 'Task profiles over the last 2 runs of default' in result.output
+    for task_name in ['squares', 'cubes', 'total', 'broken']:
+        assert task_name in result.output
+
+
+def test_critical_path(store_path):
+
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_2.py'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'critical-path'])
+    assert result.exit_code == 0
+    assert 'No runs of pipeline default have been recorded.' in result.output
+
+    (store_path / 'default').mkdir(parents=True, exist_ok=True)
+    run = {'started': '2021-01-01T00:00:00', 'wall_time': 6.0,
+           'tasks': {'squares': {'status': 'success', 'wall_time': 2.0, 'reused': False},
+                     'cubes': {'status': 'success', 'wall_time': 3.0, 'reused': False},
+                     'total': {'status': 'success', 'wall_time': 1.0, 'reused': False}}}
+    with open(store_path / 'default' / 'runs.jsonl', 'w') as f:
+        f.write(json.dumps(run) + '\n')
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'critical-path'])
+    assert result.exit_code == 0
+    assert 'Critical path: cubes -> total' in result.output
+    assert 'Makespan lower bound: 4.00s' in result.output
+    assert 'Tasks without recorded durations are assumed to take no time.' in result.output
+
+    dot_file = store_path / 'graph.dot'
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'dump-task-graph', str(dot_file), '--annotate'])
+    assert result.exit_code == 0
+    dot = dot_file.read_text()
+    assert 'cubes -> total' in dot and 'color=red' in dot
+    assert 'squares\\n2.00s\\nslack 1.00s' in dot
+    assert 'broken\\nno data' in dot
+    dot_file.unlink()
+
+
+def test_task_graph_cache(store_path):
+
+    runner = CliRunner()
+    entry_point = store_path / 'entry_point.py'
+    store_path.mkdir(parents=True, exist_ok=True)
+    shutil.copy('tests/sample_pipelines/sample_pipeline_1.py', entry_point)
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'list-tasks'])
+    assert result.exit_code == 0
+    assert len(list((store_path / '.graph_cache').iterdir())) == 1
+
+    with open(entry_point, 'a') as f:
+        f.write('\n\n@task(depends_on=["baz"])\ndef qux():\n'
+                '    return TaskResult({})\n')
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'list-tasks'])
+    assert result.exit_code == 0
+    assert result.output.split('\n')[4] == '[ ] qux'
+    entry_point.unlink()
+
+
+def test_ignore_task(store_path):
+
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'task-info', 'foo'])
+    assert "result: 'hello world'" in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'ignore', 'foo'])
+    assert result.exit_code == 0
+    assert not (store_path / 'default' / 'foo' / '.ignore').exists()
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'list-tasks'])
+    output_lines = result.output.split('\n')
+    assert output_lines[1] == '[ ] foo'
+    assert output_lines[2] == '[✘] bar'
+    assert 'foo' not in Pipeline.load_pipeline(store_path / 'default').task_results
+
+
+def test_migrate(store_path, monkeypatch):
+
+    monkeypatch.setattr(settings, 'YENTA_STORE_URL', None)
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
+    database = f'sqlite:///{store_path}/sqlite/cache.db'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'migrate', database])
+    assert result.exit_code == 0
+    assert 'Copied 2 cached results of pipeline default' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', database, 'list-tasks'])
+    assert result.exit_code == 0
+    output_lines = result.output.split('\n')
+    assert output_lines[1] == '[✔] foo'
+    assert output_lines[2] == '[✘] bar'
+    assert settings.YENTA_STORE_URL == database
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', database, 'task-info', 'foo'])
+    assert "result: 'hello world'" in result.output
+
+    # the other caches were kept next to the database
+    assert settings.YENTA_STORE_PATH == (store_path / 'sqlite').resolve()
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', store_path)
+
+
+def test_migrate_legacy_layout(store_path, monkeypatch):
+
+    import pickle
+    from yenta.pipeline import TaskResult, TaskStatus
+
+    monkeypatch.setattr(settings, 'YENTA_STORE_URL', None)
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
+    database = f'sqlite:///{store_path}/sqlite/cache.db'
+
+    # the layout written before results had any metadata: a pickled result and the full inputs
+    results = {'foo': TaskResult({'result': 'hello world'}, status=TaskStatus.SUCCESS),
+               'bar': TaskResult(status=TaskStatus.FAILURE, error='oh noes')}
+    for task_name, task_result in results.items():
+        task_path = store_path / 'default' / task_name
+        task_path.mkdir(parents=True)
+        (task_path / 'result.pk').write_bytes(pickle.dumps(task_result))
+        (task_path / 'inputs.pk').write_bytes(pickle.dumps(PipelineResult()))
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'migrate', database])
+    assert result.exit_code == 0
+    assert 'Copied 2 cached results of pipeline default' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', database, 'list-tasks'])
+    output_lines = result.output.split('\n')
+    assert output_lines[1] == '[✔] foo'
+    assert output_lines[2] == '[✘] bar'
+
+    # the migrated result of foo is reused
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', database, 'run'])
+    assert 'hello from foo task' not in result.output
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', store_path)
+
+
+def test_du_and_gc(store_path, monkeypatch):
+
+    monkeypatch.setattr(settings, 'YENTA_STORE_URL', None)
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_1.py'
+
+    for pipeline_name in ['default', 'other']:
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                           'run', '--pipeline-name', pipeline_name])
+        assert result.exit_code == 0
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'du'])
+    assert result.exit_code == 0
+    assert 'default' in result.output and 'other' in result.output
+    assert 'in 4 cached results' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'du', '--pipeline-name', 'other'])
+    assert 'latest run' in result.output
+    assert 'in 2 cached results' in result.output
+
+    # every result was used by the latest run of its pipeline
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'gc', '--budget', '0'])
+    assert 'Evicted 0 cached results' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'run', '--pipeline-name', 'other', '--only', 'foo', '--force-rerun', 'foo'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'gc', '--budget', '0', '--dry-run'])
+    assert 'Would evict other/bar' in result.output
+    assert 'Would evict 1 cached results' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'pin', 'bar', '--pipeline-name', 'other'])
+    assert 'will be protected' in result.output
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'gc', '--budget', '0'])
+    assert 'Evicted 0 cached results' in result.output
+
+    runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                              'pin', 'bar', '--pipeline-name', 'other', '--unpin'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'gc', '--budget', '0'])
+    assert 'Evicted other/bar' in result.output
+    assert not (store_path / 'other' / 'bar').exists()
+    assert 'bar' in Pipeline.load_pipeline(store_path / 'default').task_results
+
+
+def test_coordinator_and_worker(store_path, monkeypatch):
+
+    import socket
+    import subprocess
+    import sys
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    runner = CliRunner()
+    entry_point = 'tests/sample_pipelines/sample_pipeline_2.py'
+    monkeypatch.setattr(settings, 'YENTA_CLUSTER_KEY', 'not-so-secret')
+    worker = subprocess.Popen([sys.executable, '-m', 'yenta.cli', 'worker', '--connect', f'127.0.0.1:{port}'],
+                              stdout=subprocess.PIPE, text=True,
+                              env={**os.environ, 'YENTA_CLUSTER_KEY': 'not-so-secret'})
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'run', '--coordinator', '--listen', f'127.0.0.1:{port}'])
+    assert result.exit_code == 0
+    assert '[✔] total' in result.output.split('\n')
+    assert 'Executed 4 tasks.' in worker.communicate(timeout=10)[0]
+
+    pipeline = Pipeline.load_pipeline(store_path / 'default')
+    assert pipeline.values('total', 'pid') == worker.pid
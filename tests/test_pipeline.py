@@ -1,15 +1,30 @@
+import asyncio
 import json
+import multiprocessing
+import pickle
 import pytest
 import networkx as nx
 import shutil
+import threading
+import time
+import tracemalloc
 
+from copy import copy
 from datetime import datetime
 from pathlib import Path
 
 from yenta.config import settings
-from yenta.tasks.Task import task
-from yenta.pipeline import Pipeline, TaskResult, PipelineResult, InvalidTaskResultError
+from yenta.tasks.Task import task, TaskExecutor
+from yenta.pipeline import (
+    Pipeline, TaskResult, PipelineResult, InvalidTaskResultError, PipelineConfigError, TaskStatus, LazyDict
+)
+from yenta.pipeline.Distributed import Coordinator, DistributedError, run_worker
+from yenta.pipeline.Stream import Stream, StreamError
 from yenta.artifacts import FileArtifact
+from yenta.store import (
+    CacheWriteError, Manifest, SQLiteStore, SharedCache, FileTransport, cache_usage, select_evictions
+)
+from yenta.utils.fingerprint import fingerprint
 
 
 @pytest.fixture
@@ -65,16 +80,25 @@ def test_cache_pipeline_result(store_path):
     task_result = TaskResult({'bar': 2}, {'some_other_file': FileArtifact(location='/some/other/path')})
     previous_result = PipelineResult()
     previous_result.task_results['previous_task'] = task_input
+    inputs = Pipeline.input_fingerprint(previous_result)
 
-    pipeline_result = PipelineResult({'this_task': task_result}, {'previous_task': previous_result})
+    pipeline_result = PipelineResult({'this_task': task_result}, {'this_task': inputs})
     pipeline = Pipeline()
     pipeline.cache_result('this_task', pipeline_result)
 
     result_file = pipeline.store_path / 'this_task' / 'result.pk'
-    input_file = pipeline.store_path / 'this_task' / 'inputs.pk'
+    meta_file = pipeline.store_path / 'this_task' / 'meta.json'
 
     assert result_file.exists()
-    assert input_file.exists()
+    assert meta_file.exists()
+
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+
+    assert meta['inputs'] == inputs
+    assert meta['result'] == fingerprint(task_result)
+    assert meta['serializer'] == 'pickle'
+    assert meta['parts'] == ['result.pk']
 
 
 def test_run_pipeline_with_past_results(store_path):
@@ -279,3 +303,1083 @@ def test_non_serializable_result(store_path):
 
     assert result == cached_result
     assert 'baz' not in cached_result.task_results
+
+
+def test_run_pipeline_in_parallel(store_path):
+
+    barrier = threading.Barrier(2, timeout=5)
+
+    # foo and bar can only both finish if they are running at the same time
+    @task
+    def foo():
+        barrier.wait()
+        return TaskResult({'x': 1})
+
+    @task
+    def bar():
+        barrier.wait()
+        return TaskResult({'y': 2})
+
+    @task(depends_on=['foo', 'bar'])
+    def baz(x: 'foo__values__x', y: 'bar__values__y'):
+        return TaskResult({'sum': x + y})
+
+    pipeline = Pipeline(foo, bar, baz)
+    result = pipeline.run_pipeline(max_workers=2)
+
+    assert result.values('baz', 'sum') == 3
+    assert pipeline._tasks_executed == {'foo', 'bar', 'baz'}
+
+    result = pipeline.run_pipeline(max_workers=2)
+
+    assert result.values('baz', 'sum') == 3
+    assert pipeline._tasks_reused == {'foo', 'bar', 'baz'}
+
+
+def test_run_pipeline_in_parallel_propagates_failures(store_path):
+
+    @task
+    def foo():
+        raise ValueError('foo failed')
+
+    @task
+    def bar():
+        return TaskResult({'y': 2})
+
+    @task(depends_on=['foo', 'bar'])
+    def baz():
+        return TaskResult({'z': 3})
+
+    @task(depends_on=['baz'])
+    def qux():
+        return TaskResult({'w': 4})
+
+    pipeline = Pipeline(foo, bar, baz, qux)
+    result = pipeline.run_pipeline(max_workers=4)
+
+    assert result.task_results['foo'].status == TaskStatus.FAILURE
+    assert result.task_results['foo'].error == 'foo failed'
+    assert result.task_results['bar'].status == TaskStatus.SUCCESS
+    assert 'baz' not in result.task_results
+    assert 'qux' not in result.task_results
+    assert pipeline._tasks_executed == {'bar'}
+
+    with pytest.raises(PipelineConfigError):
+        pipeline.run_pipeline(max_workers=0)
+
+
+def test_run_pipeline_with_resources(store_path):
+
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def make_task(n, mem_gb):
+
+        def work():
+            with lock:
+                running.append(mem_gb)
+                max_running.append(sum(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(mem_gb)
+            return TaskResult({'n': n})
+
+        work.__name__ = f'work_{n}'
+        return task(resources={'mem_gb': mem_gb, 'cpu': 1})(work)
+
+    # the last one needs more than there is, so it has to run alone
+    tasks = [make_task(n, mem_gb) for n, mem_gb in enumerate([16, 16, 16, 4, 4, 64])]
+    pipeline = Pipeline(*tasks)
+    result = pipeline.run_pipeline(max_workers=4, resources={'mem_gb': 20})
+
+    assert pipeline._tasks_executed == {t.task_def.name for t in tasks}
+    assert max(max_running) <= 64
+    assert max(total for total in max_running if total != 64) <= 20
+    assert all(result.task_results[t.task_def.name].profile.queue_time >= 0 for t in tasks)
+    # only one of the large tasks could start right away
+    assert sum(result.task_results[f'work_{n}'].profile.queue_time >= 0.04 for n in range(3)) >= 2
+
+    with pytest.raises(PipelineConfigError):
+        pipeline.run_pipeline(resources={'mem_gb': -1})
+
+
+def test_mapped_tasks(store_path):
+
+    items = [1, 2, 3, 4]
+    calls = []
+
+    @task(pure=False)
+    def listing():
+        return TaskResult({'items': list(items), 'offset': 100})
+
+    @task(map_over='listing__values__items')
+    def square(x):
+        calls.append(x)
+        if x < 0:
+            raise ValueError(f'negative {x}')
+        return TaskResult({'square': x * x})
+
+    @task(map_over='listing__values__items',
+          reduce=lambda results: TaskResult({'total': sum(r.values['shifted'] for r in results)}))
+    def shift(x: 'listing__values__items', offset: 'listing__values__offset'):
+        return TaskResult({'shifted': x + offset})
+
+    pipeline = Pipeline(listing, square, shift)
+    result = pipeline.run_pipeline(max_workers=4)
+
+    assert result.values('square', 'square') == [1, 4, 9, 16]
+    assert result.values('shift', 'total') == 410
+    assert sorted(calls) == [1, 2, 3, 4]
+    assert result.task_results['square'].profile.elements == 4
+    assert result.task_results['square'].profile.elements_reused == 0
+    # the results of the elements are cached on their own, but are not results of the pipeline
+    assert sum(entry.startswith('square[') for entry in pipeline.store.entries()) == 4
+    assert set(Pipeline.load_pipeline(pipeline.store).task_results) == {'listing', 'square', 'shift'}
+    # the elements belong to their task, which the latest run used
+    assert not [result.task for result in select_evictions(cache_usage(store_path), 0) if '[' in result.task]
+
+    # only the changed and the new elements execute
+    calls.clear()
+    items[1] = 20
+    items.append(5)
+    result = pipeline.run_pipeline(max_workers=4)
+
+    assert result.values('square', 'square') == [1, 400, 9, 16, 25]
+    assert result.values('shift', 'total') == 533
+    assert sorted(calls) == [5, 20]
+    assert result.task_results['square'].profile.elements_reused == 3
+    assert sum(entry.startswith('square[') for entry in pipeline.store.entries()) == 5
+
+    calls.clear()
+    pipeline.run_pipeline(force_rerun=['square'])
+    assert sorted(calls) == [1, 3, 4, 5, 20]
+
+    # the elements that succeed are cached even if others fail
+    calls.clear()
+    items[0] = -1
+    result = pipeline.run_pipeline()
+
+    assert result.task_results['square'].status == TaskStatus.FAILURE
+    assert 'the first of them at index 0: negative -1' in result.task_results['square'].error
+    assert calls == [-1]
+
+    calls.clear()
+    items[0] = 1
+    result = pipeline.run_pipeline()
+    assert result.values('square', 'square') == [1, 400, 9, 16, 25]
+    assert calls == [1]
+
+
+def test_mapped_task_resources(store_path):
+
+    running = []
+    most = []
+    lock = threading.Lock()
+
+    @task
+    def listing():
+        return TaskResult({'items': list(range(8))})
+
+    @task(map_over='listing__values__items', resources={'mem_gb': 16})
+    def heavy(x):
+        with lock:
+            running.append(x)
+            most.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(x)
+        return TaskResult({'x': x})
+
+    # the resources are declared per element, so only two elements fit at a time
+    result = Pipeline(listing, heavy).run_pipeline(max_workers=8, resources={'mem_gb': 32})
+    assert result.values('heavy', 'x') == list(range(8))
+    assert max(most) == 2
+
+
+def test_streaming_tasks(store_path):
+
+    np = pytest.importorskip('numpy')
+    events = []
+
+    @task(stream_buffer=1)
+    def produce():
+        for i in range(50):
+            events.append('produced')
+            yield np.full(10000, i, dtype=np.float64)
+
+    @task
+    def consume(chunks: 'produce__stream'):
+        total = 0
+        for chunk in chunks:
+            events.append('consumed')
+            total += chunk.sum()
+        return TaskResult({'total': float(total)})
+
+    @task(depends_on=['produce'])
+    def count(previous):
+        return TaskResult({'offset': 1})
+
+    @task(depends_on=['count'])
+    def late(chunks: 'produce__stream', offset: 'count__values__offset'):
+        return TaskResult({'chunks': sum(1 for _ in chunks) + offset})
+
+    pipeline = Pipeline(produce, consume, count, late)
+    tracemalloc.start()
+    result = pipeline.run_pipeline(max_workers=1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert result.values('consume', 'total') == 10000 * sum(range(50))
+    assert result.values('produce', 'chunks') == 50
+    # the task that waits for another one reads the chunks back from the cache
+    assert result.values('late', 'chunks') == 51
+    # the consumer keeps up with the stream, which is never held in memory as a whole
+    assert events.index('consumed') < events.index('produced', 10)
+    assert peak < 50 * 10000 * 8 / 4
+
+    # since the chunks were cached, the whole stream can be reused
+    result = pipeline.run_pipeline()
+    assert pipeline._tasks_reused == {'produce', 'consume', 'count', 'late'}
+
+    @task
+    def fail():
+        yield 1
+        raise ValueError('no more chunks')
+
+    @task
+    def drain(chunks: 'fail__stream'):
+        return TaskResult({'chunks': len(list(chunks))})
+
+    result = Pipeline(fail, drain, name='failing').run_pipeline()
+    assert result.task_results['fail'].status == TaskStatus.FAILURE
+    assert result.task_results['drain'].status == TaskStatus.FAILURE
+    assert 'no more chunks' in result.task_results['drain'].error
+
+    # iterating over a failed stream again raises the failure again instead of waiting for more chunks
+    stream = Stream('fail', 1)
+    stream.fail(ValueError('no more chunks'))
+    for _ in range(2):
+        with pytest.raises(StreamError):
+            list(stream)
+
+
+def test_chained_streaming_tasks(store_path):
+
+    events = []
+
+    @task
+    def source():
+        for i in range(20):
+            events.append('source')
+            yield i
+
+    @task
+    def double(chunks: 'source__stream'):
+        for chunk in chunks:
+            events.append('double')
+            yield 2 * chunk
+
+    @task
+    def total(chunks: 'double__stream'):
+        return TaskResult({'total': sum(chunks)})
+
+    pipeline = Pipeline(source, double, total)
+    result = pipeline.run_pipeline()
+
+    # every stage starts with the stage before it, so no chunk is cached along the way
+    assert result.values('total', 'total') == 380
+    assert events.index('double') < events.index('source', 10)
+    assert not [entry for entry in pipeline.store.entries() if '[' in entry]
+
+
+def test_run_pipeline_with_async_tasks(store_path):
+
+    in_flight = []
+    max_in_flight = []
+
+    def make_fetcher(n):
+
+        async def fetch():
+            in_flight.append(n)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(n)
+            return TaskResult({'n': n})
+
+        fetch.__name__ = f'fetch_{n}'
+        return task(fetch)
+
+    fetchers = [make_fetcher(n) for n in range(20)]
+
+    @task(depends_on=[f.task_def.name for f in fetchers])
+    def total(previous_results: PipelineResult):
+        return TaskResult({'total': sum(r.values['n'] for r in previous_results.task_results.values())})
+
+    @task(depends_on=['total'])
+    async def double(previous_results: PipelineResult):
+        await asyncio.sleep(0)
+        return TaskResult({'double': 2 * previous_results.values('total', 'total')})
+
+    assert double.task_def.executor == TaskExecutor.ASYNC
+
+    pipeline = Pipeline(*fetchers, total, double)
+    result = asyncio.run(pipeline.arun_pipeline())
+
+    assert result.values('double', 'double') == 2 * sum(range(20))
+    # all of the fetchers were waiting on the event loop at the same time
+    assert max(max_in_flight) == 20
+
+    result = pipeline.run_pipeline()
+    assert result.values('double', 'double') == 2 * sum(range(20))
+    assert pipeline._tasks_reused == {f.task_def.name for f in fetchers} | {'total', 'double'}
+
+    async def notebook_cell():
+        return pipeline.run_pipeline()
+
+    # the synchronous wrapper also works from inside a running event loop
+    result = asyncio.run(notebook_cell())
+    assert result.values('double', 'double') == 2 * sum(range(20))
+
+
+def test_load_pipeline_lazily(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1})
+
+    @task
+    def bar():
+        return TaskResult({'y': 2})
+
+    @task(depends_on=['foo'])
+    def baz(previous_results: PipelineResult):
+        return TaskResult({'z': previous_results.values('foo', 'x') + 1})
+
+    pipeline = Pipeline(foo, bar, baz)
+    pipeline.run_pipeline()
+
+    # a cache entry that can no longer be unpickled must not matter unless it is needed
+    with open(pipeline.store_path / 'bar' / 'result.pk', 'wb') as f:
+        f.write(b'garbage')
+
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert set(cached.task_results) == {'foo', 'bar', 'baz'}
+    assert not any(cached.task_results.is_loaded(name) for name in cached.task_results)
+
+    assert cached.values('foo', 'x') == 1
+    assert cached.task_results.is_loaded('foo')
+    assert not cached.task_results.is_loaded('bar')
+
+    with pytest.raises(pickle.UnpicklingError):
+        _ = cached.task_results['bar']
+
+    result = pipeline.run_pipeline(only='baz')
+    assert pipeline._tasks_reused == {'foo', 'baz'}
+    # reusing results only reads their statuses and fingerprints from the index
+    assert not any(result.task_results.is_loaded(name) for name in result.task_results)
+    assert result.values('baz', 'z') == 2
+    assert result.task_results['baz'].profile.reused
+    assert Pipeline.load_runs(pipeline.store)[-1]['tasks']['foo']['reused']
+
+
+def test_lazy_dict():
+
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return 'value'
+
+    d = LazyDict({'a': 1})
+    d.defer('b', loader)
+
+    assert 'b' in d
+    assert list(d) == ['a', 'b']
+    assert loads == []
+
+    d2 = copy(d)
+    assert d2['b'] == 'value'
+    assert d['b'] == 'value'
+    assert loads == [1]
+
+    assert d == {'a': 1, 'b': 'value'}
+
+
+def test_reuse_by_fingerprint(store_path):
+
+    data = {'x': list(range(1000))}
+
+    @task
+    def foo():
+        return TaskResult({'x': data['x']})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'total': sum(previous_results.values('foo', 'x'))})
+
+    pipeline = Pipeline(foo, bar)
+    pipeline.run_pipeline()
+    assert pipeline._tasks_executed == {'foo', 'bar'}
+
+    # foo is impure in practice, so force it to rerun; it produces the same value, so bar is reused
+    pipeline.run_pipeline(force_rerun=['foo'])
+    assert pipeline._tasks_executed == {'foo'}
+    assert pipeline._tasks_reused == {'bar'}
+
+    # the cache does not hold a copy of the upstream data
+    assert not (pipeline.store_path / 'bar' / 'inputs.pk').exists()
+    assert (pipeline.store_path / 'bar' / 'meta.json').stat().st_size < 200
+
+    data['x'] = list(range(10))
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert pipeline._tasks_executed == {'foo', 'bar'}
+    assert result.values('bar', 'total') == 45
+
+
+def test_run_pipeline_updates_state_incrementally(store_path, monkeypatch):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1})
+
+    @task
+    def bar():
+        return TaskResult({'y': 2})
+
+    @task(depends_on=['foo'])
+    def baz(previous_results: PipelineResult):
+        return TaskResult({'z': previous_results.values('foo', 'x') + 1})
+
+    pipeline = Pipeline(foo, bar, baz)
+    pipeline.run_pipeline()
+
+    merges = []
+    merge = Pipeline.merge_pipeline_results
+    monkeypatch.setattr(Pipeline, 'merge_pipeline_results',
+                        staticmethod(lambda res1, res2: merges.append(1) or merge(res1, res2)))
+
+    # tasks outside the selection keep their previous results, new results overwrite old ones
+    result = pipeline.run_pipeline(only='baz', force_rerun=['foo', 'baz'])
+    assert len(merges) == 1
+    assert set(result.task_results) == {'foo', 'bar', 'baz'}
+    assert result.values('bar', 'y') == 2
+    assert result.values('baz', 'z') == 2
+    assert pipeline._tasks_executed == {'foo', 'baz'}
+
+    # selecting a task that does not exist runs nothing
+    with pytest.raises(PipelineConfigError):
+        pipeline.run_pipeline(only='qux')
+    with pytest.raises(PipelineConfigError):
+        pipeline.run_pipeline(up_to='qux')
+    assert pipeline._tasks_executed == set()
+
+
+def test_write_behind_cache(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'y': previous_results.values('foo', 'x') + 1})
+
+    pipeline = Pipeline(foo, bar, write_behind=True, max_pending_writes=1)
+    result = pipeline.run_pipeline()
+
+    # run_pipeline does not return before everything has been written
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached == result
+    assert not list(pipeline.store_path.glob('*/*.tmp'))
+
+    pipeline.run_pipeline()
+    assert pipeline._tasks_reused == {'foo', 'bar'}
+
+
+def test_write_behind_cache_errors(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1})
+
+    pipeline = Pipeline(foo, write_behind=True)
+
+    # the cache directory of the task is blocked by a file
+    (pipeline.store_path / 'foo').touch()
+
+    with pytest.raises(CacheWriteError) as ex:
+        pipeline.run_pipeline()
+
+    assert 'FileExistsError' in repr(ex.value.__cause__)
+    assert pipeline._tasks_executed == {'foo'}
+    (pipeline.store_path / 'foo').unlink()
+
+
+def test_pipeline_serializers(store_path):
+
+    @task(serializer='json')
+    def foo():
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'y': [previous_results.values('foo', 'x')] * 3})
+
+    pipeline = Pipeline(foo, bar, serializer='pickle5')
+    result = pipeline.run_pipeline()
+
+    assert pipeline.serializer_for('foo').name == 'json'
+    assert pipeline.serializer_for('bar').name == 'pickle5'
+    assert (pipeline.store_path / 'foo' / 'result.json').exists()
+    assert (pipeline.store_path / 'bar' / 'result.pk5').exists()
+
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached == result
+
+    # switching serializers replaces the old files
+    pipeline = Pipeline(foo, bar)
+    pipeline.run_pipeline(force_rerun=['bar'])
+    assert sorted(p.name for p in (pipeline.store_path / 'bar').iterdir()) == ['meta.json', 'result.pk']
+    assert Pipeline.load_pipeline(pipeline.store_path).values('bar', 'y') == [1, 1, 1]
+
+    with pytest.raises(PipelineConfigError):
+        Pipeline(foo, bar, serializer='yaml')
+
+
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_unserializable_results(store_path, write_behind):
+
+    @task(serializer='json')
+    def foo():
+        return TaskResult({'counts': {1: 2}})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'total': sum(previous_results.values('foo', 'counts').values())})
+
+    @task
+    def baz():
+        return TaskResult({'lock': threading.Lock()})
+
+    # a result that the serializer rejects is left uncached without failing the run
+    pipeline = Pipeline(foo, bar, baz, write_behind=write_behind)
+    result = pipeline.run_pipeline()
+
+    assert result.values('bar', 'total') == 2
+    assert set(pipeline.store.entries()) == {'bar'}
+
+    result = pipeline.run_pipeline()
+    assert result.values('bar', 'total') == 2
+    assert pipeline._tasks_executed == {'foo', 'baz'}
+    assert pipeline._tasks_reused == {'bar'}
+
+
+def test_pipeline_compression(store_path, monkeypatch):
+
+    np = pytest.importorskip('numpy')
+    monkeypatch.setattr(settings, 'YENTA_MMAP_THRESHOLD', 1024)
+
+    @task(compression='bz2')
+    def foo():
+        return TaskResult({'text': 'all work and no play makes jack a dull boy. ' * 1000})
+
+    @task(serializer='npy')
+    def bar():
+        return TaskResult({'zeros': np.zeros(10000), 'small': 'not worth compressing'})
+
+    @task(compression='none')
+    def baz():
+        return TaskResult({'text': 'hello world ' * 1000})
+
+    pipeline = Pipeline(foo, bar, baz, compression='zlib')
+    result = pipeline.run_pipeline()
+
+    entries = Manifest(pipeline.store_path).load()
+    assert entries['foo']['codecs'] == {'result.pk': 'bz2'}
+    assert entries['foo']['size'] < 1000
+    assert entries['bar']['codecs'] == {'array-0000.npy': 'zlib'}
+    assert 'codecs' not in entries['baz']
+
+    # compressed arrays cannot be memory mapped, so they are passed on as they are
+    assert not isinstance(result.values('bar', 'zeros'), np.memmap)
+
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached.values('foo', 'text') == result.values('foo', 'text')
+    assert cached.values('bar', 'zeros').sum() == 0 and cached.values('bar', 'small') == 'not worth compressing'
+    assert cached.values('baz', 'text') == result.values('baz', 'text')
+
+    # results written with another codec, or none at all, are still loaded with their own
+    pipeline = Pipeline(foo, bar, baz, compression='lzma', compression_threshold=1 << 20)
+    pipeline.run_pipeline(force_rerun=['bar'])
+    assert 'codecs' not in Manifest(pipeline.store_path).load()['bar']
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached.values('foo', 'text') == result.values('foo', 'text')
+    assert isinstance(cached.values('bar', 'zeros'), np.memmap)
+
+    for compression in ['zstd', 'zlib:99']:
+        with pytest.raises(PipelineConfigError):
+            Pipeline(foo, bar, compression=compression)
+    # the setting is checked when the pipeline is created, not once a task has succeeded
+    monkeypatch.setattr(settings, 'YENTA_COMPRESSION', 'lzma:10')
+    with pytest.raises(PipelineConfigError):
+        Pipeline(foo, bar)
+
+
+def test_large_arrays_are_memory_mapped(store_path, monkeypatch):
+
+    np = pytest.importorskip('numpy')
+    monkeypatch.setattr(settings, 'YENTA_MMAP_THRESHOLD', 1024)
+    received = {}
+
+    @task
+    def foo():
+        return TaskResult({'big': np.arange(1000, dtype=np.float64), 'small': np.arange(10)})
+
+    @task(depends_on=['foo'])
+    def bar(big: 'foo__values__big', small: 'foo__values__small'):
+        received['annotation'] = big
+        return TaskResult({'total': float(big.sum())})
+
+    @task(depends_on=['foo'], selectors={'big': lambda res: res.values('foo', 'big'),
+                                         'small': lambda res: res.values('foo', 'small')})
+    def baz(big, small):
+        received['selector'] = big
+        received['small'] = small
+        return TaskResult({'total': int(small.sum())})
+
+    pipeline = Pipeline(foo, bar, baz)
+    result = pipeline.run_pipeline()
+
+    assert result.values('bar', 'total') == 499500.0
+    assert result.values('baz', 'total') == 45
+    assert pipeline.serializer_for('foo', result.task_results['foo']).name == 'npy'
+    assert isinstance(received['annotation'], np.memmap)
+    assert not received['annotation'].flags.writeable
+    assert isinstance(received['selector'], np.memmap)
+    assert not isinstance(received['small'], np.memmap)
+
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert isinstance(cached.values('foo', 'big'), np.memmap)
+    assert np.array_equal(cached.values('foo', 'big'), np.arange(1000))
+    assert fingerprint(cached.task_results['foo']) == result.task_fingerprints['foo']
+
+    # reused results are neither rewritten nor loaded into memory
+    mtime = (pipeline.store_path / 'foo' / 'meta.json').stat().st_mtime_ns
+    result = pipeline.run_pipeline(force_rerun=['bar'])
+    assert (pipeline.store_path / 'foo' / 'meta.json').stat().st_mtime_ns == mtime
+    assert isinstance(received['annotation'], np.memmap)
+    assert pipeline._tasks_executed == {'bar'}
+
+
+def test_large_datetime_arrays(store_path, monkeypatch):
+
+    np = pytest.importorskip('numpy')
+    monkeypatch.setattr(settings, 'YENTA_MMAP_THRESHOLD', 1024)
+    times = np.arange(200000).astype('datetime64[ns]')
+
+    @task
+    def foo():
+        return TaskResult({'times': times, 'gaps': np.diff(times)})
+
+    pipeline = Pipeline(foo)
+    result = pipeline.run_pipeline()
+
+    assert pipeline.serializer_for('foo', result.task_results['foo']).name == 'npy'
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached.values('foo', 'times').dtype == times.dtype
+    assert np.array_equal(cached.values('foo', 'times'), times)
+    assert np.array_equal(cached.values('foo', 'gaps'), np.diff(times))
+
+
+@pytest.mark.parametrize('reset_peak', [True, False])
+def test_task_profiles(store_path, monkeypatch, reset_peak):
+
+    if not reset_peak:
+        # as on Python 3.8 and older
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+
+    @task
+    def foo():
+        data = [0] * 100000
+        return TaskResult({'x': len(data)})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'y': previous_results.values('foo', 'x')})
+
+    pipeline = Pipeline(foo, bar, profile_memory=True)
+    result = pipeline.run_pipeline()
+
+    profile = result.task_results['foo'].profile
+    assert profile.wall_time > 0 and profile.cpu_time is not None
+    assert profile.peak_memory >= 800000
+    assert profile.result_size == (pipeline.store_path / 'foo' / 'result.pk').stat().st_size
+    assert not profile.reused
+
+    # the profile is cached with the result, but does not affect its fingerprint
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached.task_results['foo'].profile.wall_time == profile.wall_time
+    assert cached.task_results['foo'].profile.load_time is not None
+    assert fingerprint(cached.task_results['foo']) == result.task_fingerprints['foo']
+
+    result = Pipeline(foo, bar).run_pipeline()
+    profile = result.task_results['foo'].profile
+    assert profile.reused
+    assert profile.reuse_check_time is not None and profile.load_time is not None
+
+    runs = Pipeline.load_runs(pipeline.store_path)
+    assert len(runs) == 2
+    assert list(runs[1]['tasks']) == ['foo', 'bar']
+    assert runs[1]['tasks']['foo']['reused']
+    assert Pipeline.load_runs(pipeline.store_path, last=1) == runs[1:]
+
+
+def test_critical_path():
+
+    from yenta.pipeline.critical_path import critical_path, remaining_lengths, task_durations
+
+    graph = nx.DiGraph([('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd'), ('e', 'd')])
+    runs = [{'tasks': {'a': {'wall_time': 1.0, 'reused': False}, 'b': {'wall_time': 5.0, 'reused': False},
+                       'c': {'wall_time': 2.0, 'reused': False}, 'd': {'wall_time': 1.0, 'reused': False}}},
+            {'tasks': {'a': {'wall_time': 3.0, 'reused': False}, 'b': {'wall_time': 0.1, 'reused': True}}},
+            {'tasks': {'a': {'wall_time': 2.0, 'reused': False}}}]
+
+    durations = task_durations(runs)
+    assert durations == {'a': 2.0, 'b': 5.0, 'c': 2.0, 'd': 1.0}
+
+    analysis = critical_path(graph, durations)
+    assert analysis.makespan == 8.0
+    assert analysis.path == ['a', 'b', 'd']
+    assert analysis.earliest_start == {'a': 0.0, 'b': 2.0, 'c': 2.0, 'd': 7.0, 'e': 0.0}
+    assert analysis.slack['c'] == 3.0
+    assert analysis.slack['e'] == 7.0
+    assert [task_name for task_name in 'abcde' if analysis.is_critical(task_name)] == ['a', 'b', 'd']
+
+    assert critical_path(nx.DiGraph(), {}).makespan == 0.0
+
+    # e has no recorded duration, so it is assumed to take the median of the others
+    assert remaining_lengths(graph, durations) == {'a': 8.0, 'b': 6.0, 'c': 3.0, 'd': 1.0, 'e': 3.0}
+    assert remaining_lengths(graph, {}) == {'a': 3.0, 'b': 2.0, 'c': 2.0, 'd': 1.0, 'e': 2.0}
+
+
+def test_critical_path_priority(store_path):
+
+    started = []
+
+    def make_task(name, seconds, depends_on=None):
+
+        def work():
+            started.append(name)
+            time.sleep(seconds)
+            return TaskResult({'name': name})
+
+        work.__name__ = name
+        return task(work, depends_on=depends_on)
+
+    tasks = [make_task('fast_1', 0), make_task('fast_2', 0, ['fast_1']), make_task('fast_3', 0, ['fast_2']),
+             make_task('slow', 0.05)]
+    pipeline = Pipeline(*tasks)
+    names = [t.task_def.name for t in tasks]
+
+    pipeline.run_pipeline(priority='order')
+    assert started == ['fast_1', 'fast_2', 'fast_3', 'slow']
+
+    # without a history for these tasks, the longest chain of tasks goes first
+    pipeline.store.clear()
+    started.clear()
+    pipeline.run_pipeline()
+    assert started[0] == 'fast_1'
+
+    # with one, the task that takes longest does
+    started.clear()
+    pipeline.run_pipeline(force_rerun=names)
+    assert started[0] == 'slow'
+
+    with pytest.raises(PipelineConfigError):
+        pipeline.run_pipeline(priority='random')
+
+
+def test_pipeline_manifest(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1, 'xs': list(range(100))})
+
+    @task
+    def bar():
+        raise ValueError('oh noes')
+
+    pipeline = Pipeline(foo, bar)
+    pipeline.run_pipeline()
+
+    entries = Manifest(pipeline.store_path).load()
+    assert entries['foo']['status'] == TaskStatus.SUCCESS
+    assert entries['foo']['summary']['values'] == {'x': '1', 'xs': 'list of 100 items'}
+    assert entries['foo']['parts'] == ['result.pk'] and not entries['foo']['pending']
+    assert entries['bar']['status'] == TaskStatus.FAILURE and entries['bar']['error'] == 'oh noes'
+
+    # loading the pipeline only reads the manifest, so a missing meta.json goes unnoticed
+    (pipeline.store_path / 'foo' / 'meta.json').unlink()
+    cached = Pipeline.load_pipeline(pipeline.store_path)
+    assert cached.task_fingerprints['foo'] == fingerprint(cached.task_results['foo'])
+
+    # an interrupted write leaves the task pending, and then only its meta.json is trusted
+    Manifest(pipeline.store_path).mark_pending('foo')
+    assert Pipeline.load_pipeline(pipeline.store_path).task_inputs['foo'] is None
+
+    Manifest(pipeline.store_path).ignore('bar')
+    assert 'bar' not in Pipeline.load_pipeline(pipeline.store_path).task_results
+
+    # stores written before there was a manifest are scanned instead
+    (pipeline.store_path / 'manifest.jsonl').unlink()
+    pipeline.run_pipeline()
+    (pipeline.store_path / 'manifest.jsonl').unlink()
+    (pipeline.store_path / 'bar' / '.ignore').touch()
+    assert set(Pipeline.load_pipeline(pipeline.store_path).task_results) == {'foo'}
+    Manifest(pipeline.store_path).remove('foo')
+    entries = Manifest(pipeline.store_path).load()
+    assert list(entries) == ['bar'] and entries['bar']['ignored']
+
+
+def test_sqlite_pipeline(store_path, monkeypatch):
+
+    np = pytest.importorskip('numpy')
+    monkeypatch.setattr(settings, 'YENTA_MMAP_THRESHOLD', 1024)
+    monkeypatch.setattr(settings, 'YENTA_STORE_URL', f'sqlite:///{store_path}/sqlite/cache.db')
+
+    @task
+    def foo():
+        return TaskResult({'big': np.arange(1000, dtype=np.float64), 'n': 3})
+
+    @task(depends_on=['foo'])
+    def bar(previous_results: PipelineResult):
+        return TaskResult({'total': float(previous_results.values('foo', 'big').sum())})
+
+    pipeline = Pipeline(foo, bar)
+    assert isinstance(pipeline.store, SQLiteStore)
+    result = pipeline.run_pipeline()
+    assert (store_path / 'sqlite' / 'cache.db').exists()
+    assert not (store_path / 'default').exists()
+
+    # large arrays are spilled to files, which are memory mapped like those of the file store
+    assert isinstance(result.values('foo', 'big'), np.memmap)
+
+    cached = Pipeline.load_pipeline(pipeline.store)
+    assert cached.values('bar', 'total') == 499500.0
+    assert cached.values('foo', 'n') == 3
+
+    result = pipeline.run_pipeline()
+    assert pipeline._tasks_reused == {'foo', 'bar'}
+    assert len(Pipeline.load_runs(pipeline.store)) == 2
+    pipeline.store.close()
+
+
+def test_pipeline_store_budget(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'xs': list(range(1000))})
+
+    @task
+    def bar():
+        return TaskResult({'xs': list(range(1000))})
+
+    # only the results that the latest run of each pipeline did not use can be evicted
+    Pipeline(foo, bar, name='old').run_pipeline()
+    Pipeline(foo, name='old').run_pipeline()
+    Pipeline(foo, bar, name='pinned').run_pipeline()
+    Pipeline(bar, name='pinned').run_pipeline()
+    Pipeline(bar, name='pinned').store.pin('foo')
+
+    with pytest.raises(PipelineConfigError):
+        Pipeline(foo, bar, store_budget='lots')
+
+    # the results of the pipeline that was just run are kept even though they alone exceed the budget
+    pipeline = Pipeline(foo, bar, store_budget=1)
+    pipeline.run_pipeline()
+    assert set(Pipeline.load_pipeline(pipeline.store).task_results) == {'foo', 'bar'}
+    assert set(Pipeline.load_pipeline(store_path / 'pinned').task_results) == {'foo', 'bar'}
+    assert set(Pipeline.load_pipeline(store_path / 'old').task_results) == {'foo'}
+
+
+def test_shared_cache(store_path, monkeypatch):
+
+    shared = store_path / 'shared'
+    calls = []
+
+    @task
+    def foo():
+        calls.append('foo')
+        return TaskResult({'text': 'expensive ' * 1000})
+
+    @task(depends_on=['foo'], pure=False)
+    def bar(previous_results: PipelineResult):
+        calls.append('bar')
+        return TaskResult({'length': len(previous_results.values('foo', 'text'))})
+
+    @task
+    def baz():
+        raise ValueError('oh noes')
+
+    Pipeline(foo, bar, baz, name='shared', shared_cache=shared, compression='zlib').run_pipeline()
+    assert calls == ['foo', 'bar']
+
+    # the same pipeline elsewhere, with a cache of its own, reuses the results of the pure tasks
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', store_path / 'elsewhere')
+    pipeline = Pipeline(foo, bar, baz, name='shared', shared_cache=shared)
+    result = pipeline.run_pipeline()
+    assert calls == ['foo', 'bar', 'bar']
+    assert pipeline._tasks_reused == {'foo'}
+    assert result.values('bar', 'length') == 10000
+    assert result.task_results['foo'].profile.shared
+    assert result.task_results['baz'].status == TaskStatus.FAILURE
+
+    # and from then on reuses them from its own cache
+    cached = Pipeline.load_pipeline(pipeline.store)
+    assert cached.values('foo', 'text') == 'expensive ' * 1000
+    result = pipeline.run_pipeline()
+    assert calls == ['foo', 'bar', 'bar', 'bar']
+    assert pipeline._tasks_reused == {'foo'} and not result.task_results['foo'].profile.shared
+
+    # only the results of pure tasks that succeeded are shared, and no locks are left behind
+    assert sorted(path.name.split('-')[0] for path in (shared / 'objects').iterdir()) == ['foo']
+    assert not list((shared / 'locks').iterdir())
+
+
+def test_shared_cache_namespaces(store_path):
+
+    shared = store_path / 'shared'
+
+    def make_load(data):
+
+        @task
+        def load():
+            return TaskResult({'x': data})
+
+        return load
+
+    first = Pipeline(make_load('pipeline A data'), name='A', shared_cache=shared)
+    first.run_pipeline()
+
+    # a task of the same name in another pipeline does not get the results of the first one
+    second = Pipeline(make_load('pipeline B data'), name='B', shared_cache=shared)
+    result = second.run_pipeline()
+    assert second._tasks_executed == {'load'}
+    assert result.values('load', 'x') == 'pipeline B data'
+    assert first.shared_namespace('load') != second.shared_namespace('load')
+
+    @task
+    def load():
+        return TaskResult({'x': 'other code'})
+
+    # nor does a task of the same name with other code in the same pipeline
+    third = Pipeline(load, name='A', shared_cache=shared)
+    assert third.shared_namespace('load') != first.shared_namespace('load')
+
+
+def test_shared_cache_stampede(store_path, monkeypatch):
+
+    calls = []
+    started = threading.Barrier(3)
+
+    @task
+    def slow():
+        calls.append('slow')
+        time.sleep(0.3)
+        return TaskResult({'answer': 42})
+
+    def run(name, pipeline):
+        started.wait()
+        results[name] = pipeline.run_pipeline().values('slow', 'answer')
+
+    # the same pipeline on three machines, each with a store of its own
+    pipelines = {}
+    for i in range(3):
+        monkeypatch.setattr(settings, 'YENTA_STORE_PATH', store_path / f'worker-{i}')
+        pipelines[f'worker-{i}'] = Pipeline(slow, name='stampede', shared_cache=SharedCache(
+            FileTransport(store_path / 'shared'), poll_interval=0.01))
+
+    results = {}
+    threads = [threading.Thread(target=run, args=item) for item in pipelines.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # only one of the concurrent workers computed the result, which the others waited for
+    assert calls == ['slow']
+    assert results == {'worker-0': 42, 'worker-1': 42, 'worker-2': 42}
+
+
+def start_workers(coordinator, count):
+
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(coordinator.address,),
+                               kwargs={'connect_timeout': 10, 'key': coordinator.key})
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def test_distributed_execution(store_path):
+
+    from yenta.cli import load_tasks
+
+    tasks = load_tasks('tests/sample_pipelines/sample_pipeline_2.py')
+    with Coordinator(port=0) as coordinator:
+        workers = start_workers(coordinator, 2)
+        pipeline = Pipeline(*tasks)
+        result = pipeline.run_pipeline(coordinator=coordinator)
+
+    for worker in workers:
+        worker.join(10)
+        assert worker.exitcode == 0
+
+    assert result.values('total', 'total') == 285 + 2025
+    assert {result.values(task_name, 'pid') for task_name in ['squares', 'cubes', 'total']} <= \
+        {worker.pid for worker in workers}
+    assert result.task_results['broken'].error == 'broken in a worker'
+    assert Pipeline.load_pipeline(pipeline.store).values('total', 'total') == 2310
+
+
+def test_distributed_keys(monkeypatch):
+
+    monkeypatch.setattr(settings, 'YENTA_CLUSTER_KEY', None)
+    # without a key, the coordinator makes up one that cannot be guessed, and workers cannot connect
+    with Coordinator(port=0) as first, Coordinator(port=0) as second:
+        assert first.generated_key and len(first.key) == 32 and first.key != second.key
+        with pytest.raises(DistributedError):
+            run_worker(first.address, connect_timeout=0)
+
+    monkeypatch.setattr(settings, 'YENTA_CLUSTER_KEY', 'configured')
+    with Coordinator(port=0) as coordinator:
+        assert coordinator.key == 'configured' and not coordinator.generated_key
+
+
+def test_distributed_worker_loss(store_path):
+
+    from yenta.cli import load_tasks
+
+    tasks = load_tasks('tests/sample_pipelines/sample_pipeline_3.py')
+    pipeline = Pipeline(*tasks)
+
+    # the task of the worker that died is handed to the other one
+    with Coordinator(port=0) as coordinator:
+        workers = start_workers(coordinator, 2)
+        result = pipeline.run_pipeline(only='flaky', coordinator=coordinator)
+    for worker in workers:
+        worker.join(10)
+
+    assert result.task_results['flaky'].status == TaskStatus.SUCCESS
+    assert sorted(worker.exitcode for worker in workers) == [0, 1]
+    assert result.values('flaky', 'pid') == [worker.pid for worker in workers if worker.exitcode == 0][0]
+
+    with Coordinator(port=0, max_attempts=1) as coordinator:
+        workers = start_workers(coordinator, 1)
+        result = pipeline.run_pipeline(only='doomed', coordinator=coordinator)
+    workers[0].join(10)
+
+    assert result.task_results['doomed'].status == TaskStatus.FAILURE
+    assert 'Gave up after losing 1 workers' in result.task_results['doomed'].error
@@ -0,0 +1,358 @@
+import os
+import pytest
+import shutil
+import threading
+from datetime import datetime
+
+from pathlib import Path
+
+from yenta.artifacts import FileArtifact
+from yenta.pipeline import TaskResult, TaskStatus
+from yenta.store import (
+    get_serializer, FilePartReader, SerializationError, PickleSerializer, Pickle5Serializer,
+    NpySerializer, JsonSerializer, FileStore, SQLiteStore, StoreConfigError, open_store, migrate_store,
+    CachedResult, cache_usage, select_evictions, collect_garbage, parse_size, CODECS, CompressionError,
+    CompressedPartReader, compress_parts, get_codec, SharedCache, SharedCacheError, FileTransport, HTTPTransport,
+    serve_shared_cache
+)
+from yenta.utils.files import atomic_write
+
+
+@pytest.fixture
+def part_dir():
+
+    path = Path('tests/tmp/parts')
+    path.mkdir(parents=True, exist_ok=True)
+    yield path
+    for part in path.iterdir():
+        part.unlink()
+    path.rmdir()
+
+
+def round_trip(serializer, obj, part_dir):
+
+    parts = serializer.dumps(obj)
+    for name, chunks in parts.items():
+        atomic_write(part_dir / name, chunks)
+
+    return serializer.loads(FilePartReader(part_dir, list(parts)))
+
+
+@pytest.mark.parametrize('serializer', [PickleSerializer(), Pickle5Serializer(), NpySerializer(), JsonSerializer()])
+def test_serializer_round_trip(serializer, part_dir):
+
+    result = TaskResult({'x': 1, 'y': [1.5, 'two'], 'z': {'a': None}},
+                        {'file': FileArtifact(location='/some/path', date_created='2021-01-01')},
+                        status=TaskStatus.SUCCESS)
+
+    loaded = round_trip(serializer, result, part_dir)
+
+    assert loaded == result
+    assert loaded.status == TaskStatus.SUCCESS
+    assert isinstance(loaded.artifacts['file'], FileArtifact)
+    assert loaded.artifacts['file'].date_created == '2021-01-01'
+
+
+@pytest.mark.parametrize('name', ['pickle', 'pickle5', 'npy'])
+def test_serializer_arrays(name, part_dir):
+
+    np = pytest.importorskip('numpy')
+
+    array = np.arange(1000, dtype=np.float64).reshape(10, 100)
+    dates = np.arange(1000).astype('datetime64[ns]')
+    result = TaskResult({'array': array, 'fortran': np.asfortranarray(array), 'empty': np.zeros(0), 'dates': dates,
+                         'n': 3})
+
+    serializer = get_serializer(name)
+    parts = serializer.dumps(result)
+    loaded = round_trip(serializer, result, part_dir)
+
+    assert loaded.values['n'] == 3
+    for key in ('array', 'fortran', 'empty', 'dates'):
+        assert np.array_equal(loaded.values[key], result.values[key])
+    assert loaded.values['dates'].dtype == dates.dtype
+
+    if name == 'npy':
+        assert len([part for part in parts if part.endswith('.npy')]) == 4
+        # the original result was not modified
+        assert result.values['array'] is array
+    elif name == 'pickle5':
+        assert len([part for part in parts if part.startswith('buffer-')]) >= 1
+
+
+def test_json_serializer_errors(part_dir):
+
+    serializer = JsonSerializer()
+
+    with pytest.raises(SerializationError):
+        serializer.dumps(TaskResult({'x': object()}))
+
+    with pytest.raises(SerializationError):
+        serializer.dumps(TaskResult({'x': {1: 2}}))
+
+    (part_dir / 'result.json').write_text('{"__dataclass__": "os.system", "fields": {}}')
+    with pytest.raises(SerializationError):
+        serializer.loads(FilePartReader(part_dir, ['result.json']))
+
+
+def test_unknown_serializer():
+
+    with pytest.raises(SerializationError):
+        get_serializer('yaml')
+
+
+@pytest.mark.parametrize('name', list(CODECS))
+def test_compression(name, part_dir):
+
+    text = b'the quick brown fox jumps over the lazy dog\n' * 1000
+    parts = {'result.pk': [text[:100], memoryview(text[100:])], 'small.bin': [b'ab' * 100],
+             'random.bin': [os.urandom(4096)]}
+    codec = get_codec(name)
+    stored, codecs = compress_parts(parts, codec, threshold=1024)
+
+    # small parts and parts that do not get any smaller are left alone
+    assert codecs == {'result.pk': name}
+    assert len(stored['result.pk'][0]) < len(text) // 10
+    assert stored['small.bin'] is parts['small.bin']
+
+    for part, chunks in stored.items():
+        atomic_write(part_dir / part, chunks)
+    reader = CompressedPartReader(FilePartReader(part_dir, list(stored)), codecs)
+    assert reader.read('result.pk') == text
+    assert reader.path('result.pk') is None
+    assert reader.read('small.bin') == b'ab' * 100
+    assert reader.path('small.bin') == part_dir / 'small.bin'
+
+
+def test_codec_levels():
+
+    assert get_codec(None) is None and get_codec('none') is None
+    assert get_codec('zlib').level == 6
+    assert get_codec('lzma:1').level == 1
+    assert get_codec('zlib:-1').level == -1
+    for spec in ['zstd', 'zlib:fast', 'zlib:99', 'zlib:-2', 'bz2:0', 'lzma:10']:
+        with pytest.raises(CompressionError):
+            get_codec(spec)
+
+
+@pytest.fixture
+def store_dir():
+
+    path = Path('tests/tmp/stores')
+    path.mkdir(parents=True, exist_ok=True)
+    yield path
+    shutil.rmtree(path)
+
+
+def test_sqlite_store(store_dir):
+
+    store = SQLiteStore(store_dir / 'cache.db', 'default', blob_threshold=100)
+    meta = {'inputs': 'a', 'result': 'b', 'serializer': 'pickle', 'status': 'success', 'parts': ['big', 'small']}
+    store.write('foo', {'big': [b'x' * 60, b'y' * 60], 'small': [b'z']}, meta, error=None)
+
+    entry = store.entries()['foo']
+    assert entry['inputs'] == 'a' and not entry['ignored']
+    reader = store.reader('foo', entry)
+    assert reader.read('big') == b'x' * 60 + b'y' * 60
+    assert reader.read('small') == b'z'
+    assert reader.path('small') is None
+    assert reader.path('big').parent.parent == store_dir / 'cache.db.blobs'
+
+    # the same contents are only stored once
+    store.write('bar', {'big': [b'x' * 60 + b'y' * 60]}, {**meta, 'parts': ['big']})
+    assert len([path for path in (store_dir / 'cache.db.blobs').rglob('*') if path.is_file()]) == 1
+
+    store.ignore('foo')
+    store.write('foo', {'small': [b'w']}, {**meta, 'parts': ['small']})
+    assert store.entries()['foo']['ignored']
+
+    assert store.remove('bar') and not store.remove('bar')
+    assert list(store.entries()) == ['foo']
+
+    store.append_run({'run': 1})
+    store.append_run({'run': 2})
+    assert store.load_runs() == [{'run': 1}, {'run': 2}]
+    assert store.load_runs(last=1) == [{'run': 2}]
+
+    # pipelines sharing a database do not see each other's results
+    assert SQLiteStore(store_dir / 'cache.db', 'other').entries() == {}
+    store.close()
+
+
+def test_open_and_migrate_stores(store_dir):
+
+    assert isinstance(open_store('default', store_dir), FileStore)
+    with pytest.raises(StoreConfigError):
+        open_store('default', 'sqlite:///')
+
+    source = open_store('default', store_dir / 'files')
+    meta = {'inputs': 'a', 'result': 'b', 'serializer': 'pickle', 'status': 'success', 'parts': ['result.pk']}
+    source.write('foo', {'result.pk': [b'data']}, meta, error=None)
+    source.ignore('foo')
+    source.append_run({'run': 1})
+
+    destination = open_store('default', f'sqlite:///{store_dir}/cache.db')
+    assert isinstance(destination, SQLiteStore)
+    assert migrate_store(source, destination) == 1
+
+    entry = destination.entries()['foo']
+    assert entry['ignored'] and entry['result'] == 'b'
+    assert destination.reader('foo', entry).read('result.pk') == b'data'
+    assert destination.load_runs() == [{'run': 1}]
+    destination.close()
+
+
+def test_parse_size():
+
+    assert parse_size(None) is None
+    assert parse_size(100) == 100
+    assert parse_size('100') == 100
+    assert parse_size('2k') == 2048
+    assert parse_size('1.5 GiB') == 3 * 2 ** 29
+    assert parse_size('10MB') == 10 * 2 ** 20
+    with pytest.raises(StoreConfigError):
+        parse_size('ten gigs')
+
+
+def test_select_evictions():
+
+    results = [CachedResult('a', 'old', 100, '2021-01-01', '2021-03-01'),
+               CachedResult('a', 'recent', 100, '2021-02-01', '2021-02-01'),
+               CachedResult('a', 'pinned', 100, '2020-01-01', '2020-01-01', pinned=True),
+               CachedResult('b', 'latest', 100, '2020-01-01', '2020-01-01', in_latest_run=True)]
+
+    assert select_evictions(results, 400) == []
+    assert [r.task for r in select_evictions(results, 300, 'lru')] == ['recent']
+    assert [r.task for r in select_evictions(results, 300, 'age')] == ['old']
+    # protected results are kept even if the budget cannot be met
+    assert [r.task for r in select_evictions(results, 0, 'lru')] == ['recent', 'old']
+    with pytest.raises(StoreConfigError):
+        select_evictions(results, 0, 'random')
+
+
+@pytest.mark.parametrize('kind', ['file', 'sqlite'])
+def test_collect_garbage(kind, store_dir):
+
+    location = store_dir if kind == 'file' else f'sqlite:///{store_dir}/cache.db'
+    meta = {'inputs': 'a', 'result': 'b', 'serializer': 'pickle', 'status': 'success', 'parts': ['result.pk']}
+    for pipeline in ['first', 'second']:
+        store = open_store(pipeline, location)
+        if kind == 'sqlite':
+            store.blob_threshold = 100
+        for i, task_name in enumerate(['foo', 'bar', 'baz']):
+            store.write(task_name, {'result.pk': [bytes([i]) * 1000]}, {**meta, 'size': 1000})
+        store.append_run({'started': datetime.now().isoformat(), 'tasks': {'foo': {}, 'bar': {}}})
+        store.append_run({'started': datetime.now().isoformat(), 'tasks': {'foo': {}}})
+        store.close()
+    open_store('second', location).pin('bar')
+
+    usage = {(r.pipeline, r.task): r for r in cache_usage(location)}
+    assert len(usage) == 6
+    assert usage['first', 'foo'].in_latest_run and usage['first', 'foo'].last_used > usage['first', 'foo'].written
+    assert not usage['first', 'bar'].in_latest_run
+    assert usage['second', 'bar'].pinned
+
+    assert len(collect_garbage('3000', location=location, dry_run=True)) == 3
+    assert len(cache_usage(location)) == 6
+
+    evicted = collect_garbage('3000', location=location)
+    assert sorted((r.pipeline, r.task) for r in evicted) == [('first', 'bar'), ('first', 'baz'), ('second', 'baz')]
+    assert sorted((r.pipeline, r.task) for r in cache_usage(location)) == \
+        [('first', 'foo'), ('second', 'bar'), ('second', 'foo')]
+
+    if kind == 'sqlite':
+        store = open_store('first', location)
+        # the blobs of the evicted results are kept while they might be in the middle of being written
+        assert store.sweep() == 0
+        # blobs are shared by identical parts, so only the blob of the two `baz` results is unreferenced
+        assert store.sweep(grace=-1) == 1000
+        assert len([path for path in store.blob_directory.rglob('*') if path.is_file()]) == 2
+        store.close()
+
+
+@pytest.fixture(params=['file', 'http'])
+def transport(request, store_dir):
+
+    if request.param == 'file':
+        yield FileTransport(store_dir / 'shared')
+        return
+
+    server = serve_shared_cache(store_dir / 'shared')
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield HTTPTransport(f'http://{server.server_address[0]}:{server.server_address[1]}')
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_cache_transports(transport):
+
+    assert transport.get('foo-abc') is None
+    transport.put('foo-abc', [b'hello ', memoryview(b'world')])
+    assert transport.get('foo-abc') == b'hello world'
+
+    assert transport.lock('foo-abc', 'me')
+    assert not transport.lock('foo-abc', 'you')
+    transport.unlock('foo-abc', 'you')
+    assert not transport.lock('foo-abc', 'you')
+    transport.unlock('foo-abc', 'me')
+    # expired locks are taken over
+    assert transport.lock('foo-abc', 'you', ttl=-1)
+    assert transport.lock('foo-abc', 'me')
+
+    with pytest.raises(SharedCacheError):
+        transport.get('../../etc/passwd')
+
+
+def test_shared_cache_entries(transport):
+
+    first, second = SharedCache(transport), SharedCache(transport, poll_interval=0.01)
+    parts = {'result.pk': [b'abc', b'def'], 'array-0000.npy': [b'']}
+    meta = {'inputs': 'abc', 'result': 'def', 'parts': sorted(parts), 'codecs': {'result.pk': 'zlib'}}
+
+    # the first worker to miss an entry gets to compute it, and the others wait for it
+    assert first.acquire('foo', 'abc') is None
+    assert second.acquire('foo', 'abc', timeout=0.05) is None
+    first.publish('foo', 'abc', parts, meta, {'summary': {}})
+
+    stored, stored_meta, details = second.acquire('foo', 'abc')
+    assert {name: bytes(chunks[0]) for name, chunks in stored.items()} == {'result.pk': b'abcdef',
+                                                                         'array-0000.npy': b''}
+    assert stored_meta == meta and details == {'summary': {}}
+
+    # releasing an entry without publishing it lets another worker compute it
+    assert first.acquire('bar', 'abc') is None
+    first.release('bar', 'abc')
+    assert second.acquire('bar', 'abc', timeout=0) is None
+
+
+def test_shared_cache_secret(store_dir):
+
+    parts = {'result.pk': [b'abc']}
+    meta = {'inputs': 'abc', 'result': 'def', 'parts': ['result.pk']}
+    signed = SharedCache(FileTransport(store_dir / 'shared'), secret='s3cret')
+    signed.publish('foo', 'abc', parts, meta, {})
+    assert signed.get('foo', 'abc')[1] == meta
+
+    # entries that are not signed with the same secret are never used
+    SharedCache(FileTransport(store_dir / 'shared')).publish('bar', 'abc', parts, meta, {})
+    for secret, name in [('other', 'foo'), ('other', 'bar'), ('s3cret', 'bar')]:
+        with pytest.raises(SharedCacheError):
+            SharedCache(FileTransport(store_dir / 'shared'), secret=secret).get(name, 'abc')
+
+    # the server only serves clients with the secret, and only listens on other interfaces with one
+    with pytest.raises(SharedCacheError):
+        serve_shared_cache(store_dir / 'shared', host='0.0.0.0')
+    server = serve_shared_cache(store_dir / 'shared', secret='s3cret')
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    url = f'http://{server.server_address[0]}:{server.server_address[1]}'
+    try:
+        assert SharedCache(HTTPTransport(url, secret='s3cret'), secret='s3cret').get('foo', 'abc')[1] == meta
+        with pytest.raises(SharedCacheError):
+            HTTPTransport(url).get('foo-abc')
+        with pytest.raises(SharedCacheError):
+            HTTPTransport(url, secret='other').put('foo-abc', [b'payload'])
+    finally:
+        server.shutdown()
+        server.server_close()
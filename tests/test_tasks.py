@@ -1,8 +1,12 @@
+import inspect
+import pickle
 import pytest
 
+from pathlib import Path
+
 from yenta.tasks import (
     task, build_parameter_spec, TaskDef, InvalidTaskDefinitionError, ParameterSpec,
-    ParameterType, ResultSpec, ResultType
+    ParameterType, ResultSpec, ResultType, TaskExecutor, TaskReference
 )
 
 
@@ -75,3 +79,190 @@ def test_task_definition():
 
     assert(foo.task_def == expected_def)
 
+
+def test_task_executor():
+
+    @task(executor='process')
+    def foo():
+        pass
+
+    assert foo.task_def.executor == TaskExecutor.PROCESS
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(executor='gpu')
+        def bar():
+            pass
+
+    assert 'Invalid executor gpu' in str(ex.value)
+
+
+def test_task_serializer():
+
+    @task(serializer='npy')
+    def foo():
+        pass
+
+    assert foo.task_def.serializer == 'npy'
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(serializer='yaml')
+        def bar():
+            pass
+
+    assert 'yaml' in str(ex.value)
+
+
+def test_task_compression():
+
+    @task(compression='lzma:9')
+    def foo():
+        pass
+
+    assert foo.task_def.compression == 'lzma:9'
+
+    for compression in ['zstd', 'zlib:best', 'zlib:99']:
+        with pytest.raises(InvalidTaskDefinitionError):
+
+            @task(compression=compression)
+            def bar():
+                pass
+
+
+def test_task_resources():
+
+    @task(resources={'cpu': 4, 'mem_gb': 0.5})
+    def foo():
+        pass
+
+    assert foo.task_def.resources == {'cpu': 4, 'mem_gb': 0.5}
+
+    for resources in [{'cpu': -1}, {'cpu': '4'}, {'gpu': True}, {4: 1}]:
+        with pytest.raises(InvalidTaskDefinitionError):
+
+            @task(resources=resources)
+            def bar():
+                pass
+
+
+def test_mapped_task():
+
+    @task(map_over='files__values__paths')
+    def foo(path):
+        pass
+
+    assert foo.task_def.depends_on == ['files']
+    assert foo.task_def.element_param == 'path'
+
+    @task(depends_on=['files', 'config'], map_over='files__values__paths', reduce=len)
+    def bar(path: 'files__values__paths', scale: 'config__values__scale'):
+        pass
+
+    assert bar.task_def.depends_on == ['files', 'config']
+    assert bar.task_def.element_param == 'path'
+    assert bar.task_def.reduce is len
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(map_over='files__paths')
+        def baz(path):
+            pass
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(depends_on=['config'], map_over='files__values__paths')
+        def qux(scale: 'config__values__scale', offset: 'config__values__offset'):
+            pass
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(reduce=len)
+        def quux(path):
+            pass
+
+
+def test_streaming_task():
+
+    @task(stream_buffer=2)
+    def chunks():
+        yield 1
+
+    @task(depends_on=['config'])
+    def total(values: 'chunks__stream', scale: 'config__values__scale'):
+        pass
+
+    assert chunks.task_def.stream
+    assert chunks.task_def.stream_buffer == 2
+    assert not total.task_def.stream
+    assert total.task_def.stream_inputs == ['chunks']
+    assert total.task_def.depends_on == ['config', 'chunks']
+    assert total.task_def.param_specs[0] == ParameterSpec('values', ParameterType.EXPLICIT,
+                                                          ResultSpec('chunks', ResultType.STREAM, None))
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(executor='process')
+        def foo():
+            yield 1
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(cache_stream=True)
+        def bar():
+            pass
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(stream_buffer=0)
+        def baz():
+            yield 1
+
+    with pytest.raises(InvalidTaskDefinitionError):
+
+        @task(executor='process')
+        def qux(values: 'chunks__stream'):
+            pass
+
+
+def test_task_reference_from_file():
+
+    from yenta.cli import load_tasks
+
+    entry_point = 'tests/sample_pipelines/sample_pipeline_2.py'
+    tasks = {t.task_def.name: t for t in load_tasks(entry_point)}
+
+    ref = TaskReference.from_task(tasks['squares'])
+    assert ref.module_file == str(Path(entry_point).resolve())
+    assert ref.task_name == 'squares'
+
+    # the module was never registered under its own name, so it has to be loaded from the file
+    resolved = pickle.loads(pickle.dumps(ref)).resolve()
+    assert resolved.task_def.name == 'squares'
+    assert resolved().values['squares'][3] == 9
+
+
+def test_async_task_executor():
+
+    @task
+    async def foo():
+        pass
+
+    assert foo.task_def.executor == TaskExecutor.ASYNC
+    assert inspect.iscoroutinefunction(foo)
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(executor='process')
+        async def bar():
+            pass
+
+    assert 'can only use the async executor' in str(ex.value)
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(executor='async')
+        def baz():
+            pass
+
+    assert 'must be a coroutine function' in str(ex.value)
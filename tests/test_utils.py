@@ -0,0 +1,134 @@
+import os
+import pytest
+
+from datetime import datetime
+from pathlib import Path
+
+from yenta.artifacts import FileArtifact
+from yenta.pipeline import TaskResult, TaskStatus
+from yenta.utils.files import atomic_write
+from yenta.utils.fingerprint import fingerprint, combine_fingerprints
+
+
+def test_fingerprint():
+
+    assert fingerprint({'a': 1, 'b': [1, 2]}) == fingerprint({'b': [1, 2], 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 2})
+    assert fingerprint([1, 2]) != fingerprint((1, 2))
+    assert fingerprint('1') != fingerprint(1)
+    assert fingerprint({1, 2, 3}) == fingerprint({3, 2, 1})
+    assert fingerprint(Path('abc')) == fingerprint(Path('abc'))
+
+    res1 = TaskResult({'x': 1}, status=TaskStatus.SUCCESS)
+    res2 = TaskResult({'x': 1}, status=TaskStatus.SUCCESS)
+    res3 = TaskResult({'x': 1}, status=TaskStatus.FAILURE)
+
+    assert fingerprint(res1) == fingerprint(res2)
+    assert fingerprint(res1) != fingerprint(res3)
+
+
+def test_unpicklable_fingerprint():
+
+    import threading
+
+    # values that cannot be pickled never match, so whatever depends on them is rerun
+    result = TaskResult({'lock': threading.Lock()})
+    assert fingerprint(result) != fingerprint(result)
+
+
+def test_array_fingerprint():
+
+    np = pytest.importorskip('numpy')
+
+    days = np.arange('2020-01-01', '2020-02-01', dtype='datetime64[D]')
+    assert fingerprint(TaskResult({'days': days})) == fingerprint(TaskResult({'days': days.copy()}))
+    assert fingerprint(days) != fingerprint(days + np.timedelta64(1, 'D'))
+    assert fingerprint(np.diff(days)) != fingerprint(np.diff(days).astype('timedelta64[h]'))
+    assert fingerprint(np.arange(6).reshape(2, 3).T) == fingerprint(np.arange(6).reshape(2, 3).T.copy())
+
+
+def test_artifact_fingerprint():
+
+    art1 = FileArtifact(location='foo', date_created=str(datetime(2020, 1, 1)))
+    art2 = FileArtifact(location='foo', date_created=str(datetime(2021, 1, 1)))
+    art3 = FileArtifact(location='bar', date_created=str(datetime(2021, 1, 1)))
+
+    art4 = FileArtifact(location='foo', meta={'version': 2})
+    art5 = FileArtifact(location='foo', hash_algorithm='md5')
+
+    # artifacts are fingerprinted by every field but their creation date
+    assert fingerprint(art1) == fingerprint(art2)
+    assert fingerprint(art1) != fingerprint(art3)
+    assert fingerprint(art1) != fingerprint(art4)
+    assert fingerprint(art1) != fingerprint(art5)
+
+
+def test_combine_fingerprints():
+
+    assert combine_fingerprints({'a': '1', 'b': '2'}) == combine_fingerprints({'b': '2', 'a': '1'})
+    assert combine_fingerprints({'a': '1', 'b': '2'}) != combine_fingerprints({'a': '2', 'b': '1'})
+
+
+def test_atomic_write(monkeypatch):
+
+    output_file = Path('tests').resolve() / 'tmp' / 'atomic.test'
+    atomic_write(output_file, b'old contents')
+
+    def fail(*args):
+        raise OSError('disk on fire')
+
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        atomic_write(output_file, b'new contents')
+
+    assert output_file.read_bytes() == b'old contents'
+    assert not list(output_file.parent.glob('.atomic.test.*'))
+
+    monkeypatch.undo()
+    atomic_write(output_file, b'new contents')
+    assert output_file.read_bytes() == b'new contents'
+
+    output_file.unlink()
+
+
+def test_hash_cache(monkeypatch):
+
+    import yenta.utils.files as files
+
+    directory = Path('tests').resolve() / 'tmp'
+    cache = files.HashCache(directory / 'hash_cache')
+    output_file = directory / 'hashed.test'
+    output_file.write_bytes(b'some nice data')
+    # files modified too recently are never cached
+    os.utime(output_file, ns=(0, 10 ** 18))
+
+    calls = []
+    file_hash = files.file_hash
+    monkeypatch.setattr(files, 'file_hash', lambda *args, **kwargs: calls.append(args) or file_hash(*args, **kwargs))
+
+    assert cache.hash(output_file, 'sha1') == '6a52cbb539857eb8c7353cadda0054996dea6de8'
+    assert cache.hash(output_file, 'sha1') == '6a52cbb539857eb8c7353cadda0054996dea6de8'
+    assert len(calls) == 1
+
+    # each algorithm is recorded separately
+    blake = cache.hash(output_file, 'blake2b')
+    assert blake == file_hash(output_file, algorithm='blake2b').hexdigest()
+    assert cache.hash(output_file, 'blake2b') == blake
+    assert cache.hash(output_file, 'sha1') == '6a52cbb539857eb8c7353cadda0054996dea6de8'
+    assert len(calls) == 2
+
+    # a file with the same size but a different modification time is hashed again
+    output_file.write_bytes(b'some nice dat!')
+    os.utime(output_file, ns=(0, 2 * 10 ** 18))
+    assert cache.hash(output_file, 'sha1') == file_hash(output_file).hexdigest()
+    assert len(calls) == 3
+
+    output_file.write_bytes(b'fresh data')
+    cache.hash(output_file, 'sha1')
+    cache.hash(output_file, 'sha1')
+    assert len(calls) == 5
+
+    output_file.unlink()
+    for entry in cache.directory.iterdir():
+        entry.unlink()
+    cache.directory.rmdir()
@@ -1,9 +1,16 @@
+import hashlib
+
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Union
 
-from yenta.utils.files import file_hash
+from yenta.config import settings
+from yenta.utils.files import cached_file_hash, cached_directory_hash
+
+
+class InvalidArtifactError(Exception):
+    pass
 
 
 @dataclass
@@ -13,6 +20,9 @@ class Artifact:
     date_created: str = None
     hash: Optional[str] = None
     meta: dict = None
+    hash_algorithm: Optional[str] = None
+    """ The name of the algorithm with which `hash` was computed. Artifacts created before the
+        algorithm was recorded were always hashed with SHA-1. """
 
     def artifact_hash(self):
         raise NotImplementedError
@@ -32,9 +42,29 @@ class FileArtifact(Artifact):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.hash_algorithm = self.hash_algorithm or settings.YENTA_HASH_ALGORITHM
+        if self.hash_algorithm not in hashlib.algorithms_available:
+            raise InvalidArtifactError(f'Unknown hash algorithm {self.hash_algorithm}')
         self._path: Path = Path(self.location)
-        if self._path.exists() and not self._path.is_dir():
+        if self._is_hashable():
             self.hash = self.artifact_hash()
 
+    def _is_hashable(self) -> bool:
+        return self._path.exists() and not self._path.is_dir()
+
+    def artifact_hash(self):
+        return cached_file_hash(self._path, self.hash_algorithm)
+
+
+@dataclass(init=False)
+class DirectoryArtifact(FileArtifact):
+    """ An artifact that represents a directory generated during the task execution. Its hash is
+        a Merkle hash of everything in the directory, so it changes whenever any file in the
+        directory is added, removed, renamed or modified. Only the files that changed since
+        the directory was last hashed are read again. """
+
+    def _is_hashable(self) -> bool:
+        return self._path.is_dir()
+
     def artifact_hash(self):
-        return file_hash(self._path).hexdigest()
+        return cached_directory_hash(self._path, self.hash_algorithm)
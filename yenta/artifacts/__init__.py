@@ -1 +1 @@
-from .Artifact import Artifact, FileArtifact
+from .Artifact import Artifact, FileArtifact, DirectoryArtifact, InvalidArtifactError
@@ -4,20 +4,13 @@ import sys
 import click
 import configparser
 import importlib.util
-import more_itertools
-import shutil
 import os
 
-from rich.tree import Tree
-from rich.text import Text
-from rich import print
-
-from typing import Iterable
-from networkx.drawing.nx_pydot import to_pydot
-from colorama import init, Fore, Style
 from pathlib import Path
 from yenta.config import settings
-from yenta.pipeline.Pipeline import Pipeline, TaskStatus
+
+# everything else is imported by the commands that need it, so that commands which
+# do not execute the pipeline start quickly
 
 import logging
 
@@ -27,6 +20,35 @@ logger = logging.getLogger(__name__)
 CHECK_MARK = u'\u2714'
 X_MARK = u'\u2718'
 
+SUCCESS = 'success'
+FAILURE = 'failure'
+
+PROFILE_SORT_KEYS = {
+    'wall': 'total_wall_time',
+    'cpu': 'total_cpu_time',
+    'memory': 'peak_memory',
+    'size': 'result_size',
+    'overhead': 'reuse_overhead',
+    'queued': 'total_queue_time',
+}
+
+
+def parse_resources(ctx, param, value):
+    """ Parse the capacities of resources given as `cpu=32,mem_gb=128`. """
+
+    if not value:
+        return None
+    resources = {}
+    for item in value.split(','):
+        resource, _, amount = item.partition('=')
+        try:
+            resources[resource.strip()] = float(amount)
+        except ValueError:
+            raise click.BadParameter(f'expected resource=amount, got {item}')
+        if not resource.strip() or resources[resource.strip()] < 0:
+            raise click.BadParameter(f'expected resource=amount, got {item}')
+    return resources
+
 
 def load_tasks(entry_file):
     spec = importlib.util.spec_from_file_location('main', entry_file)
@@ -39,16 +61,135 @@ def load_tasks(entry_file):
     return tasks
 
 
+def build_task_graph(entry_file):
+    """ Execute the entry point and describe the task graph it defines, along with the files that
+        define its tasks, for `TaskGraphCache`. """
+
+    import inspect
+    from yenta.pipeline.Pipeline import Pipeline
+
+    tasks = load_tasks(entry_file)
+    pipeline = Pipeline(*tasks)
+    graph = {'tasks': [{'name': task.task_def.name, 'depends_on': list(task.task_def.depends_on or [])}
+                       for task in tasks],
+             'execution_order': list(pipeline.execution_order)}
+    sources = {inspect.unwrap(task).__code__.co_filename for task in tasks}
+
+    return graph, sources
+
+
+def load_task_graph(entry_file):
+    """ Describe the task graph defined by the entry point, using the cached description if the
+        task definitions have not changed since it was built. """
+
+    from yenta.store.GraphCache import TaskGraphCache
+
+    cache = TaskGraphCache(settings.YENTA_STORE_PATH / '.graph_cache')
+    return cache.get(entry_file, lambda: build_task_graph(entry_file))
+
+
+def task_graph_from(graph):
+    """ Build a networkx graph from a description of the task graph made by `build_task_graph`. """
+
+    import networkx as nx
+
+    task_graph = nx.DiGraph()
+    for task in graph['tasks']:
+        task_graph.add_node(task['name'])
+        for dependency in task['depends_on']:
+            task_graph.add_edge(dependency, task['name'])
+
+    return task_graph
+
+
+def load_task_statuses(store, task_names):
+    """ Read the status of the previous execution of every task from the index of the store,
+        without loading the results themselves unless they were cached before the status was
+        recorded. """
+
+    entries = store.entries()
+    statuses = {}
+    legacy = []
+    for task_name in task_names:
+        entry = entries.get(task_name, {})
+        statuses[task_name] = None if entry.get('ignored', False) else entry.get('status', None)
+        if task_name in entries and statuses[task_name] is None and not entry.get('ignored', False):
+            legacy.append(task_name)
+
+    if legacy:
+        from yenta.pipeline.Pipeline import Pipeline
+        pipeline_data = Pipeline.load_pipeline(store)
+        for task_name in legacy:
+            task_result = pipeline_data.task_results.get(task_name, None)
+            statuses[task_name] = task_result.status if task_result else None
+
+    return statuses
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return f'{seconds:.2f}s' if seconds >= 1 else f'{seconds * 1000:.1f}ms'
+
+
+def format_bytes(size):
+    if size is None:
+        return '-'
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+
+def summarize_runs(runs):
+    """ Aggregate the profiles of each task over a number of runs. """
+
+    summary = {}
+    for run in runs:
+        for task_name, profile in run['tasks'].items():
+            task = summary.setdefault(task_name, {'task': task_name, 'executed': 0, 'reused': 0, 'failed': 0,
+                                                  'total_wall_time': 0.0, 'max_wall_time': None,
+                                                  'total_cpu_time': None, 'peak_memory': None,
+                                                  'result_size': None, 'reuse_overhead': None,
+                                                  'total_queue_time': None})
+            if profile['status'] == FAILURE:
+                task['failed'] += 1
+            if profile['reused']:
+                task['reused'] += 1
+                overhead = (profile['reuse_check_time'] or 0) + (profile['load_time'] or 0)
+                task['reuse_overhead'] = (task['reuse_overhead'] or 0) + overhead
+                continue
+
+            task['executed'] += 1
+            wall_time = profile['wall_time'] or 0
+            task['total_wall_time'] += wall_time
+            task['max_wall_time'] = max(task['max_wall_time'] or 0, wall_time)
+            if profile['cpu_time'] is not None:
+                task['total_cpu_time'] = (task['total_cpu_time'] or 0) + profile['cpu_time']
+            if profile['peak_memory'] is not None:
+                task['peak_memory'] = max(task['peak_memory'] or 0, profile['peak_memory'])
+            if profile['result_size'] is not None:
+                task['result_size'] = profile['result_size']
+            # runs recorded before queue times were measured have none
+            if profile.get('queue_time') is not None:
+                task['total_queue_time'] = (task['total_queue_time'] or 0) + profile['queue_time']
+
+    for task in summary.values():
+        if task['reused']:
+            task['reuse_overhead'] /= task['reused']
+
+    return list(summary.values())
+
+
 @click.group()
 @click.option('--config-file', default=settings.YENTA_CONFIG_FILE, type=Path,
               help='The config file from which to read settings.')
-@click.option('--pipeline-store', type=Path, help='The directory to which the pipeline will be cached.')
+@click.option('--pipeline-store', type=str,
+              help='The directory to which the pipeline will be cached, or a sqlite:///<path> URL of a database.')
 @click.option('--entry-point', type=Path, help='The file containing the task definitions.')
 @click.option('--log-file', type=Path, help='The file to which the logs should be written.')
 def yenta(config_file, pipeline_store, entry_point, log_file):
 
-    init()
-
     # append the local path we're running from so that we can allow
     # the project to import normally when running via CLI
     sys.path.append(os.getcwd())
@@ -62,11 +203,20 @@ def yenta(config_file, pipeline_store, entry_point, log_file):
                                  cf['yenta'].get('entry_point', None) or \
                                  settings.YENTA_ENTRY_POINT
 
+    pipeline_store = str(pipeline_store) if pipeline_store else None
     pipeline_file = cf['yenta'].get('pipeline_store', None)
-    pipeline_path = Path(pipeline_file).resolve() if pipeline_file else None
-    settings.YENTA_STORE_PATH = pipeline_store or \
-                                pipeline_path or \
-                                settings.YENTA_STORE_PATH
+    if (pipeline_store or pipeline_file or '').startswith('sqlite:'):
+        from yenta.store.Store import sqlite_path
+
+        # the other caches are kept next to the database
+        settings.YENTA_STORE_URL = pipeline_store or pipeline_file
+        settings.YENTA_STORE_PATH = sqlite_path(settings.YENTA_STORE_URL).resolve().parent
+    else:
+        pipeline_path = Path(pipeline_file).resolve() if pipeline_file else None
+        settings.YENTA_STORE_URL = None if pipeline_store or pipeline_path else settings.YENTA_STORE_URL
+        settings.YENTA_STORE_PATH = (Path(pipeline_store) if pipeline_store else None) or \
+                                    pipeline_path or \
+                                    settings.YENTA_STORE_PATH
     conf_log_file = cf['yenta'].get('log_file', None)
     conf_log_path = Path(conf_log_file).resolve() if log_file else None
     settings.YENTA_LOG_FILE = log_file or \
@@ -78,30 +228,37 @@ def yenta(config_file, pipeline_store, entry_point, log_file):
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def list_tasks(pipeline_name='default'):
 
-    tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline = Pipeline(*tasks)
-    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name)
+    from yenta.store.Store import open_store
+
+    graph = load_task_graph(settings.YENTA_ENTRY_POINT)
+    task_names = [task['name'] for task in graph['tasks']]
+    statuses = load_task_statuses(open_store(pipeline_name), task_names)
 
-    print('[bold white]The following tasks are available:[/bold white]')
-    for task_name in pipeline.execution_order:
-        task_result = pipeline_data.task_results.get(task_name, None)
+    # styled with click rather than rich, which takes far longer to render long lists
+    lines = [click.style('The following tasks are available:', fg='white', bold=True)]
+    for task_name in task_names:
         marker = ' '
-        if task_result and task_result.status == TaskStatus.SUCCESS:
-            marker = f'[bold green]{CHECK_MARK}[/bold green]'
-        elif task_result and task_result.status == TaskStatus.FAILURE:
-            marker = f'[bold red]{X_MARK}[/bold red]'
+        if statuses[task_name] == SUCCESS:
+            marker = click.style(CHECK_MARK, fg='green', bold=True)
+        elif statuses[task_name] == FAILURE:
+            marker = click.style(X_MARK, fg='red', bold=True)
 
-        print(f'[{marker}] [bold white]{task_name}[/bold white]')
+        lines.append(f'[{marker}] ' + click.style(task_name, fg='white', bold=True))
+
+    click.echo('\n'.join(lines))
 
 
 @yenta.command(help='Show the current configuration.')
 def show_config():
 
+    from rich import print
+
     print('[bold white]Yenta is using the following configuration:[/bold white]')
     print(f'[bold white]The entrypoint for Yenta is [green]{settings.YENTA_ENTRY_POINT}[/green][/bold white]')
-    print(f'[bold white]Pipelines will be cached in [green]{settings.YENTA_STORE_PATH}[/green][/bold white]')
+    print(f'[bold white]Pipelines will be cached in '
+          f'[green]{settings.YENTA_STORE_URL or settings.YENTA_STORE_PATH}[/green][/bold white]')
     if settings.YENTA_LOG_FILE:
-        print('Log output will be written to ' + Fore.GREEN + str(settings.YENTA_LOG_FILE) + Fore.WHITE)
+        print(f'Log output will be written to [green]{settings.YENTA_LOG_FILE}[/green]')
     else:
         print('No log output configured')
 
@@ -111,48 +268,53 @@ def show_config():
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def task_info(task_name, pipeline_name='default'):
 
-    tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name)
-    try:
-        task = more_itertools.one(filter(lambda t: t.task_def.name == task_name, tasks))
-        print(f'[bold white]Information for task [green]{task_name}[/green]:[/bold white]')
-        deps = ', '.join(task.task_def.depends_on) if task.task_def.depends_on else 'None'
-        print(f'[bold white]Dependencies: [bright_blue]{deps}[/bright_blue][/bold white]')
-        task_result = pipeline_data.task_results.get(task_name, None)
-        marker = 'Did not run'
-        if task_result and task_result.status == TaskStatus.SUCCESS:
-            marker = Fore.GREEN + u'\u2714' + Fore.WHITE
-        elif task_result and task_result.status == TaskStatus.FAILURE:
-            marker = Fore.RED + u'\u2718' + ' ' + task_result.error + Fore.WHITE
-        print(f'Previous status: {marker}')
-
+    from rich import print
+    from rich.markup import escape
+    from rich.text import Text
+    from rich.tree import Tree
+    from yenta.store.Store import open_store
+
+    graph = load_task_graph(settings.YENTA_ENTRY_POINT)
+    task = next((task for task in graph['tasks'] if task['name'] == task_name), None)
+    if task is None:
+        print(f'[bold white]Unknown task [red]{escape(task_name)}[/red] specified.[/bold white]')
+        return
+
+    store = open_store(pipeline_name)
+    entry = store.entries().get(task_name, {})
+    if entry.get('ignored', False):
+        entry = {}
+    elif entry and 'status' not in entry:
+        # cached before the manifest recorded statuses, so the result itself has to be loaded
+        from yenta.store.Manifest import summarize_result
+        from yenta.pipeline.Pipeline import Pipeline
+
+        task_result = Pipeline.load_pipeline(store).task_results[task_name]
+        entry = {'status': task_result.status, 'error': task_result.error, 'summary': summarize_result(task_result)}
+
+    print(f'[bold white]Information for task [green]{task_name}[/green]:[/bold white]')
+    deps = ', '.join(task['depends_on']) if task['depends_on'] else 'None'
+    print(f'[bold white]Dependencies: [bright_blue]{deps}[/bright_blue][/bold white]')
+    status = entry.get('status', None)
+    marker = 'Did not run'
+    if status == SUCCESS:
+        marker = f'[green]{CHECK_MARK}[/green]'
+    elif status == FAILURE:
+        marker = f'[red]{X_MARK} {escape(entry.get("error", None) or "")}[/red]'
+    print(f'Previous status: {marker}')
+
+    if status == SUCCESS:
         tree = Tree('Previous result: ')
-        if task_result and task_result.status == TaskStatus.SUCCESS:
-            # print('Previous result: ', task_result)
-            values_node = tree.add('values')
-            for key in sorted(task_result.values.keys()):
-                val = task_result.values.get(key)
-                if isinstance(val, Iterable) and not isinstance(val, str):
-                    key_node = values_node.add(Text(f'{key}: '))
-                    for v in val:
-                        key_node.add(Text(str(v)))
-                else:
-                    values_node.add(Text(f'{key}: {val}'))
-            artifacts_node = tree.add('artifacts')
-            for key in sorted(task_result.artifacts.keys()):
-                val = task_result.artifacts.get(key)
-                if isinstance(val, Iterable) and not isinstance(val, str):
-                    key_node = artifacts_node.add(Text(f'{key}: '))
-                    for v in val:
-                        key_node.add(Text(v))
-                else:
-                    artifacts_node.add(Text(f'{key}: {val}'))
-            print(tree)
-        else:
-            print('Previous result: ' + Fore.GREEN + 'None' + Fore.WHITE)
-
-    except ValueError:
-        print(Fore.WHITE + Style.BRIGHT + 'Unknown task ' + Fore.RED + task_name + Fore.WHITE + ' specified.')
+        summary = entry.get('summary', {})
+        for kind in ['values', 'artifacts']:
+            node = tree.add(kind)
+            for key, description in sorted(summary.get(kind, {}).items()):
+                node.add(Text(f'{key}: {description}'))
+        if 'written' in entry:
+            tree.add(Text(f'written: {entry["written"]}'))
+        print(tree)
+    else:
+        print('Previous result: [green]None[/green]')
 
 
 @yenta.command(help='Remove a task from the pipeline cache.')
@@ -160,12 +322,17 @@ def task_info(task_name, pipeline_name='default'):
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def rm(task_name, pipeline_name='default'):
 
-    task_path = settings.YENTA_STORE_PATH / pipeline_name / task_name
+    from rich import print
+    from rich.markup import escape
+    from yenta.store.Store import open_store, is_element_entry
 
-    if task_path.exists():
-        shutil.rmtree(task_path)
-    else:
-        print(Fore.WHITE + Style.BRIGHT + 'Unknown task ' + Fore.RED + task_name + Fore.WHITE + ' specified.')
+    store = open_store(pipeline_name)
+    # the results of the elements of a mapped task go with it
+    for entry_name in store.entries():
+        if is_element_entry(entry_name, task_name):
+            store.remove(entry_name)
+    if not store.remove(task_name):
+        print(f'[bold white]Unknown task [red]{escape(task_name)}[/red] specified.[/bold white]')
 
 
 @yenta.command(help='Mark a task as ignorable; it will be skipped by the pipeline.')
@@ -173,28 +340,288 @@ def rm(task_name, pipeline_name='default'):
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def ignore(task_name, pipeline_name='default'):
 
-    tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    target_task = [task for task in tasks if task.task_def.name == task_name]
+    from rich import print
+    from yenta.store.Store import open_store
+
+    graph = load_task_graph(settings.YENTA_ENTRY_POINT)
+    target_task = [task for task in graph['tasks'] if task['name'] == task_name]
     if len(target_task) == 0:
         print(f'[bold white]Unknown task {task_name} specified.[/bold white]')
     elif len(target_task) > 1:
         print(f'[bold red]Multiple tasks have the same name: {task_name}. Task names must be unique '
               f'within a pipeline.[/bold red]')
     else:
-        ignore_path = settings.YENTA_STORE_PATH / pipeline_name / task_name / '.ignore'
-        ignore_path.parents[0].mkdir(parents=True, exist_ok=True)
-        ignore_path.touch(exist_ok=True)
+        open_store(pipeline_name).ignore(task_name)
         print(f'[bold white]Setting task {task_name} to be ignored.[/bold white]')
 
 
+@yenta.command(help='Protect the cached result of a task from garbage collection.')
+@click.argument('task-name')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline of the task.')
+@click.option('--unpin', is_flag=True, default=False, help='Stop protecting the result instead.')
+def pin(task_name, pipeline_name='default', unpin=False):
+
+    from rich import print
+    from rich.markup import escape
+    from yenta.store.Store import open_store
+
+    graph = load_task_graph(settings.YENTA_ENTRY_POINT)
+    if not any(task['name'] == task_name for task in graph['tasks']):
+        print(f'[bold white]Unknown task [red]{escape(task_name)}[/red] specified.[/bold white]')
+        return
+
+    open_store(pipeline_name).pin(task_name, not unpin)
+    action = 'no longer be protected' if unpin else 'be protected'
+    print(f'[bold white]The cached result of task {task_name} will {action} from garbage collection.[/bold white]')
+
+
+@yenta.command(help='Show how much space the cached results take up.')
+@click.option('--pipeline-name', default=None, help='Show the tasks of this pipeline instead of every pipeline.')
+def du(pipeline_name=None):
+
+    from rich import print
+    from rich.table import Table
+    from yenta.store.Eviction import cache_usage
+
+    results = cache_usage()
+    location = settings.YENTA_STORE_URL or settings.YENTA_STORE_PATH
+    if pipeline_name is None:
+        table = Table(title=f'Cache usage of {location}')
+        for column in ['Pipeline', 'Tasks', 'Pinned', 'Size']:
+            table.add_column(column, justify='left' if column == 'Pipeline' else 'right', no_wrap=True)
+        pipelines = {}
+        for result in results:
+            pipelines.setdefault(result.pipeline, []).append(result)
+        for name, tasks in sorted(pipelines.items(), key=lambda item: -sum(r.size for r in item[1])):
+            table.add_row(name, str(len(tasks)), str(sum(r.pinned for r in tasks)),
+                          format_bytes(sum(r.size for r in tasks)))
+    else:
+        results = [result for result in results if result.pipeline == pipeline_name]
+        table = Table(title=f'Cache usage of pipeline {pipeline_name}')
+        table.add_column('Task', no_wrap=True)
+        table.add_column('Size', justify='right')
+        table.add_column('Last used', no_wrap=True)
+        table.add_column('', no_wrap=True)
+        for result in sorted(results, key=lambda r: -r.size):
+            flags = ', '.join(flag for flag, is_set in [('pinned', result.pinned), ('latest run', result.in_latest_run)]
+                              if is_set)
+            last_used = result.last_used[:19].replace('T', ' ') if result.last_used else '-'
+            table.add_row(result.task, format_bytes(result.size), last_used, flags)
+
+    print(table)
+    print(f'[bold white]Total: {format_bytes(sum(result.size for result in results))} '
+          f'in {len(results)} cached results[/bold white]')
+
+
+@yenta.command(help='Evict cached results until the cache fits a budget.')
+@click.option('--budget', default=None,
+              help='The size the cache may take up, e.g. 500M or 10G; defaults to YENTA_STORE_BUDGET.')
+@click.option('--policy', default=None, type=click.Choice(['lru', 'age']),
+              help='Evict the least recently used or the oldest results first; defaults to YENTA_EVICTION_POLICY.')
+@click.option('--dry-run', is_flag=True, default=False, help='Only show which results would be evicted.')
+def gc(budget=None, policy=None, dry_run=False):
+
+    from rich import print
+    from yenta.store.Eviction import collect_garbage
+    from yenta.store.Store import StoreConfigError
+
+    budget = budget or settings.YENTA_STORE_BUDGET
+    if budget is None:
+        print('[bold red]No budget was given and YENTA_STORE_BUDGET is not set.[/bold red]')
+        return
+
+    try:
+        evicted = collect_garbage(budget, policy or settings.YENTA_EVICTION_POLICY, dry_run=dry_run)
+    except StoreConfigError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        return
+
+    verb = 'Would evict' if dry_run else 'Evicted'
+    for result in evicted:
+        print(f'{verb} {result.pipeline}/{result.task} ({format_bytes(result.size)})')
+    print(f'[bold white]{verb} {len(evicted)} cached results, '
+          f'{format_bytes(sum(result.size for result in evicted))} in total.[/bold white]')
+
+
+@yenta.command(help='Copy the cached results and run history of a pipeline to another store.')
+@click.argument('destination')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline to copy.')
+def migrate(destination, pipeline_name='default'):
+    """ Copy the cache of a pipeline to DESTINATION, which is either the directory under which the
+        pipeline gets its own directory, or a sqlite:///<path> URL of a database. """
+
+    from rich import print
+    from yenta.store.Store import open_store, migrate_store, StoreConfigError
+
+    try:
+        source = open_store(pipeline_name)
+        target = open_store(pipeline_name, destination)
+    except StoreConfigError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        return
+
+    if type(source) is type(target) and source.path.resolve() == target.path.resolve():
+        print('[bold red]The destination is the store the pipeline is already cached in.[/bold red]')
+        return
+
+    count = migrate_store(source, target)
+    print(f'[bold white]Copied {count} cached results of pipeline {pipeline_name} to '
+          f'[green]{destination}[/green].[/bold white]')
+
+
+@yenta.command(help='Serve a shared cache of task results over HTTP.')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--host', default='127.0.0.1', help='The address to listen on.')
+@click.option('--port', default=8765, type=click.IntRange(min=0), help='The port to listen on.')
+def serve_cache(directory, host='127.0.0.1', port=8765):
+    """ Serve the shared cache kept in DIRECTORY, so that pipelines run with
+        --shared-cache http://<host>:<port> share the results of their pure tasks.
+        Only clients with the same YENTA_SHARED_CACHE_SECRET are served, and
+        without a secret the cache can only be served on a loopback address. """
+
+    from rich import print
+    from yenta.store.SharedCache import SharedCacheError, serve_shared_cache
+
+    try:
+        server = serve_shared_cache(directory, host, port)
+    except SharedCacheError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(1)
+    print(f'[bold white]Serving the shared cache in [green]{directory}[/green] on '
+          f'http://{server.server_address[0]}:{server.server_address[1]}[/bold white]')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def duration_color(duration, longest):
+    """ Shade from white for the quickest tasks to red for the slowest. """
+    level = int(255 * (1 - duration / longest)) if longest > 0 else 255
+    return f'#ff{level:02x}{level:02x}'
+
+
 @yenta.command(help='Dump the task graph to a DOT file.')
 @click.argument('filename', type=click.Path())
-def dump_task_graph(filename: Path):
-
-    tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline = Pipeline(*tasks)
-    pydot_graph = to_pydot(pipeline.task_graph)
-    pydot_graph.write(filename)
+@click.option('--annotate', is_flag=True, default=False,
+              help='Label and color the tasks by their recorded durations and highlight the critical path.')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline whose runs to use.')
+@click.option('--runs', '-n', default=10, type=click.IntRange(min=1),
+              help='The number of recent runs from which to estimate task durations.')
+def dump_task_graph(filename: Path, annotate=False, pipeline_name='default', runs=10):
+
+    import networkx as nx
+    from networkx.drawing.nx_pydot import to_pydot
+
+    task_graph = task_graph_from(load_task_graph(settings.YENTA_ENTRY_POINT))
+    if not annotate:
+        pydot_graph = to_pydot(task_graph)
+        pydot_graph.write(filename)
+        return
+
+    from yenta.pipeline.Pipeline import Pipeline
+    from yenta.pipeline.critical_path import critical_path as compute_critical_path, task_durations
+    from yenta.store.Store import open_store
+
+    durations = task_durations(Pipeline.load_runs(open_store(pipeline_name), last=runs))
+    analysis = compute_critical_path(task_graph, durations)
+    longest = max(analysis.durations.values(), default=0)
+
+    graph = nx.DiGraph()
+    for task_name in task_graph.nodes:
+        known = task_name in durations
+        label = f'{task_name}\\n{format_seconds(analysis.durations[task_name]) if known else "no data"}'
+        if not analysis.is_critical(task_name):
+            label += f'\\nslack {format_seconds(analysis.slack[task_name])}'
+        graph.add_node(task_name, label=f'"{label}"', style='filled',
+                       fillcolor=f'"{duration_color(analysis.durations[task_name], longest)}"',
+                       penwidth=3 if analysis.is_critical(task_name) else 1)
+    critical_edges = set(zip(analysis.path, analysis.path[1:]))
+    for dependency, dependent in task_graph.edges:
+        critical = (dependency, dependent) in critical_edges
+        graph.add_edge(dependency, dependent, penwidth=3 if critical else 1, color='red' if critical else 'black')
+
+    to_pydot(graph).write(filename)
+
+
+@yenta.command(help='Show the critical path of the pipeline, based on recorded task durations.')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline whose runs to use.')
+@click.option('--runs', '-n', default=10, type=click.IntRange(min=1),
+              help='The number of recent runs from which to estimate task durations.')
+def critical_path(pipeline_name='default', runs=10):
+
+    from rich import print
+    from rich.table import Table
+    from yenta.pipeline.Pipeline import Pipeline
+    from yenta.pipeline.critical_path import critical_path as compute_critical_path, task_durations
+    from yenta.store.Store import open_store
+
+    graph = load_task_graph(settings.YENTA_ENTRY_POINT)
+    durations = task_durations(Pipeline.load_runs(open_store(pipeline_name), last=runs))
+    if not durations:
+        print(f'[bold white]No runs of pipeline {pipeline_name} have been recorded.[/bold white]')
+        return
+
+    analysis = compute_critical_path(task_graph_from(graph), durations)
+
+    table = Table(title=f'Critical path of {pipeline_name}')
+    table.add_column('', no_wrap=True)
+    table.add_column('Task', no_wrap=True)
+    for column in ['Duration', 'Start', 'Slack']:
+        table.add_column(column, justify='right')
+    for task_name in sorted(graph['execution_order'], key=lambda name: (analysis.earliest_start[name], name)):
+        critical = analysis.is_critical(task_name)
+        duration = format_seconds(analysis.durations[task_name]) if task_name in durations else 'no data'
+        table.add_row('[bold red]*[/bold red]' if critical else '',
+                      f'[bold]{task_name}[/bold]' if critical else task_name, duration,
+                      format_seconds(analysis.earliest_start[task_name]), format_seconds(analysis.slack[task_name]))
+
+    print(table)
+    print(f'[bold white]Critical path: {" -> ".join(analysis.path)}[/bold white]')
+    print(f'[bold white]Makespan lower bound: {format_seconds(analysis.makespan)}[/bold white]')
+    if len(durations) < len(graph['execution_order']):
+        print('[bold white]Tasks without recorded durations are assumed to take no time.[/bold white]')
+
+
+@yenta.command(help='Show where the time of recent pipeline runs went.')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
+@click.option('--runs', '-n', default=10, type=click.IntRange(min=1), help='The number of recent runs to include.')
+@click.option('--sort-by', default='wall', type=click.Choice(list(PROFILE_SORT_KEYS)),
+              help='The column by which to sort the tasks, largest first.')
+def profile(pipeline_name='default', runs=10, sort_by='wall'):
+
+    from rich import print
+    from rich.table import Table
+    from yenta.pipeline.Pipeline import Pipeline
+    from yenta.store.Store import open_store
+
+    history = Pipeline.load_runs(open_store(pipeline_name), last=runs)
+    if not history:
+        print(f'[bold white]No runs of pipeline {pipeline_name} have been recorded.[/bold white]')
+        return
+
+    key = PROFILE_SORT_KEYS[sort_by]
+    tasks = sorted(summarize_runs(history), key=lambda task: task[key] or 0, reverse=True)
+
+    table = Table(title=f'Task profiles over the last {len(history)} runs of {pipeline_name}')
+    table.add_column('Task', no_wrap=True)
+    for column in ['Runs', 'Reused', 'Wall', 'Max', 'CPU', 'Memory', 'Size', 'Overhead', 'Queued']:
+        table.add_column(column, justify='right')
+    for task in tasks:
+        name = f'[red]{task["task"]}[/red]' if task['failed'] else task['task']
+        table.add_row(name, str(task['executed']), str(task['reused']),
+                      format_seconds(task['total_wall_time']), format_seconds(task['max_wall_time']),
+                      format_seconds(task['total_cpu_time']), format_bytes(task['peak_memory']),
+                      format_bytes(task['result_size']), format_seconds(task['reuse_overhead']),
+                      format_seconds(task['total_queue_time']))
+
+    print(table)
+    if any(task['failed'] for task in tasks):
+        print('[bold white]Tasks that failed in any of the runs are shown in [red]red[/red].[/bold white]')
+    total = sum(run['wall_time'] for run in history)
+    print(f'[bold white]Total wall time: {format_seconds(total)}[/bold white]')
 
 
 @yenta.command(help='Run the pipeline.')
@@ -202,12 +629,69 @@ def dump_task_graph(filename: Path):
 @click.option('--force-rerun', '-f', multiple=True, default=[], help='Force specified tasks to rerun.')
 @click.option('--only', '-o', help='Only run the specified task and its dependencies.')
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to run.')
-def run(up_to=None, force_rerun=None, only=None, pipeline_name='default'):
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1),
+              help='The maximum number of tasks to execute concurrently.')
+@click.option('--processes', '-p', default=None, type=click.IntRange(min=1),
+              help='The maximum number of worker processes for tasks declared with executor=\'process\'; '
+                   'defaults to the number of CPUs.')
+@click.option('--write-behind', is_flag=True, default=False,
+              help='Write the pipeline cache on a background thread instead of after each task.')
+@click.option('--profile-memory', is_flag=True, default=False,
+              help='Record the peak memory allocated by each task, at the cost of slower execution.')
+@click.option('--store-budget', default=None,
+              help='Evict cached results after the run until the cache fits this size, e.g. 10G.')
+@click.option('--shared-cache', default=None,
+              help='A directory or http:// URL of a cache of pure task results shared with other machines; '
+                   'defaults to YENTA_SHARED_CACHE.')
+@click.option('--coordinator', is_flag=True, default=False,
+              help='Hand the tasks to workers started with `yenta worker` instead of executing them here.')
+@click.option('--listen', default='127.0.0.1:8766',
+              help='The address on which the coordinator waits for workers.')
+@click.option('--resources', default=None, callback=parse_resources,
+              help='The capacity of each resource that tasks declare, e.g. cpu=32,mem_gb=128.')
+@click.option('--priority', default='critical-path', type=click.Choice(['critical-path', 'order']),
+              help='Start the ready tasks with the longest estimated path to the end first, or in execution order.')
+def run(up_to=None, force_rerun=None, only=None, pipeline_name='default', jobs=1, processes=None,
+        write_behind=False, profile_memory=False, store_budget=None, shared_cache=None, coordinator=False,
+        listen='127.0.0.1:8766', resources=None, priority='critical-path'):
+
+    from contextlib import ExitStack
+    from colorama import init
+    from yenta.pipeline.Pipeline import Pipeline
+
+    init()
 
     logger.info('Running the pipeline')
     tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline = Pipeline(*tasks, name=pipeline_name)
-    result = pipeline.run_pipeline(up_to, force_rerun, only)
+    pipeline = Pipeline(*tasks, name=pipeline_name, write_behind=write_behind, profile_memory=profile_memory,
+                        store_budget=store_budget, shared_cache=shared_cache)
+    with ExitStack() as stack:
+        executor = None
+        if coordinator:
+            from yenta.pipeline.Distributed import Coordinator, parse_address
+            executor = stack.enter_context(Coordinator(*parse_address(listen)))
+            print(f'Waiting for workers on {executor.address[0]}:{executor.address[1]}')
+            if executor.generated_key:
+                print(f'Start the workers with YENTA_CLUSTER_KEY={executor.key}')
+        result = pipeline.run_pipeline(up_to, force_rerun, only, max_workers=jobs, max_processes=processes,
+                                       coordinator=executor, resources=resources, priority=priority)
+
+
+@yenta.command(help='Execute the tasks of a pipeline run with --coordinator.')
+@click.option('--connect', default='127.0.0.1:8766', help='The address of the coordinator.')
+@click.option('--timeout', default=60, type=click.FloatRange(min=0),
+              help='How many seconds to keep trying to connect to the coordinator.')
+def worker(connect='127.0.0.1:8766', timeout=60):
+
+    from rich import print
+    from yenta.pipeline.Distributed import DistributedError, parse_address, run_worker
+
+    try:
+        executed = run_worker(parse_address(connect), connect_timeout=timeout)
+    except DistributedError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(1)
+    print(f'[bold white]Executed {executed} tasks.[/bold white]')
 
 
 if __name__ == "__main__":
@@ -4,9 +4,20 @@ from pathlib import Path
 
 
 YENTA_STORE_PATH = Path('./.yenta_cache').resolve()
+YENTA_STORE_URL = os.environ.get('YENTA_STORE_URL', None)
 YENTA_ENTRY_POINT = os.environ.get('YENTA_ENTRY_POINT', Path('./main.py'))
 YENTA_CONFIG_FILE = os.environ.get('YENTA_CONFIG_FILE', Path('./yenta.config'))
 YENTA_LOG_FILE = os.environ.get('YENTA_LOG_FILE', None)
+YENTA_HASH_ALGORITHM = os.environ.get('YENTA_HASH_ALGORITHM', 'sha1')
+YENTA_MMAP_THRESHOLD = int(os.environ.get('YENTA_MMAP_THRESHOLD', 1 << 20))
+YENTA_COMPRESSION = os.environ.get('YENTA_COMPRESSION', None)
+YENTA_COMPRESSION_THRESHOLD = int(os.environ.get('YENTA_COMPRESSION_THRESHOLD', 1 << 12))
+YENTA_SHARED_CACHE = os.environ.get('YENTA_SHARED_CACHE', None)
+YENTA_SHARED_CACHE_SECRET = os.environ.get('YENTA_SHARED_CACHE_SECRET', None)
+YENTA_CLUSTER_KEY = os.environ.get('YENTA_CLUSTER_KEY', None)
+YENTA_STORE_BUDGET = os.environ.get('YENTA_STORE_BUDGET', None)
+YENTA_EVICTION_POLICY = os.environ.get('YENTA_EVICTION_POLICY', 'lru')
+YENTA_STREAM_BUFFER = int(os.environ.get('YENTA_STREAM_BUFFER', 4))
 
 VERBOSE = False
 
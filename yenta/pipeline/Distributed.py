@@ -0,0 +1,301 @@
+import logging
+import pickle
+import secrets
+import socket
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Optional, Tuple
+
+from yenta.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+HEARTBEAT_INTERVAL = 5.0
+""" How often, in seconds, a worker that is executing a task lets the coordinator know it is still alive."""
+
+DEFAULT_PORT = 8766
+
+
+class DistributedError(Exception):
+    pass
+
+
+def parse_address(address: str, default_host: str = '127.0.0.1') -> Tuple[str, int]:
+    """ Parse an address of the form `host:port`, `:port` or `port`.
+
+    :param str address: The address.
+    :param str default_host: The host to use if the address only has a port.
+    :return: The host and the port.
+    :rtype: Tuple[str, int]
+    """
+    host, _, port = str(address).rpartition(':')
+    try:
+        return host or default_host, int(port)
+    except ValueError:
+        raise DistributedError(f'Invalid address {address}, expected host:port')
+
+
+@dataclass
+class _Job:
+
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+
+
+class Coordinator(Executor):
+    """ An executor that hands the calls submitted to it to worker processes, which connect to it over
+        TCP with `run_worker`, possibly from other machines. Workers pull one call at a time, execute it,
+        and send back its result, so the pipeline that submits the calls keeps scheduling the tasks,
+        propagating failures and caching their results. Calls are handed out in the order they were
+        submitted; the calls of a worker that is lost, because its connection drops or because it stops
+        sending heartbeats, are handed to another worker, up to `max_attempts` times.
+
+        Calls and their results are pickled, so anyone who can connect can run code on the coordinator
+        and on the workers. Connections are authenticated with `key`, which defaults to
+        `settings.YENTA_CLUSTER_KEY`; if neither is set, a random key is generated, which is then
+        in `key` and has to be given to the workers. The coordinator must still only listen where
+        every worker can be trusted, since the connections are not encrypted. """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, max_attempts: int = 3,
+                 heartbeat_timeout: float = 6 * HEARTBEAT_INTERVAL, key: str = None):
+
+        self.max_attempts = max_attempts
+        self.heartbeat_timeout = heartbeat_timeout
+        self.key = key or settings.YENTA_CLUSTER_KEY or secrets.token_hex(16)
+        self.generated_key = not (key or settings.YENTA_CLUSTER_KEY)
+        self._listener = Listener((host, port), authkey=self.key.encode())
+        self.address = self._listener.address
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.workers = 0
+        self._accept_thread = threading.Thread(target=self._accept, name='yenta-coordinator', daemon=True)
+        self._accept_thread.start()
+        logger.info(f'Coordinator listening on {self.address[0]}:{self.address[1]}')
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+
+        job = _Job(fn, args, kwargs)
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError('Cannot submit calls to a coordinator that was shut down')
+            self._jobs.append(job)
+            self._condition.notify()
+        return job.future
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+
+        with self._condition:
+            if self._stopping:
+                return
+            self._stopping = True
+            for job in self._jobs:
+                job.future.cancel()
+            self._jobs.clear()
+            self._condition.notify_all()
+
+        # wake up the thread waiting for connections, which then sees that the coordinator is stopping
+        try:
+            socket.create_connection(self.address, timeout=1).close()
+        except OSError:
+            pass
+        if wait:
+            self._accept_thread.join()
+        self._listener.close()
+
+    def _accept(self) -> None:
+
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception as ex:
+                if self._stopping:
+                    return
+                logger.warning(f'Refused a worker connection: {ex}')
+                continue
+            if self._stopping:
+                connection.close()
+                return
+            threading.Thread(target=self._serve, args=(connection,), name='yenta-coordinator-worker',
+                             daemon=True).start()
+
+    def _next_job(self) -> Optional[_Job]:
+
+        with self._condition:
+            while not self._jobs and not self._stopping:
+                self._condition.wait()
+            return None if self._stopping else self._jobs.popleft()
+
+    def _requeue(self, job: _Job, reason: str) -> None:
+
+        if job.attempts >= self.max_attempts:
+            job.future.set_exception(DistributedError(f'Gave up after losing {job.attempts} workers: {reason}'))
+            return
+        logger.warning(f'Lost a worker ({reason}), handing its task to another worker')
+        with self._condition:
+            if self._stopping:
+                job.future.cancel()
+                return
+            # it was handed out first, so it goes before the calls that are still waiting
+            self._jobs.appendleft(job)
+            self._condition.notify()
+
+    def _serve(self, connection: Connection) -> None:
+
+        with self._condition:
+            self.workers += 1
+        job = None
+        try:
+            while True:
+                # a worker asks for a call whenever it is idle
+                message = connection.recv()
+                if message[0] == 'heartbeat':
+                    continue
+                elif message[0] != 'ready':
+                    raise DistributedError(f'Unexpected message {message[0]} from a worker')
+
+                job = self._send_job(connection)
+                if job is None:
+                    connection.send(('stop',))
+                    return
+
+                while True:
+                    if not connection.poll(self.heartbeat_timeout):
+                        raise TimeoutError(f'no heartbeat for {self.heartbeat_timeout} seconds')
+                    message = connection.recv()
+                    if message[0] != 'heartbeat':
+                        break
+
+                kind, value = message
+                if kind == 'result':
+                    job.future.set_result(value)
+                else:
+                    job.future.set_exception(value)
+                job = None
+        except (EOFError, OSError, TimeoutError, DistributedError) as ex:
+            if job is not None:
+                self._requeue(job, str(ex) or type(ex).__name__)
+        except Exception as ex:
+            # e.g. a result that cannot be unpickled here, which another worker would not fix
+            if job is not None:
+                job.future.set_exception(DistributedError(f'Could not receive the result from a worker: {ex}'))
+        finally:
+            connection.close()
+            with self._condition:
+                self.workers -= 1
+
+    def _send_job(self, connection: Connection) -> Optional[_Job]:
+
+        while True:
+            job = self._next_job()
+            if job is None:
+                return None
+            if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                message = pickle.dumps(('job', job.fn, job.args, job.kwargs))
+            except Exception as ex:
+                job.future.set_exception(DistributedError(f'Could not send a call to a worker: {ex}'))
+                continue
+            job.attempts += 1
+            try:
+                connection.send_bytes(message)
+            except BaseException:
+                self._requeue(job, 'could not send the call')
+                raise
+            return job
+
+
+def _connect(address: Tuple[str, int], timeout: float, key: str) -> Connection:
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(address, authkey=key.encode())
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise DistributedError(f'Could not connect to a coordinator on {address[0]}:{address[1]}')
+            time.sleep(0.2)
+
+
+def _heartbeat(connection: Connection, lock: threading.Lock, done: threading.Event, interval: float) -> None:
+
+    while not done.wait(interval):
+        with lock:
+            try:
+                connection.send(('heartbeat',))
+            except OSError:
+                return
+
+
+def _can_unpickle(obj: Any) -> bool:
+
+    try:
+        pickle.loads(pickle.dumps(obj))
+        return True
+    except Exception:
+        return False
+
+
+def run_worker(address: Tuple[str, int], connect_timeout: float = 60,
+               heartbeat_interval: float = HEARTBEAT_INTERVAL, key: str = None) -> int:
+    """ Connect to a coordinator and execute the calls it hands out until it stops. The tasks are
+        located in the worker by their module or by the file they were defined in, so each worker
+        needs the tasks at the same path as the coordinator, or installed as an importable module.
+
+    :param address: The host and port of the coordinator.
+    :param float connect_timeout: How long to keep trying to connect, in case the coordinator has not started yet.
+    :param float heartbeat_interval: How often to let the coordinator know the worker is alive while it executes a call.
+    :param str key: The key of the coordinator, which defaults to `settings.YENTA_CLUSTER_KEY`.
+    :return: The number of calls executed.
+    :rtype: int
+    """
+    key = key or settings.YENTA_CLUSTER_KEY
+    if not key:
+        raise DistributedError('Set YENTA_CLUSTER_KEY to the key of the coordinator')
+    connection = _connect(address, connect_timeout, key)
+    lock = threading.Lock()
+    executed = 0
+    try:
+        while True:
+            with lock:
+                connection.send(('ready',))
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+
+            _, fn, args, kwargs = message
+            done = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat, args=(connection, lock, done, heartbeat_interval),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                reply = ('result', fn(*args, **kwargs))
+            except Exception as ex:
+                reply = ('error', ex if _can_unpickle(ex) else DistributedError(str(ex)))
+            finally:
+                done.set()
+                heartbeat.join()
+            executed += 1
+
+            with lock:
+                try:
+                    connection.send(reply)
+                except Exception as ex:
+                    connection.send(('error', DistributedError(f'Could not send the result back: {ex}')))
+    finally:
+        connection.close()
+
+    return executed
@@ -1,15 +1,25 @@
+import asyncio
+import heapq
+import inspect
 import io
-import json
 import logging
+import multiprocessing
+import os
 import tempfile
-import pickle
-import shutil
-
-from dataclasses import dataclass, field, asdict
+import time
+import tracemalloc
+
+from collections import Counter
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack
+from copy import copy
+from dataclasses import dataclass, field, asdict, replace
+from datetime import datetime
 from enum import Enum
+from functools import partial
 from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Union, Any
+from typing import Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional, Set, Union, Any
 
 import networkx as nx
 from colorama import Fore, Style
@@ -17,7 +27,21 @@ from more_itertools import split_after
 
 from yenta.artifacts.Artifact import Artifact
 from yenta.config import settings
-from yenta.tasks.Task import TaskDef, ParameterType, ResultSpec
+from yenta.pipeline.critical_path import remaining_lengths, task_durations
+from yenta.pipeline.Stream import Stream, StreamError
+from yenta.store.Compression import Codec, CompressedPartReader, CompressionError, compress_parts, get_codec
+from yenta.store.Eviction import collect_garbage, parse_size
+from yenta.store.Manifest import summarize_result
+from yenta.store.SharedCache import SharedCache, SharedCacheError, open_shared_cache
+from yenta.store.Serializer import (
+    Serializer, PartReader, NpySerializer, get_serializer, SERIALIZERS, DEFAULT_SERIALIZER
+)
+from yenta.store.Store import (
+    Store, FileStore, StoreConfigError, open_store, element_entry_name, chunk_entry_name, is_element_entry
+)
+from yenta.store.Writer import CacheWriter
+from yenta.tasks.Task import TaskDef, ParameterType, ResultSpec, ResultType, TaskExecutor, TaskReference
+from yenta.utils.fingerprint import fingerprint, combine_fingerprints
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +57,107 @@ class PipelineConfigError(Exception):
     pass
 
 
+class MappedTaskError(Exception):
+    pass
+
+
 class TaskStatus(str, Enum):
 
     SUCCESS = 'success'
     FAILURE = 'failure'
 
 
+class TaskPriority(str, Enum):
+    """ How the pipeline chooses between tasks that are ready at the same time. """
+
+    CRITICAL_PATH = 'critical-path'
+    """ The tasks with the longest path of estimated durations to the end of the pipeline go first."""
+
+    ORDER = 'order'
+    """ The tasks go in execution order."""
+
+
+PRIORITY_HISTORY = 10
+""" The number of recent runs from which the durations of the tasks are estimated to prioritize them."""
+
+
+@dataclass
+class TaskProfile:
+    """ Measurements taken while producing a task result. Times are in seconds and sizes in bytes. """
+
+    wall_time: float = None
+    """ How long the task took to execute."""
+
+    cpu_time: float = None
+    """ The CPU time spent executing the task, or None for tasks that are coroutine functions."""
+
+    peak_memory: int = None
+    """ The peak Python memory allocated while executing the task, if memory profiling was enabled."""
+
+    result_size: int = None
+    """ The size of the serialized result in the cache."""
+
+    reused: bool = False
+    """ Whether the result was reused from a previous run instead of being computed."""
+
+    reuse_check_time: float = None
+    """ How long it took to decide to reuse the result, not counting the time to load it."""
+
+    load_time: float = None
+    """ How long it took to load the result from the cache."""
+
+    shared: bool = False
+    """ Whether the reused result was fetched from the shared cache rather than the pipeline's own."""
+
+    queue_time: float = None
+    """ How long the task waited, once its dependencies had finished, for a worker or for its resources."""
+
+    elements: int = None
+    """ For a mapped task, the number of elements it was mapped over."""
+
+    elements_reused: int = None
+    """ For a mapped task, the number of elements whose results were reused instead of being computed."""
+
+
+def _reset_peak_memory() -> None:
+    """ Make the peak allocation traced by tracemalloc the current one. Python 3.8 and older have
+        no `tracemalloc.reset_peak`, so there tracing is restarted instead, which forgets the traces. """
+
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        frames = tracemalloc.get_traceback_limit()
+        tracemalloc.stop()
+        tracemalloc.start(frames)
+
+
+class _Profiler:
+    """ Measures the wall time, CPU time and, if tracemalloc is tracing, the peak allocation of
+        a task execution. CPU time is measured for the current thread only, so that tasks executing
+        concurrently on other threads are not counted; the peak allocation is global, and so only
+        reliable when tasks execute one at a time. """
+
+    def __init__(self, cpu: bool = True):
+        self.cpu = cpu
+        self.profile = TaskProfile()
+
+    def __enter__(self) -> TaskProfile:
+        self._memory = tracemalloc.is_tracing()
+        if self._memory:
+            _reset_peak_memory()
+            self._base_memory = tracemalloc.get_traced_memory()[0]
+        self._cpu_start = time.thread_time() if self.cpu else None
+        self._wall_start = time.perf_counter()
+        return self.profile
+
+    def __exit__(self, *exc_info):
+        self.profile.wall_time = time.perf_counter() - self._wall_start
+        if self.cpu:
+            self.profile.cpu_time = time.thread_time() - self._cpu_start
+        if self._memory and tracemalloc.is_tracing():
+            self.profile.peak_memory = max(tracemalloc.get_traced_memory()[1] - self._base_memory, 0)
+
+
 @dataclass
 class TaskResult:
     """ Holds the result of a specific task execution """
@@ -55,17 +174,128 @@ class TaskResult:
     error: str = None
     """ Error message associated with task failure."""
 
+    profile: Optional[TaskProfile] = field(default=None, compare=False)
+    """ How long the task took and how much memory it used. Not considered when comparing results."""
+
+
+class _Deferred:
+    """ A value that is computed by calling `loader` the first time it is needed. The
+        computed value is shared by every LazyDict that holds this instance. """
+
+    __slots__ = ('loader', 'value', 'loaded')
+
+    def __init__(self, loader: Callable[[], Any]):
+        self.loader = loader
+        self.value = None
+        self.loaded = False
+
+    def get(self):
+        if not self.loaded:
+            self.value = self.loader()
+            self.loaded = True
+            self.loader = None
+        return self.value
+
+
+class LazyDict(MutableMapping):
+    """ A dictionary whose values can be deferred, i.e. supplied as a loader function
+        that is only called the first time the value is accessed. Membership tests,
+        iteration over keys and copies never load any values. """
+
+    def __init__(self, *args, **kwargs):
+        self._data = {}
+        self.update(*args, **kwargs)
+
+    def defer(self, key: str, loader: Callable[[], Any]) -> None:
+        """ Set the value of `key` to be the result of calling `loader` when first accessed.
+
+        :param str key: The key.
+        :param Callable loader: A function of no arguments that produces the value.
+        :return: None
+        """
+        self._data[key] = _Deferred(loader)
+
+    def is_loaded(self, key: str) -> bool:
+        """ Whether the value of `key` has already been loaded.
+
+        :param str key: The key.
+        :return: True or False
+        :rtype: bool
+        """
+        value = self._data[key]
+        return not isinstance(value, _Deferred) or value.loaded
+
+    def copy(self) -> 'LazyDict':
+        """ Make a shallow copy which shares any deferred values with this one. """
+        other = LazyDict()
+        other._data = self._data.copy()
+        return other
+
+    def subset(self, keys: Iterable[str]) -> 'LazyDict':
+        """ Make a shallow copy of only some of the keys, which shares any deferred values with this one.
+
+        :param keys: The keys to copy.
+        :return: The copy.
+        :rtype: LazyDict
+        """
+        other = LazyDict()
+        other._data = {key: self._data[key] for key in keys}
+        return other
+
+    __copy__ = copy
+
+    def update(self, *args, **kwargs):
+        if len(args) == 1 and isinstance(args[0], LazyDict) and not kwargs:
+            self._data.update(args[0]._data)
+        else:
+            super().update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        if isinstance(value, _Deferred):
+            return value.get()
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        items = ', '.join(f'{key!r}: {self[key]!r}' if self.is_loaded(key) else f'{key!r}: <not loaded>'
+                          for key in self._data)
+        return f'{{{items}}}'
+
 
 @dataclass
 class PipelineResult:
     """ Holds the intermediate results of a step in the pipeline, where the keys of the dicts
         are the names of the tasks that have been executed and the values are TaskResults"""
 
-    task_results: Dict[str, TaskResult] = field(default_factory=dict)
+    task_results: MutableMapping[str, TaskResult] = field(default_factory=dict)
     """ A dictionary whose keys are task names and whose values are the results of that task execution."""
 
-    task_inputs: Dict[str, 'PipelineResult'] = field(default_factory=dict)
-    """ A dictionary whose keys are task names and whose values are the inputs used in executing that task."""
+    task_inputs: MutableMapping[str, str] = field(default_factory=dict)
+    """ A dictionary whose keys are task names and whose values are fingerprints of the inputs used in
+        executing that task."""
+
+    task_fingerprints: MutableMapping[str, str] = field(default_factory=dict)
+    """ A dictionary whose keys are task names and whose values are fingerprints of the results of
+        that task execution."""
+
+    task_statuses: MutableMapping[str, str] = field(default_factory=dict)
+    """ A dictionary whose keys are task names and whose values are the statuses of their results, which
+        are known without loading the results."""
 
     def values(self, task_name: str, value_name: str):
         """ Return the value named `value_name` that was produced by task `task_name`.
@@ -98,26 +328,88 @@ class PipelineResult:
         return func(spec.result_task_name, spec.result_var_name)
 
 
+def _invoke_in_process(task_ref: TaskReference, args_dict: Dict[str, Any], profile_memory: bool = False) -> TaskResult:
+    """ Execute a task in a worker process. The task is shipped by reference and
+        resolved inside the worker, since the task function itself may live in a
+        module that only exists in the parent process.
+
+    :param TaskReference task_ref: The reference to the task.
+    :param dict args_dict: The arguments obtained from `build_args_dict`.
+    :param bool profile_memory: Whether to measure the peak memory allocated by the task.
+    :return: The task result
+    :rtype: TaskResult
+    """
+
+    task = task_ref.resolve()
+    if profile_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    with _Profiler() as profile:
+        output = Pipeline._wrap_task_output(task(**args_dict), task.task_def.name)
+    output.profile = profile
+    return output
+
+
+class _InlineExecutor(Executor):
+    """ An executor that runs every submitted call immediately on the calling thread.
+        Used when the pipeline runs with a single worker, so that tasks keep executing
+        on the main thread exactly as they would without a pool. """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+
 class Pipeline:
 
-    def __init__(self, *tasks, name='default'):
+    def __init__(self, *tasks, name='default', write_behind: bool = False, max_pending_writes: int = 16,
+                 serializer: str = None, profile_memory: bool = False, store_budget: Union[str, int] = None,
+                 compression: str = None, compression_threshold: int = None,
+                 shared_cache: Union[str, Path, SharedCache] = None):
 
         self._tasks = tasks
         self.task_graph = nx.DiGraph()
         self.execution_order = []
         self.name = name
-        self.store_path = settings.YENTA_STORE_PATH / self.name
+        self.store = open_store(self.name)
+        self.store_path = self.store.path
 
-        self.store_path.mkdir(exist_ok=True, parents=True)
+        self.store.create()
 
         self.build_task_graph()
 
         self._tasks_executed = set()
         self._tasks_reused = set()
+        self._shared_fingerprints = {}
+        self._shared_namespaces = {}
+        self._writer = CacheWriter(max_pending_writes) if write_behind else None
+
+        if serializer is not None and serializer not in SERIALIZERS:
+            raise PipelineConfigError(f'Unknown serializer {serializer}, expected one of: {", ".join(SERIALIZERS)}')
+        self.serializer = serializer
+        self.profile_memory = profile_memory
+
+        try:
+            # the setting is only used if the pipeline has no codec of its own
+            get_codec(compression or settings.YENTA_COMPRESSION)
+        except CompressionError as ex:
+            raise PipelineConfigError(str(ex)) from ex
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.shared_cache = open_shared_cache(shared_cache if shared_cache is not None
+                                              else settings.YENTA_SHARED_CACHE)
+
+        try:
+            self.store_budget = parse_size(store_budget if store_budget is not None else settings.YENTA_STORE_BUDGET)
+        except StoreConfigError as ex:
+            raise PipelineConfigError(str(ex)) from ex
 
     def _clear_pipeline_cache(self):
         """ Delete the pipeline cache. Only used for testing purposes. """
-        shutil.rmtree(self.store_path)  # pragma: no cover
+        self.store.clear()  # pragma: no cover
 
     def build_task_graph(self) -> None:
         """ Construct the task graph for the pipeline
@@ -158,11 +450,12 @@ class Pipeline:
         return output
 
     @staticmethod
-    def build_args_dict(task, args: PipelineResult) -> Dict[str, Any]:
+    def build_args_dict(task, args: PipelineResult, streams: Dict[str, Iterable] = None) -> Dict[str, Any]:
         """ Build the args dictionary for executing a task.
 
         :param task: The task itself, which has a `task_def` attached to it.
         :param PipelineResult args: The results of the pipeline up to this point
+        :param Dict[str, Iterable] streams: The chunks of each streaming task that the task consumes.
         :return: A dictionary whose keys correspond to the arguments expected by
                 the task to be executed, and whose values are the values to be
                 passed in.
@@ -179,6 +472,8 @@ class Pipeline:
             elif spec.param_type == ParameterType.EXPLICIT:
                 if spec.selector:
                     args_dict[spec.param_name] = spec.selector(args)
+                elif spec.result_spec and spec.result_spec.result_type == ResultType.STREAM:
+                    args_dict[spec.param_name] = streams[spec.result_spec.result_task_name]
                 elif spec.result_spec:
                     args_dict[spec.param_name] = args.from_spec(spec.result_spec)
 
@@ -193,8 +488,25 @@ class Pipeline:
         :rtype: TaskResult
         """
 
-        output = task(**kwargs)
-        return self._wrap_task_output(output, task.task_def.name)
+        with _Profiler() as profile:
+            output = self._wrap_task_output(task(**kwargs), task.task_def.name)
+        output.profile = profile
+        return output
+
+    async def ainvoke_task(self, task, **kwargs) -> TaskResult:
+        """ Await the coroutine function that represents the task with the supplied kwargs.
+
+        :param Callable task: The task coroutine function.
+        :param dict kwargs: The arguments obtained from `build_args`.
+        :return: The task result
+        :rtype: TaskResult
+        """
+
+        # other tasks run on the same thread while this one is suspended, so its CPU time is unknown
+        with _Profiler(cpu=False) as profile:
+            output = self._wrap_task_output(await task(**kwargs), task.task_def.name)
+        output.profile = profile
+        return output
 
     @staticmethod
     def merge_pipeline_results(res1: PipelineResult, res2: PipelineResult) -> PipelineResult:
@@ -208,115 +520,665 @@ class Pipeline:
         :rtype: PipelineResult
         """
 
-        return PipelineResult(task_results={**res1.task_results, **res2.task_results},
-                              task_inputs={**res1.task_inputs, **res2.task_inputs})
+        # copying instead of unpacking keeps any values of a lazily loaded result unloaded
+        task_results = copy(res1.task_results)
+        task_results.update(res2.task_results)
+        task_inputs = copy(res1.task_inputs)
+        task_inputs.update(res2.task_inputs)
+        task_fingerprints = copy(res1.task_fingerprints)
+        task_fingerprints.update(res2.task_fingerprints)
+        task_statuses = copy(res1.task_statuses)
+        task_statuses.update(res2.task_statuses)
+
+        return PipelineResult(task_results=task_results, task_inputs=task_inputs,
+                              task_fingerprints=task_fingerprints, task_statuses=task_statuses)
+
+    def serializer_for(self, task_name: str, task_result: TaskResult = None) -> Serializer:
+        """ The serializer with which the result of a task is cached: the one the task
+            was declared with, if any, and otherwise the one of the pipeline. If neither
+            chose a serializer, results holding arrays of at least `settings.YENTA_MMAP_THRESHOLD`
+            bytes are cached with the npy serializer, so that they can be memory mapped, and
+            all other results are pickled.
+
+        :param str task_name: The name of the task.
+        :param TaskResult task_result: The result to be cached, if known.
+        :return: The serializer.
+        :rtype: Serializer
+        """
+        task = self.task_graph.nodes.get(task_name, {}).get('task', None)
+        name = (task and task.task_def.serializer) or self.serializer
+        if name is None:
+            large_arrays = task_result is not None and any(
+                value.nbytes >= settings.YENTA_MMAP_THRESHOLD for _, _, value in NpySerializer.array_parts(task_result)
+            )
+            name = NpySerializer.name if large_arrays else DEFAULT_SERIALIZER
+
+        return get_serializer(name)
+
+    def codec_for(self, task_name: str) -> Optional[Codec]:
+        """ The codec with which the large parts of the result of a task are compressed: the one
+            the task was declared with, if any, then the one of the pipeline, and otherwise the one
+            set by `settings.YENTA_COMPRESSION`. Results are not compressed unless one of these is set.
+
+        :param str task_name: The name of the task.
+        :return: The codec, or None if the result should not be compressed.
+        :rtype: Codec
+        """
+        task = self.task_graph.nodes.get(task_name, {}).get('task', None)
+        spec = (task and task.task_def.compression) or self.compression or settings.YENTA_COMPRESSION
+        try:
+            return get_codec(spec)
+        except CompressionError as ex:
+            raise PipelineConfigError(str(ex)) from ex
 
     def cache_result(self, task_name: str, result: PipelineResult):
-        """ Write the pipeline results to a file.
+        """ Write the pipeline results to the store. If the pipeline was created with
+            `write_behind=True`, the write is only queued; see `flush_cache`. Otherwise,
+            large arrays written by the npy serializer to files are swapped for read-only
+            memory maps of these files, which is what the downstream tasks then receive.
 
         :param Path task_name: The name of the task to cache.
         :param PipelineResult result: The results.
         :return: None
         """
-        task_path = self.store_path / task_name
-        task_path.mkdir(exist_ok=True, parents=True)
+        task_result = result.task_results[task_name]
+        self._cache_entry(task_name, task_name, task_result, result.task_inputs.get(task_name, None),
+                          result.task_fingerprints.get(task_name, None))
+
+    def _cache_entry(self, task_name: str, entry_name: str, task_result: TaskResult, inputs: Optional[str],
+                     result_fingerprint: Optional[str], share: bool = True, behind: bool = True) -> None:
+        """ Write a result to the store under `entry_name`, with the serializer and codec of `task_name`,
+            behind the pipeline if it writes behind and `behind` is set. """
+
+        serializer = self.serializer_for(task_name, task_result)
+        codec = self.codec_for(task_name)
+        task = self.task_graph.nodes.get(task_name, {}).get('task', None)
+        shared_cache = self.shared_cache if share and task is not None and task.task_def.pure else None
+        threshold = settings.YENTA_COMPRESSION_THRESHOLD if self.compression_threshold is None \
+            else self.compression_threshold
+        meta = {'inputs': inputs, 'result': result_fingerprint or fingerprint(task_result),
+                'serializer': serializer.name, 'status': task_result.status}
+
+        namespace = self.shared_namespace(task_name) if shared_cache is not None else None
+
+        if self._writer and behind:
+            self._writer.submit(self._write_task_cache, self.store, entry_name, task_result, meta, serializer,
+                                codec, threshold, shared_cache, namespace)
+        else:
+            entry = self._write_task_cache(self.store, entry_name, task_result, meta, serializer, codec, threshold,
+                                           shared_cache, namespace)
+            if entry is not None and isinstance(serializer, NpySerializer):
+                serializer.map_arrays(task_result, self._reader(self.store, entry_name, entry))
+
+    @staticmethod
+    def _write_task_cache(store: Store, task_name: str, task_result: TaskResult, meta: Dict[str, Any],
+                          serializer: Serializer, codec: Codec = None, threshold: int = 0,
+                          shared_cache: SharedCache = None, namespace: str = None) -> Optional[Dict[str, Any]]:
+        """ Serialize, compress and store a result. A result that cannot be serialized or compressed
+            is left uncached, and None is returned, rather than failing the whole pipeline. """
+
+        try:
+            parts = serializer.dumps(task_result)
+            if codec is not None:
+                parts, codecs = compress_parts(parts, codec, threshold)
+                if codecs:
+                    meta['codecs'] = codecs
+        except Exception as ex:
+            # values that cannot be pickled, such as locks or local functions, mostly raise
+            # TypeError or AttributeError rather than a serialization error
+            logger.warning(f'Could not cache the result of {task_name}: {ex!r}')
+            # an older result must not be reused in place of the one that could not be written
+            store.remove(task_name)
+            if shared_cache is not None:
+                shared_cache.release(task_name, meta['inputs'], namespace)
+            return None
+        except BaseException:
+            if shared_cache is not None:
+                shared_cache.release(task_name, meta['inputs'], namespace)
+            raise
+
+        try:
+            size = sum(memoryview(chunk).nbytes for chunks in parts.values() for chunk in chunks)
+            if task_result.profile is not None:
+                task_result.profile.result_size = size
+
+            meta['parts'] = sorted(parts)
+            meta['size'] = size
+            details = {'error': task_result.error, 'summary': summarize_result(task_result)}
+            entry = store.write(task_name, parts, meta, **details)
+        except BaseException:
+            if shared_cache is not None:
+                shared_cache.release(task_name, meta['inputs'], namespace)
+            raise
+
+        # artifacts refer to files on this machine, so results holding them are not shared
+        if shared_cache is not None and task_result.status == TaskStatus.SUCCESS and not task_result.artifacts:
+            try:
+                shared_cache.publish(task_name, meta['inputs'], parts, meta, details, namespace)
+            except (SharedCacheError, OSError) as ex:
+                logger.warning(f'Could not publish the result of {task_name} to the shared cache: {ex}')
+        elif shared_cache is not None:
+            shared_cache.release(task_name, meta['inputs'], namespace)
+
+        return entry
+
+    def flush_cache(self) -> None:
+        """ Wait until every queued cache write has been written to disk. Does nothing
+            unless the pipeline was created with `write_behind=True`.
+
+        :raises CacheWriteError: If any of the queued writes failed.
+        :return: None
+        """
+        if self._writer:
+            self._writer.flush()
+
+    @staticmethod
+    def _reader(store: Store, task_name: str, entry: Dict[str, Any]) -> PartReader:
 
-        task_cache = task_path / 'result.pk'
-        with open(task_cache, 'wb') as f:
-            pickle.dump(result.task_results[task_name], f)
+        # the codec of every compressed part is recorded, so results compressed with different
+        # codecs, or not at all, can be mixed in the same store
+        reader = store.reader(task_name, entry)
+        return CompressedPartReader(reader, entry['codecs']) if entry.get('codecs', None) else reader
 
-        task_cache = task_path / 'inputs.pk'
-        with open(task_cache, 'wb') as f:
-            pickle.dump(result.task_inputs[task_name], f)
+    @staticmethod
+    def _load_task_result(store: Store, task_name: str, entry: Dict[str, Any]) -> TaskResult:
+        # results cached before serializers were recorded were always plain pickles
+        serializer = get_serializer(entry.get('serializer', DEFAULT_SERIALIZER))
+        start = time.perf_counter()
+        task_result = serializer.loads(Pipeline._reader(store, task_name, entry))
+        # results cached before profiles were recorded have none
+        task_result.profile = task_result.profile or TaskProfile()
+        task_result.profile.load_time = time.perf_counter() - start
+        task_result.profile.result_size = entry.get('size', None)
+        return task_result
 
     @staticmethod
-    def load_pipeline(store_path: Path) -> PipelineResult:
-        """ Load a pipeline from file.
+    def load_pipeline(store: Union[Path, Store]) -> PipelineResult:
+        """ Load a pipeline from its store. The tasks, their fingerprints, statuses and metadata
+            are read from the index of the store; the cached results of each task are only
+            deserialized the first time they are accessed.
 
+        :param store: The store of the pipeline, or the directory of a `FileStore`.
         :return: The pipeline.
         :rtype: PipelineResult
         """
-        logger.debug(f'Loading pipeline from {store_path}')
-        pipeline = PipelineResult()
-        if store_path.exists():
-            for task_path in store_path.iterdir():
-                ignore_file = task_path / '.ignore'
-                if task_path.is_dir() and not ignore_file.exists():
-                    task_name = task_path.stem
-                    with open(task_path / 'inputs.pk', 'rb') as f:
-                        inputs = pickle.load(f)
-                    with open(task_path / 'result.pk', 'rb') as f:
-                        result = pickle.load(f)
-                    pipeline.task_inputs[task_name] = inputs
-                    pipeline.task_results[task_name] = result
+        store = store if isinstance(store, Store) else FileStore(store)
+        logger.debug(f'Loading pipeline from {store.path}')
+        pipeline = PipelineResult(task_results=LazyDict(), task_inputs=LazyDict(), task_fingerprints=LazyDict())
+        for task_name, entry in store.entries().items():
+            if entry.get('ignored', False) or is_element_entry(task_name):
+                continue
+            pipeline.task_inputs[task_name] = entry.get('inputs', None)
+            pipeline.task_fingerprints[task_name] = entry.get('result', None)
+            pipeline.task_statuses[task_name] = entry.get('status', None)
+            pipeline.task_results.defer(task_name, partial(Pipeline._load_task_result, store, task_name, entry))
 
         return pipeline
 
     @staticmethod
-    def reuse_inputs(task_name: str, previous_result: PipelineResult, args: PipelineResult) -> bool:
+    def input_fingerprint(args: PipelineResult) -> str:
+        """ Compute the fingerprint of the inputs of a task from the fingerprints of the
+            results of its dependencies, without looking at the results themselves unless
+            their fingerprint is unknown.
+
+        :param PipelineResult args: The arguments with which the task is being called.
+        :return: The fingerprint.
+        :rtype: str
+        """
+        return combine_fingerprints({task_name: args.task_fingerprints.get(task_name, None) or
+                                     fingerprint(args.task_results[task_name]) for task_name in args.task_results})
+
+    @staticmethod
+    def reuse_inputs(task_name: str, previous_result: PipelineResult, input_fingerprint: str) -> bool:
         """ Determine whether inputs from the previous instance of this task should be reused
             or whether the task should be executed again.
 
         :param str task_name: The name of the task.
         :param PipelineResult previous_result: The previous pipeline result.
-        :param PipelineResult args: The arguments with which this task is being called.
+        :param str input_fingerprint: The fingerprint of the arguments with which this task is being called.
         :return: True or False
         :rtype: bool
         """
         previous_inputs = previous_result.task_inputs.get(task_name, None)
-        if previous_inputs and previous_result.task_results.get(task_name).status == TaskStatus.SUCCESS:
-            return previous_inputs == args
+        if previous_inputs is None or previous_inputs != input_fingerprint:
+            return False
+
+        status = previous_result.task_statuses.get(task_name, None)
+        if status is None:
+            # results cached before their statuses were indexed only have them in the result itself
+            try:
+                status = previous_result.task_results[task_name].status
+            except FileNotFoundError:
+                # the cache of the task was deleted without going through the manifest
+                return False
+        return status == TaskStatus.SUCCESS
+
+    def select_tasks(self, up_to: str = None, only: str = None) -> List[str]:
+        """ Compute which tasks should be executed, in execution order.
+
+        :param str up_to: If supplied, select the tasks up to and including this task.
+        :param str only: If supplied, select only this task and its ancestors.
+        :raises PipelineConfigError: If `up_to` or `only` is not a task of the pipeline.
+        :return: The names of the selected tasks.
+        :rtype: List[str]
+        """
+
+        for selected in (up_to, only):
+            if selected and selected not in self.task_graph.nodes:
+                raise PipelineConfigError(f'Unknown task {selected} selected')
+
+        if up_to:
+            tasks = list(split_after(self.execution_order, lambda x: x == up_to))[0]
+        elif only:
+            tasks = nx.algorithms.dag.ancestors(self.task_graph, only) | {only}
+            tasks = [task_name for task_name in self.execution_order if task_name in tasks]
+        else:
+            tasks = list(self.execution_order)
+
+        for task_name in tasks:
+            if not self.task_graph.nodes.get(task_name, None):
+                raise PipelineConfigError(f'Dependency on nonexistent task: {task_name}')
+
+        return tasks
+
+    def _finish_task(self, task_name: str, output: TaskResult, inputs: str, marker: str,
+                     result: PipelineResult, output_fingerprint: str = None, cache: bool = True) -> None:
+        """ Record the output of a task in the pipeline state and cache it.
+
+        :param str task_name: The name of the task.
+        :param TaskResult output: The output of the task.
+        :param str inputs: The fingerprint of the arguments with which the task was called.
+        :param str marker: The marker to print next to the task name.
+        :param PipelineResult result: The current pipeline result, which is updated in place.
+        :param str output_fingerprint: The fingerprint of the output, if already known.
+        :param bool cache: Whether to cache the output, which is unnecessary if it was reused from the cache.
+        :return: None
+        """
+
+        print(Fore.WHITE + Style.BRIGHT + f'[{marker}] {task_name}')
+
+        result.task_results[task_name] = output
+        result.task_inputs[task_name] = inputs
+        result.task_fingerprints[task_name] = output_fingerprint or fingerprint(output)
+        result.task_statuses[task_name] = output.status
 
-        return False
+        if cache:
+            self.cache_result(task_name, result)
+
+    def run_pipeline(self, up_to: str = None, force_rerun: List[str] = None, only: str = None,
+                     max_workers: int = 1, max_processes: int = None, coordinator: Executor = None,
+                     resources: Dict[str, float] = None,
+                     priority: str = TaskPriority.CRITICAL_PATH) -> PipelineResult:
+        """ Execute the tasks in the pipeline. This is a synchronous wrapper around
+            `arun_pipeline`. When called from a running event loop, such as the one of a
+            Jupyter notebook, the pipeline runs on a private event loop in a separate thread
+            and this call blocks until it finishes.
+
+        :param str up_to: If supplied, execute the pipeline only up to this task.
+        :param List[str] force_rerun: Optionally force the listed tasks to be executed.
+        :param str only: If supplied, execute only this task and its dependencies.
+        :param int max_workers: The maximum number of thread tasks to execute at the same time.
+        :param int max_processes: The maximum number of process tasks to execute at the same time.
+            Defaults to the number of CPUs.
+        :param Executor coordinator: If supplied, every task that is not a coroutine function is executed
+            by the workers of this coordinator; see `arun_pipeline`.
+        :param Dict[str, float] resources: The capacity of each resource that tasks may declare; see `arun_pipeline`.
+        :param str priority: How to choose between tasks that are ready at the same time; see `arun_pipeline`.
+        :return: The final pipeline state.
+        :rtype: PipelineResult
+        """
 
-    def run_pipeline(self, up_to: str = None, force_rerun: List[str] = None, only: str = None) -> PipelineResult:
-        """ Execute the tasks in the pipeline.
+        run = partial(asyncio.run, self.arun_pipeline(up_to, force_rerun, only, max_workers=max_workers,
+                                                      max_processes=max_processes, coordinator=coordinator,
+                                                      resources=resources, priority=priority))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return run()
+
+        # asyncio.run refuses to start a loop in a thread that already runs one
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='yenta-pipeline') as executor:
+            return executor.submit(run).result()
+
+    async def arun_pipeline(self, up_to: str = None, force_rerun: List[str] = None, only: str = None,
+                            max_workers: int = 1, max_processes: int = None,
+                            coordinator: Executor = None, resources: Dict[str, float] = None,
+                            priority: str = TaskPriority.CRITICAL_PATH) -> PipelineResult:
+        """ Execute the tasks in the pipeline on the running event loop. Every task whose
+            dependencies have finished is dispatched as soon as possible: `async def` tasks
+            are awaited concurrently on the event loop, regular tasks are dispatched to a
+            pool of up to `max_workers` threads, and tasks declared with `executor='process'`
+            are dispatched to a pool of up to `max_processes` worker processes. Reuse checks,
+            merging and caching of results all happen on the event loop thread.
+
+            With a `coordinator`, such as a `yenta.pipeline.Distributed.Coordinator`, the tasks that
+            are not coroutine functions are instead executed by its workers, as many at a time as
+            there are workers, and located in the workers by reference as for worker processes.
+
+            With `resources`, such as `{'cpu': 32, 'mem_gb': 128}`, a task is only dispatched while the
+            resources declared with `@task(resources=...)` by the tasks that are running, plus its own,
+            fit within these capacities. Resources without a capacity are not limited, and a task that
+            declares more than the capacity of a resource is dispatched once nothing else uses it. When
+            the most urgent ready task does not fit, smaller tasks behind it are dispatched in its place.
+
+            Whenever more tasks are ready than can be dispatched, the most urgent go first. By default, these
+            are the tasks with the longest remaining path to the end of the pipeline, estimated from the
+            durations of the tasks in the last `PRIORITY_HISTORY` runs, so that the tasks that hold up the
+            most work are not left until last. With `priority='order'`, they are simply taken in execution order.
+
+            A streaming task, which yields its result in chunks, runs on a thread of its own, along with the
+            tasks that consume its stream and are ready to start with it, outside of `max_workers` and
+            `resources`. The tasks that consume its stream later, because they also wait for other tasks,
+            read its chunks back from the cache.
 
         :param str up_to: If supplied, execute the pipeline only up to this task.
         :param List[str] force_rerun: Optionally force the listed tasks to be executed.
+        :param str only: If supplied, execute only this task and its dependencies.
+        :param int max_workers: The maximum number of thread tasks to execute at the same time.
+        :param int max_processes: The maximum number of process tasks to execute at the same time.
+            Defaults to the number of CPUs.
+        :param Executor coordinator: If supplied, the executor of every task that is not a coroutine function.
+        :param Dict[str, float] resources: If supplied, the capacity of each resource that tasks may declare.
+        :param str priority: `critical-path` or `order`, how to choose between tasks that are ready at the same time.
         :return: The final pipeline state.
         :rtype: PipelineResult
         """
 
-        previous_result: PipelineResult = self.load_pipeline(self.store_path)
-        result = PipelineResult()
+        max_processes = max_processes or os.cpu_count() or 1
+        if max_workers < 1:
+            raise PipelineConfigError(f'max_workers must be at least 1, got {max_workers}')
+        if max_processes < 1:
+            raise PipelineConfigError(f'max_processes must be at least 1, got {max_processes}')
+        try:
+            priority = TaskPriority(priority)
+        except ValueError:
+            raise PipelineConfigError(f'Invalid priority {priority}, expected one of: '
+                                      f'{", ".join(p.value for p in TaskPriority)}')
+        resources = dict(resources or {})
+        for resource, amount in resources.items():
+            if amount < 0:
+                raise PipelineConfigError(f'The capacity of {resource} must not be negative, got {amount}')
+
+        run_started = datetime.now()
+        run_start = time.perf_counter()
+        previous_result: PipelineResult = self.load_pipeline(self.store)
+        # the state starts out as the previous state and is overwritten task by task, which is the same
+        # as merging every new result into the previous state, but without copying it each time
+        result = self.merge_pipeline_results(previous_result, PipelineResult())
         self._tasks_reused.clear()
         self._tasks_executed.clear()
 
-        if up_to:
-            tasks = list(split_after(self.execution_order, lambda x: x == up_to))[0]
-        elif only and only in self.execution_order:
-            tasks = list(nx.algorithms.dag.ancestors(self.task_graph, only)) + [only]
-            tasks = sorted(tasks, key=self.execution_order.index)
-
+        tasks = self.select_tasks(up_to, only)
         logger.debug(f'Executing tasks: %s', tasks)
 
-        for task_name in tasks:
-            logger.debug(f'Starting executions of {task_name}')
-            task_node = self.task_graph.nodes.get(task_name, None)
-            if not task_node:
-                raise PipelineConfigError(f'Dependency on nonexistent task: {task_name}')
-            task = task_node['task']
-            args = PipelineResult()
-            dependencies_succeeded = True
-            for dependency in (task.task_def.depends_on or []):
-                args.task_results[dependency] = result.task_results[dependency]
-                if result.task_results[dependency].status == TaskStatus.FAILURE:
-                    dependencies_succeeded = False
-                    break
-
-            if dependencies_succeeded:
-                if task.task_def.pure and task_name not in (force_rerun or []) and \
-                        self.reuse_inputs(task_name, previous_result, args):
-                    logger.debug(f'Reusing previous results of {task_name}')
-                    self._tasks_reused.add(task_name)
-                    output = previous_result.task_results[task_name]
-                    marker = Fore.YELLOW + u'\u2014' + Fore.WHITE
+        if priority == TaskPriority.CRITICAL_PATH:
+            remaining = remaining_lengths(self.task_graph.subgraph(tasks),
+                                          task_durations(self.load_runs(self.store, last=PRIORITY_HISTORY)))
+            # ties, such as tasks that have never executed, are broken by execution order
+            priority = {task_name: (-remaining[task_name], index) for index, task_name in enumerate(tasks)}
+        else:
+            priority = {task_name: (0, index) for index, task_name in enumerate(tasks)}
+        waiting = {task_name: set(self.task_graph.predecessors(task_name)) & priority.keys()
+                   for task_name in tasks}
+        # one queue of ready tasks per executor, so that a full pool never holds up the others
+        ready = {kind: [] for kind in TaskExecutor}
+        capacity = {TaskExecutor.THREAD: max_workers, TaskExecutor.PROCESS: max_processes,
+                    TaskExecutor.ASYNC: float('inf')}
+        if coordinator is not None:
+            # the coordinator hands out the calls to its workers as they become idle
+            capacity[TaskExecutor.THREAD] = capacity[TaskExecutor.PROCESS] = float('inf')
+        in_flight = Counter()
+        # the resources used by the running tasks, reserved by each of them, and when each ready task became ready
+        used = Counter()
+        reserved = {}
+        ready_at = {}
+        blocked = set()
+        running = {}
+        # the profiles of the reused tasks, whose results may never be loaded
+        reused = {}
+        # the streams of the consumers that start along with their streaming tasks, which run outside of the pools
+        live_streams = {}
+        live_ready = []
+        producers_done = {}
+        uncounted = set()
+        completed = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def executor_of(task_name):
+            return self.task_graph.nodes[task_name]['task'].task_def.executor
+
+        def needs_of(task_name):
+            # a task cannot need more than there is, so one that declares more only has to wait until it runs alone
+            declared = self.task_graph.nodes[task_name]['task'].task_def.resources
+            return {resource: min(amount, resources[resource])
+                    for resource, amount in declared.items() if resource in resources}
+
+        def fits(task_name):
+            if not running:
+                # whatever rounding errors the fractional amounts in use have accumulated
+                return True
+            return all(used[resource] + amount <= resources[resource]
+                       for resource, amount in needs_of(task_name).items())
+
+        def element_slots(task_name):
+            # the resources of a mapped task are declared per element, so it runs as many elements at a time
+            # as the free resources allow
+            limits = [int((resources[resource] - used[resource]) // amount)
+                      for resource, amount in needs_of(task_name).items() if amount > 0]
+            return max(1, min(limits)) if limits else None
+
+        def make_ready(task_name):
+            ready_at[task_name] = time.perf_counter()
+            heapq.heappush(ready[executor_of(task_name)], (priority[task_name], task_name))
+
+        def next_ready():
+            if live_ready:
+                return live_ready.pop(0)
+            for kind, queue in ready.items():
+                if not queue or in_flight[kind] >= capacity[kind]:
+                    continue
+                # the most urgent task that fits in the free resources, putting back the ones that do not
+                skipped = []
+                task_name = None
+                while queue:
+                    item = heapq.heappop(queue)
+                    if fits(item[1]):
+                        task_name = item[1]
+                        break
+                    skipped.append(item)
+                for item in skipped:
+                    heapq.heappush(queue, item)
+                if task_name is not None:
+                    return task_name
+            return None
+
+        def release(finished_task):
+            for successor in self.task_graph.successors(finished_task):
+                # a consumer that started along with its streaming task does not wait for it anymore
+                if successor in waiting and finished_task in waiting[successor]:
+                    waiting[successor].discard(finished_task)
+                    if not waiting[successor]:
+                        make_ready(successor)
+
+        for task_name, deps in waiting.items():
+            if not deps:
+                make_ready(task_name)
+
+        def succeeded(task_name):
+            return task_name not in blocked and result.task_statuses.get(task_name, None) != TaskStatus.FAILURE
+
+        def dependency_args(dependencies):
+            return PipelineResult(task_results=result.task_results.subset(dependencies),
+                                  task_fingerprints={dependency: result.task_fingerprints[dependency]
+                                                     for dependency in dependencies})
+
+        def start_stream(task_name):
+            # the consumers that only wait for this task start with it, the others read its chunks from the cache
+            streams = []
+            late = False
+            for consumer in self.task_graph.successors(task_name):
+                consumer_def = self.task_graph.nodes[consumer]['task'].task_def
+                if consumer not in waiting or task_name not in consumer_def.stream_inputs:
+                    continue
+                if waiting[consumer] == {task_name} and all(succeeded(dependency)
+                                                            for dependency in consumer_def.depends_on
+                                                            if dependency != task_name):
+                    stream = Stream(task_name, consumer_def.stream_buffer or settings.YENTA_STREAM_BUFFER)
+                    live_streams.setdefault(consumer, {})[task_name] = stream
+                    streams.append(stream)
+                    waiting[consumer].discard(task_name)
+                    ready_at[consumer] = time.perf_counter()
+                    live_ready.append(consumer)
                 else:
-                    args_dict = self.build_args_dict(task, args)
+                    late = True
+            producers_done[task_name] = asyncio.Event()
+            return streams, late
+
+        def dispatch(task, args_dict):
+            logger.debug(f'Calling function to execute {task.task_def.name}')
+            kind = task.task_def.executor
+            if kind == TaskExecutor.ASYNC:
+                return asyncio.ensure_future(self.ainvoke_task(task, **args_dict))
+            elif coordinator is not None and not task.task_def.stream_inputs:
+                return loop.run_in_executor(coordinator, _invoke_in_process, TaskReference.from_task(task),
+                                            args_dict, self.profile_memory)
+            elif kind == TaskExecutor.PROCESS:
+                if kind not in executors:
+                    executors[kind] = stack.enter_context(ProcessPoolExecutor(
+                        max_workers=max_processes, mp_context=multiprocessing.get_context('spawn')))
+                return loop.run_in_executor(executors[kind], _invoke_in_process, TaskReference.from_task(task),
+                                            args_dict, self.profile_memory)
+            else:
+                return loop.run_in_executor(executors[kind], partial(self.invoke_task, task, **args_dict))
+
+        with ExitStack() as stack:
+            executors = {
+                TaskExecutor.THREAD: stack.enter_context(
+                    ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else _InlineExecutor())
+            }
+            streaming = sum(1 for task_name in tasks if self.task_graph.nodes[task_name]['task'].task_def.stream or
+                            self.task_graph.nodes[task_name]['task'].task_def.stream_inputs)
+            if streaming:
+                # a thread for every task that produces or consumes a stream, since they wait for each other
+                stream_executor = stack.enter_context(
+                    ThreadPoolExecutor(max_workers=streaming, thread_name_prefix='yenta-stream'))
+
+            # the cache must be complete once the run is over, whether or not it succeeded
+            stack.callback(self.flush_cache)
+
+            if self.profile_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                stack.callback(tracemalloc.stop)
+
+            while running or any(ready.values()):
+                task_name = next_ready()
+                while task_name is not None:
+                    task = self.task_graph.nodes[task_name]['task']
+                    kind = task.task_def.executor
+
+                    logger.debug(f'Starting executions of {task_name}')
+                    check_start = time.perf_counter()
+                    queue_time = check_start - ready_at.pop(task_name)
+                    live = live_streams.pop(task_name, {})
+                    dependencies = [dependency for dependency in (task.task_def.depends_on or [])
+                                    if dependency not in live]
+                    dependencies_succeeded = all(succeeded(dependency) for dependency in dependencies)
+                    # the results of the dependencies are only loaded if the task executes and needs them
+                    args = dependency_args(dependencies) if dependencies_succeeded else None
+
+                    # the inputs of a consumer that started along with its streaming tasks
+                    # are only known once they finish
+                    inputs = self.input_fingerprint(args) if dependencies_succeeded and not live else None
+                    if not dependencies_succeeded:
+                        logger.debug(f'Skipping {task_name} because one of its dependencies failed')
+                        blocked.add(task_name)
+                        release(task_name)
+                    elif task.task_def.pure and task_name not in (force_rerun or []) and not live and \
+                            self.reuse_inputs(task_name, previous_result, inputs) and \
+                            (not task.task_def.stream or self._stream_cached(task_name, previous_result)):
+                        logger.debug(f'Reusing previous results of {task_name}')
+                        self._tasks_reused.add(task_name)
+                        check_time = time.perf_counter() - check_start
+                        reused[task_name] = TaskProfile(reused=True, reuse_check_time=check_time)
+                        marker = Fore.YELLOW + u'\u2014' + Fore.WHITE
+                        print(Fore.WHITE + Style.BRIGHT + f'[{marker}] {task_name}')
+                        # the cached result was stored with these very inputs, so it is left as it is,
+                        # which also leaves it unloaded unless a downstream task needs it
+                        result.task_results.defer(task_name, partial(
+                            self._reused_result, previous_result.task_results, task_name, check_time))
+                        result.task_inputs[task_name] = inputs
+                        result.task_fingerprints[task_name] = previous_result.task_fingerprints.get(task_name, None) \
+                            or fingerprint(result.task_results[task_name])
+                        result.task_statuses[task_name] = TaskStatus.SUCCESS
+                        release(task_name)
+                    else:
+                        args_dict = self.build_args_dict(task, args, {
+                            producer: live[producer] if producer in live else
+                            self._read_stream(producer, result.task_results[producer])
+                            for producer in task.task_def.stream_inputs})
+                        if task.task_def.stream:
+                            streams, late = start_stream(task_name)
+                            future = loop.run_in_executor(stream_executor, self._produce_stream, task, args_dict,
+                                                          inputs, streams, task.task_def.cache_stream or late)
+                        elif live:
+                            future = loop.run_in_executor(stream_executor,
+                                                          partial(self.invoke_task, task, **args_dict))
+                        if live:
+                            # a stage of a chain of streams both consumes and produces chunks as they come
+                            future = asyncio.ensure_future(self._aconsume_streams(
+                                future, list(live.values()), [producers_done[producer] for producer in live]))
+                        if task.task_def.stream or live:
+                            uncounted.add(future)
+                        elif task.task_def.map_over:
+                            slots = element_slots(task_name)
+                            future = asyncio.ensure_future(self._amap_task(
+                                task, args_dict, dispatch,
+                                force=not task.task_def.pure or task_name in (force_rerun or []), slots=slots))
+                            reserved[future] = Counter({resource: amount * (slots or 1)
+                                                        for resource, amount in needs_of(task_name).items()})
+                        elif self.shared_cache is not None and task.task_def.pure and \
+                                task_name not in (force_rerun or []):
+                            future = asyncio.ensure_future(self._ashared_or_invoke(
+                                task_name, inputs, partial(dispatch, task, args_dict)))
+                        else:
+                            future = dispatch(task, args_dict)
+                        running[future] = (task_name, inputs, time.perf_counter(), queue_time)
+                        if future not in uncounted:
+                            in_flight[kind] += 1
+                            reserved.setdefault(future, Counter(needs_of(task_name)))
+                            used.update(reserved[future])
+                        future.add_done_callback(completed.put_nowait)
+
+                    task_name = next_ready()
+
+                if not running:
+                    continue
+
+                done = [await completed.get()]
+                while not completed.empty():
+                    done.append(completed.get_nowait())
+
+                for future in sorted(done, key=lambda f: priority[running[f][0]]):
+                    task_name, inputs, started, queue_time = running.pop(future)
+                    if future in uncounted:
+                        uncounted.discard(future)
+                    else:
+                        in_flight[executor_of(task_name)] -= 1
+                        used.subtract(reserved.pop(future))
+                    if inputs is None:
+                        inputs = self.input_fingerprint(
+                            dependency_args(self.task_graph.nodes[task_name]['task'].task_def.depends_on))
                     try:
-                        logger.debug(f'Calling function to execute {task_name}')
-                        output = self.invoke_task(task, **args_dict)
+                        output = future.result()
+                        if output.profile is not None and output.profile.shared:
+                            logger.debug(f'Reusing the result of {task_name} from the shared cache')
+                            self._tasks_reused.add(task_name)
+                            marker = Fore.YELLOW + u'\u2014' + Fore.WHITE
+                            # it was written to the pipeline's store when it was fetched
+                            self._finish_task(task_name, output, inputs, marker, result,
+                                              self._shared_fingerprints.pop(task_name, None), cache=False)
+                            release(task_name)
+                            continue
                         output.status = TaskStatus.SUCCESS
                         marker = Fore.GREEN + u'\u2714' + Fore.WHITE
                         self._tasks_executed.add(task_name)
@@ -326,15 +1188,312 @@ class Pipeline:
                         traceback.print_exc()
                         print(Fore.WHITE)
                         logger.error(f'Caught exception executing {task_name}: {ex}')
-                        output = TaskResult(status=TaskStatus.FAILURE, error=str(ex))
+                        output = TaskResult(status=TaskStatus.FAILURE, error=str(ex),
+                                            profile=TaskProfile(wall_time=time.perf_counter() - started))
                         marker = Fore.RED + u'\u2718' + Fore.WHITE
 
-                print(Fore.WHITE + Style.BRIGHT + f'[{marker}] {task_name}')
+                    output.profile = replace(output.profile or TaskProfile(), queue_time=queue_time)
 
-                result.task_results[task_name] = output
-                result.task_inputs[task_name] = args
+                    self._finish_task(task_name, output, inputs, marker, result)
+                    release(task_name)
+                    if task_name in producers_done:
+                        producers_done.pop(task_name).set()
 
-                result = self.merge_pipeline_results(previous_result, result)
-                self.cache_result(task_name, result)
+        self.record_run(run_started, time.perf_counter() - run_start,
+                        [task_name for task_name in tasks if task_name not in blocked], result, reused)
+        self.store.compact(len(result.task_results))
+        if self.store_budget is not None:
+            # the results of this run are protected, since it is now the latest run of the pipeline
+            collect_garbage(self.store_budget, settings.YENTA_EVICTION_POLICY)
 
         return result
+
+    def shared_namespace(self, task_name: str) -> str:
+        """ Identifies a task in the shared cache, by the name of the pipeline and by the module, qualified
+            name and source of its function, so that tasks of the same name in different pipelines or
+            codebases never share results.
+
+        :param str task_name: The name of the task.
+        :return: A fingerprint of the identity of the task.
+        :rtype: str
+        """
+        if task_name not in self._shared_namespaces:
+            func = inspect.unwrap(self.task_graph.nodes[task_name]['task'])
+            try:
+                source = inspect.getsource(func)
+            except (OSError, TypeError):
+                source = None
+            self._shared_namespaces[task_name] = fingerprint(
+                [self.name, getattr(func, '__module__', None), getattr(func, '__qualname__', task_name), source])[:16]
+        return self._shared_namespaces[task_name]
+
+    def _adopt_shared(self, task_name: str, inputs: str) -> Optional[TaskResult]:
+        """ Fetch the result of a task from the shared cache, waiting for it if another worker is
+            computing it, and write it to the pipeline's store as if the task had been executed.
+
+        :param str task_name: The name of the task.
+        :param str inputs: The fingerprint of the arguments with which the task is being called.
+        :return: The result, or None if the task should be executed, in which case its entry in
+            the shared cache is locked until its result is cached.
+        :rtype: TaskResult
+        """
+        start = time.perf_counter()
+        try:
+            entry = self.shared_cache.acquire(task_name, inputs, namespace=self.shared_namespace(task_name))
+        except (SharedCacheError, OSError) as ex:
+            logger.warning(f'Could not reach the shared cache for {task_name}: {ex}')
+            return None
+        if entry is None:
+            return None
+
+        check_time = time.perf_counter() - start
+        parts, meta, details = entry
+        stored = self.store.write(task_name, parts, meta, **details)
+        output = self._load_task_result(self.store, task_name, stored)
+        self._shared_fingerprints[task_name] = meta['result']
+        output.profile = replace(output.profile, reused=True, shared=True, reuse_check_time=check_time)
+        return output
+
+    async def _ashared_or_invoke(self, task_name: str, inputs: str,
+                                 dispatch: Callable[[], Any]) -> TaskResult:
+
+        # the shared cache is reached over the network or a shared file system, so not from the event loop
+        output = await asyncio.get_running_loop().run_in_executor(None, self._adopt_shared, task_name, inputs)
+        if output is not None:
+            return output
+        return await dispatch()
+
+    async def _amap_task(self, task, args_dict: Dict[str, Any], dispatch: Callable[..., Any],
+                         force: bool = False, slots: int = None) -> TaskResult:
+        """ Execute a task declared with `map_over` once for every element of the list it maps over,
+            as many elements at a time as the executor of the task allows, and combine their results
+            into the result of the task. The result of every element is cached on its own, keyed by the
+            element and the other arguments of the task, so that only new or changed elements execute.
+
+        :param task: The task function.
+        :param dict args_dict: The arguments of the task, with the whole list as its element parameter.
+        :param Callable dispatch: Dispatches a call of a task with the given arguments and returns an awaitable.
+        :param bool force: Whether to execute every element, even those whose results could be reused.
+        :param int slots: If supplied, the most elements to execute at the same time.
+        :return: The combined result.
+        :rtype: TaskResult
+        """
+        start = time.perf_counter()
+        task_def = task.task_def
+        task_name = task_def.name
+        param = task_def.element_param
+        elements = list(args_dict[param])
+
+        fixed = {name: fingerprint(value) for name, value in args_dict.items() if name != param}
+        keys = [combine_fingerprints({**fixed, param: fingerprint(element)}) for element in elements]
+
+        loop = asyncio.get_running_loop()
+        entries = self.store.entries()
+        outputs = [None] * len(elements)
+        pending = {}
+        reused = {}
+        for index, key in enumerate(keys):
+            entry = entries.get(element_entry_name(task_name, key), {})
+            if not force and not entry.get('ignored', False) and entry.get('inputs', None) == key and \
+                    entry.get('status', None) == TaskStatus.SUCCESS:
+                reused[index] = loop.run_in_executor(None, self._load_task_result, self.store,
+                                                     element_entry_name(task_name, key), entry)
+            else:
+                # equal elements are only executed once
+                pending.setdefault(key, []).append(index)
+        for index, output in zip(reused, await asyncio.gather(*reused.values())):
+            outputs[index] = output
+
+        limit = asyncio.Semaphore(slots or max(len(pending), 1))
+
+        async def execute(element):
+            async with limit:
+                return await dispatch(task, {**args_dict, param: element})
+
+        logger.debug(f'Executing {len(pending)} of the {len(elements)} elements of {task_name}')
+        executed = await asyncio.gather(*(execute(elements[indices[0]]) for indices in pending.values()),
+                                        return_exceptions=True)
+
+        failures = []
+        for (key, indices), output in zip(pending.items(), executed):
+            if isinstance(output, BaseException):
+                logger.error(f'Caught exception executing element {indices[0]} of {task_name}: {output}')
+                failures.append((indices[0], output))
+                continue
+            output.status = TaskStatus.SUCCESS
+            self._cache_entry(task_name, element_entry_name(task_name, key), output, key, None, share=False)
+            for index in indices:
+                outputs[index] = output
+
+        # the results of elements that are no longer in the list are not needed anymore
+        self._remove_elements(task_name, {element_entry_name(task_name, key) for key in keys}, entries)
+
+        if failures:
+            index, ex = min(failures, key=lambda failure: failure[0])
+            raise MappedTaskError(f'{len(failures)} of the elements of {task_name} failed, '
+                                  f'the first of them at index {index}: {ex}')
+
+        if task_def.reduce is not None:
+            raw_output = await asyncio.get_running_loop().run_in_executor(None, task_def.reduce, outputs)
+            output = self._wrap_task_output(raw_output, task_name)
+        else:
+            output = self.combine_elements(outputs)
+
+        cpu_times = [result.profile.cpu_time for result in executed
+                     if result.profile is not None and result.profile.cpu_time is not None]
+        memory = [result.profile.peak_memory for result in executed
+                  if result.profile is not None and result.profile.peak_memory is not None]
+        output.profile = TaskProfile(wall_time=time.perf_counter() - start,
+                                     cpu_time=sum(cpu_times) if cpu_times else None,
+                                     peak_memory=max(memory) if memory else None,
+                                     elements=len(elements), elements_reused=len(elements) - len(pending))
+        return output
+
+    @staticmethod
+    def _reused_result(task_results: LazyDict, task_name: str, check_time: float) -> TaskResult:
+
+        output = task_results[task_name]
+        output.profile = replace(output.profile or TaskProfile(), reused=True, reuse_check_time=check_time)
+        return output
+
+    def _remove_elements(self, task_name: str, keep: Set[str], entries: Dict[str, Dict[str, Any]] = None) -> None:
+        """ Remove the entries of the elements or the chunks of a task from the store, except those in `keep`. """
+
+        for entry_name in (self.store.entries() if entries is None else entries):
+            if is_element_entry(entry_name, task_name) and entry_name not in keep:
+                if self._writer:
+                    self._writer.submit(self.store.remove, entry_name)
+                else:
+                    self.store.remove(entry_name)
+
+    def _produce_stream(self, task, args_dict: Dict[str, Any], inputs: str, streams: List[Stream],
+                        persist: bool) -> TaskResult:
+        """ Iterate over the chunks yielded by a streaming task, handing each of them to the tasks
+            that consume the stream while it is produced, and caching it if `persist` is set.
+
+        :param task: The streaming task.
+        :param dict args_dict: The arguments of the task.
+        :param str inputs: The fingerprint of the arguments, with which the chunks are cached, if known.
+        :param List[Stream] streams: The streams of the consumers.
+        :param bool persist: Whether to cache the chunks, for the consumers that read them later or for later runs.
+        :return: The result of the task, which holds the number of chunks and a digest of their fingerprints.
+        :rtype: TaskResult
+        """
+        task_name = task.task_def.name
+        fingerprints = []
+        try:
+            with _Profiler() as profile:
+                for chunk in task(**args_dict):
+                    chunk_fingerprint = fingerprint(chunk)
+                    if persist:
+                        # written right away, rather than behind, so that memory stays bounded by the chunk size
+                        self._cache_entry(task_name, chunk_entry_name(task_name, len(fingerprints)),
+                                          TaskResult({'chunk': chunk}, status=TaskStatus.SUCCESS), inputs,
+                                          chunk_fingerprint, share=False, behind=False)
+                    fingerprints.append(chunk_fingerprint)
+                    for stream in streams:
+                        stream.put(chunk)
+        except BaseException as ex:
+            for stream in streams:
+                stream.fail(ex)
+            raise
+
+        for stream in streams:
+            stream.close()
+        # chunks left over from a longer stream, or from a stream that is not cached anymore
+        self._remove_elements(task_name, {chunk_entry_name(task_name, index) for index in range(len(fingerprints))}
+                              if persist else set())
+
+        output = TaskResult({'chunks': len(fingerprints), 'digest': fingerprint(fingerprints)})
+        output.profile = profile
+        return output
+
+    def _read_stream(self, task_name: str, task_result: TaskResult) -> Iterator[Any]:
+        """ Read the cached chunks of the stream of a task, one at a time. """
+
+        entries = self.store.entries()
+        for index in range(task_result.values['chunks']):
+            entry = entries.get(chunk_entry_name(task_name, index), None)
+            if entry is None or entry.get('ignored', False):
+                raise StreamError(f'Chunk {index} of the stream of {task_name} is not in the cache')
+            yield self._load_task_result(self.store, chunk_entry_name(task_name, index), entry).values['chunk']
+
+    def _stream_cached(self, task_name: str, previous_result: PipelineResult) -> bool:
+        """ Whether every chunk of the previous stream of a task is cached, so that the task can be reused.
+            The chunks are checked against the digest of the stream, since a task that consumes a stream as
+            it is produced only knows its inputs once the stream has ended. """
+
+        entries = self.store.entries()
+        values = previous_result.task_results[task_name].values
+        chunks = [entries.get(chunk_entry_name(task_name, index), None) for index in range(values.get('chunks', 0))]
+        if 'digest' not in values or any(entry is None or entry.get('ignored', False) for entry in chunks):
+            return False
+        return fingerprint([entry.get('result', None) for entry in chunks]) == values['digest']
+
+    @staticmethod
+    async def _aconsume_streams(future, streams: List[Stream], producers: List[asyncio.Event]) -> TaskResult:
+
+        try:
+            return await future
+        finally:
+            for stream in streams:
+                stream.abandon()
+            # the inputs of the task include the results of the streaming tasks, which are only known once they finish
+            for finished in producers:
+                await finished.wait()
+
+    @staticmethod
+    def combine_elements(outputs: List[TaskResult]) -> TaskResult:
+        """ Combine the results of the elements of a mapped task that has no reduce step. Every value
+            becomes the list of that value in each element, in the order of the elements, and every
+            artifact is named after its element's index, as in `plot_0`, `plot_1` and so on.
+
+        :param List[TaskResult] outputs: The result of each element.
+        :return: The combined result.
+        :rtype: TaskResult
+        """
+        values = {}
+        artifacts = {}
+        for index, output in enumerate(outputs):
+            for name, value in output.values.items():
+                values.setdefault(name, [None] * len(outputs))[index] = value
+            for name, artifact in output.artifacts.items():
+                artifacts[f'{name}_{index}'] = artifact
+
+        return TaskResult(values=values, artifacts=artifacts)
+
+    def record_run(self, started: datetime, wall_time: float, task_names: List[str], result: PipelineResult,
+                   reused: Dict[str, TaskProfile] = None) -> None:
+        """ Append the profiles of the tasks of a run to the history of the pipeline's runs,
+            which is kept in the pipeline's store.
+
+        :param datetime started: When the run started.
+        :param float wall_time: How long the run took.
+        :param List[str] task_names: The names of the tasks that executed or were reused in the run.
+        :param PipelineResult result: The final pipeline state.
+        :param Dict[str, TaskProfile] reused: The profiles of the reused tasks, which are recorded instead
+            of loading their results if nothing else loaded them.
+        :return: None
+        """
+        tasks = {}
+        for task_name in task_names:
+            if task_name in (reused or {}) and isinstance(result.task_results, LazyDict) and \
+                    not result.task_results.is_loaded(task_name):
+                tasks[task_name] = {'status': TaskStatus.SUCCESS, **asdict(reused[task_name])}
+                continue
+            task_result = result.task_results[task_name]
+            tasks[task_name] = {'status': task_result.status, **asdict(task_result.profile or TaskProfile())}
+
+        self.store.append_run({'started': started.isoformat(), 'wall_time': wall_time, 'tasks': tasks})
+
+    @staticmethod
+    def load_runs(store: Union[Path, Store], last: int = None) -> List[Dict[str, Any]]:
+        """ Load the history of a pipeline's runs, as recorded by `record_run`.
+
+        :param store: The store of the pipeline, or the directory of a `FileStore`.
+        :param int last: If supplied, only load the last `last` runs.
+        :return: The runs, oldest first.
+        :rtype: List[Dict[str, Any]]
+        """
+        store = store if isinstance(store, Store) else FileStore(store)
+        return store.load_runs(last)
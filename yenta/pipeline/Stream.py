@@ -0,0 +1,78 @@
+import queue
+import threading
+
+from typing import Any, Iterator
+
+
+class StreamError(Exception):
+    pass
+
+
+class _End:
+    pass
+
+
+class _Failure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Stream:
+    """ The chunks yielded by a streaming task, on their way to one of the tasks that consume them.
+        The chunks are held in a buffer of at most `size` chunks, so a task that yields chunks faster
+        than they are consumed waits for its consumer instead of holding the whole stream in memory.
+        A consumer can only iterate over the stream once. """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, task_name: str, size: int):
+
+        self.task_name = task_name
+        self._queue = queue.Queue(maxsize=size)
+        self._abandoned = threading.Event()
+        self._ended = False
+        self._error = None
+
+    def put(self, chunk: Any) -> None:
+        """ Add a chunk to the stream, waiting until there is room for it in the buffer. Chunks put into
+            a stream that was abandoned by its consumer are dropped.
+
+        :param Any chunk: The chunk.
+        :return: None
+        """
+        while not self._abandoned.is_set():
+            try:
+                self._queue.put(chunk, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        """ Signal the consumer that every chunk has been put into the stream. """
+        self.put(_End)
+
+    def fail(self, error: BaseException) -> None:
+        """ Signal the consumer that the streaming task failed before it yielded every chunk. """
+        self.put(_Failure(error))
+
+    def abandon(self) -> None:
+        """ Called once the consumer is done with the stream, whether or not it read every chunk, so
+            that the streaming task does not wait for it anymore. """
+        self._abandoned.set()
+
+    def __iter__(self) -> Iterator[Any]:
+
+        while not self._ended:
+            chunk = self._queue.get()
+            if chunk is _End:
+                self._ended = True
+                return
+            if isinstance(chunk, _Failure):
+                # the failure is only put into the stream once, so iterating again raises it without waiting
+                self._ended = True
+                self._error = chunk.error
+                break
+            yield chunk
+        if self._error is not None:
+            raise StreamError(f'The stream of {self.task_name} failed: {self._error}') from self._error
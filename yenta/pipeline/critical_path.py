@@ -0,0 +1,119 @@
+import statistics
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import networkx as nx
+
+
+@dataclass
+class CriticalPath:
+    """ The result of a critical path analysis of a task graph. """
+
+    makespan: float
+    """ The length of the longest path through the graph, weighted by task durations: no schedule,
+        however many workers it has, can execute the whole pipeline in less time than this."""
+
+    path: List[str] = field(default_factory=list)
+    """ The names of the tasks on the critical path, in execution order."""
+
+    durations: Dict[str, float] = field(default_factory=dict)
+    """ The duration assumed for each task."""
+
+    earliest_start: Dict[str, float] = field(default_factory=dict)
+    """ The earliest time at which each task can start, if every task starts as soon as its dependencies finish."""
+
+    slack: Dict[str, float] = field(default_factory=dict)
+    """ How much each task can be delayed without delaying the whole pipeline. Tasks on the critical
+        path have no slack."""
+
+    def is_critical(self, task_name: str, tolerance: float = 1e-9) -> bool:
+        """ Whether a task has no slack, i.e. whether delaying it would delay the whole pipeline. """
+        return self.slack[task_name] <= tolerance
+
+
+def task_durations(runs: List[Dict[str, Any]]) -> Dict[str, float]:
+    """ Estimate the duration of every task from the history of a pipeline's runs, as the median wall
+        time of the runs in which the task executed. Runs in which it was reused are ignored.
+
+    :param List[Dict[str, Any]] runs: The runs, as loaded by `Pipeline.load_runs`.
+    :return: A dictionary whose keys are task names and whose values are durations in seconds.
+    :rtype: Dict[str, float]
+    """
+    wall_times = {}
+    for run in runs:
+        for task_name, profile in run['tasks'].items():
+            if not profile.get('reused', False) and profile.get('wall_time', None) is not None:
+                wall_times.setdefault(task_name, []).append(profile['wall_time'])
+
+    return {task_name: statistics.median(times) for task_name, times in wall_times.items()}
+
+
+def critical_path(task_graph: nx.DiGraph, durations: Dict[str, float], default_duration: float = 0.0) -> CriticalPath:
+    """ Compute the longest path through a task graph, weighted by the durations of the tasks, along
+        with the earliest start and the slack of every task.
+
+    :param nx.DiGraph task_graph: The task graph, whose edges point from dependencies to dependents.
+    :param Dict[str, float] durations: The duration of each task.
+    :param float default_duration: The duration assumed for tasks whose duration is unknown.
+    :return: The critical path.
+    :rtype: CriticalPath
+    """
+    order = list(nx.topological_sort(task_graph))
+    duration = {task_name: durations.get(task_name, default_duration) for task_name in order}
+
+    earliest_start = {}
+    for task_name in order:
+        earliest_start[task_name] = max((earliest_start[dependency] + duration[dependency]
+                                          for dependency in task_graph.predecessors(task_name)), default=0.0)
+
+    makespan = max((earliest_start[task_name] + duration[task_name] for task_name in order), default=0.0)
+
+    latest_finish = {}
+    for task_name in reversed(order):
+        latest_finish[task_name] = min((latest_finish[dependent] - duration[dependent]
+                                        for dependent in task_graph.successors(task_name)), default=makespan)
+
+    slack = {task_name: max(latest_finish[task_name] - duration[task_name] - earliest_start[task_name], 0.0)
+             for task_name in order}
+
+    # follow the tasks without slack from the one that finishes last back to the start
+    path = []
+    if order:
+        task_name = max(order, key=lambda name: earliest_start[name] + duration[name])
+        while task_name is not None:
+            path.append(task_name)
+            task_name = max((dependency for dependency in task_graph.predecessors(task_name)
+                             if abs(earliest_start[dependency] + duration[dependency] - earliest_start[task_name])
+                             <= 1e-9), key=lambda name: duration[name], default=None)
+        path.reverse()
+
+    return CriticalPath(makespan=makespan, path=path, durations=duration,
+                        earliest_start=earliest_start, slack=slack)
+
+
+def remaining_lengths(task_graph: nx.DiGraph, durations: Dict[str, float],
+                      default_duration: float = None) -> Dict[str, float]:
+    """ Compute, for every task, the length of the longest path from its start to the end of the
+        pipeline, weighted by the durations of the tasks. Once a task is ready, this is how long the
+        pipeline still takes at best if the task is started right away, so starting the ready tasks
+        with the longest remaining paths first keeps the critical path moving.
+
+    :param nx.DiGraph task_graph: The task graph, whose edges point from dependencies to dependents.
+    :param Dict[str, float] durations: The duration of each task.
+    :param float default_duration: The duration assumed for tasks whose duration is unknown. Defaults to
+        the median of the known durations, or to 1 if none are known, in which case the remaining length
+        of a task is the number of tasks on the longest chain that starts with it.
+    :return: A dictionary whose keys are task names and whose values are remaining lengths in seconds.
+    :rtype: Dict[str, float]
+    """
+    if default_duration is None:
+        known = [durations[task_name] for task_name in task_graph if task_name in durations]
+        default_duration = statistics.median(known) if known else 1.0
+
+    remaining = {}
+    for task_name in reversed(list(nx.topological_sort(task_graph))):
+        remaining[task_name] = durations.get(task_name, default_duration) + \
+            max((remaining[dependent] for dependent in task_graph.successors(task_name)), default=0.0)
+
+    return remaining
@@ -0,0 +1,164 @@
+import bz2
+import lzma
+import zlib
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from yenta.store.Serializer import Parts, PartReader
+
+
+class CompressionError(Exception):
+    pass
+
+
+class Codec:
+    """ Base class for the codecs with which the parts of cached results can be compressed. """
+
+    name: str = None
+    default_level: int = None
+    levels: range = None
+    """ The compression levels the codec accepts. """
+
+    def __init__(self, level: int = None):
+        self.level = self.default_level if level is None else level
+
+    def compressor(self) -> Any:
+        """ A new incremental compressor, with the `compress` and `flush` methods of `zlib.compressobj`. """
+        raise NotImplementedError
+
+    def decompress(self, data: Any) -> bytes:
+        """ Decompress the whole of a compressed part. """
+        raise NotImplementedError
+
+    def compress(self, chunks: List[Any]) -> bytes:
+        """ Compress the chunks of a part, without first concatenating them.
+
+        :param list chunks: The chunks of bytes which make up the part.
+        :return: The compressed part.
+        :rtype: bytes
+        """
+        compressor = self.compressor()
+        output = [compressor.compress(chunk) for chunk in chunks]
+        output.append(compressor.flush())
+        return b''.join(output)
+
+    def __repr__(self):
+        return f'{self.name}:{self.level}'
+
+
+class ZlibCodec(Codec):
+    """ Deflate, as in gzip: fast, with a moderate compression ratio. """
+
+    name = 'zlib'
+    default_level = 6
+    levels = range(-1, 10)
+
+    def compressor(self) -> Any:
+        return zlib.compressobj(self.level)
+
+    def decompress(self, data: Any) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCodec(Codec):
+    """ LZMA, as in xz: the best compression ratio, but by far the slowest to compress. """
+
+    name = 'lzma'
+    default_level = 6
+    levels = range(0, 10)
+
+    def compressor(self) -> Any:
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=self.level)
+
+    def decompress(self, data: Any) -> bytes:
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+class Bz2Codec(Codec):
+    """ Bzip2: compresses text well, but is slow to decompress. """
+
+    name = 'bz2'
+    default_level = 9
+    levels = range(1, 10)
+
+    def compressor(self) -> Any:
+        return bz2.BZ2Compressor(self.level)
+
+    def decompress(self, data: Any) -> bytes:
+        return bz2.decompress(data)
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec, LzmaCodec, Bz2Codec)}
+
+NO_COMPRESSION = 'none'
+""" Disables compression for a task even if its pipeline compresses results. """
+
+
+def get_codec(spec: Optional[str]) -> Optional[Codec]:
+    """ Look up a codec by name, optionally followed by a compression level, as in `zlib` or `lzma:9`.
+
+    :param str spec: The name of the codec and its level, or None or `none` for no compression.
+    :return: The codec, or None if results should not be compressed.
+    :rtype: Codec
+    """
+    if spec is None or spec == NO_COMPRESSION:
+        return None
+
+    name, _, level = spec.partition(':')
+    if name not in CODECS:
+        raise CompressionError(f'Unknown codec {name}, expected one of: {", ".join([NO_COMPRESSION, *CODECS])}')
+    codec = CODECS[name]
+    try:
+        level = int(level) if level else None
+    except ValueError:
+        raise CompressionError(f'Invalid compression level {level} for codec {name}')
+    if level is not None and level not in codec.levels:
+        raise CompressionError(f'Invalid compression level {level} for codec {name}, '
+                               f'expected {codec.levels.start} to {codec.levels.stop - 1}')
+    return codec(level)
+
+
+def compress_parts(parts: Parts, codec: Codec, threshold: int) -> Tuple[Parts, Dict[str, str]]:
+    """ Compress the parts of a serialized result that are at least `threshold` bytes. Parts that
+        do not get any smaller, such as arrays of random numbers, are kept as they are.
+
+    :param Parts parts: The serialized result.
+    :param Codec codec: The codec to compress with.
+    :param int threshold: The size in bytes below which parts are not compressed.
+    :return: The parts to store, and the name of the codec of each compressed part.
+    :rtype: Tuple[Parts, Dict[str, str]]
+    """
+    stored, codecs = {}, {}
+    for part_name, chunks in parts.items():
+        size = sum(memoryview(chunk).nbytes for chunk in chunks)
+        if size >= threshold:
+            compressed = codec.compress(chunks)
+            if len(compressed) < size:
+                stored[part_name] = [compressed]
+                codecs[part_name] = codec.name
+                continue
+        stored[part_name] = chunks
+
+    return stored, codecs
+
+
+class CompressedPartReader(PartReader):
+    """ Decompresses the parts of a stored result that were compressed by `compress_parts`. """
+
+    def __init__(self, reader: PartReader, codecs: Dict[str, str]):
+        self.reader = reader
+        self.codecs = codecs
+
+    def names(self) -> List[str]:
+        return self.reader.names()
+
+    def read(self, name: str) -> bytearray:
+        data = self.reader.read(name)
+        if name not in self.codecs:
+            return data
+        return bytearray(get_codec(self.codecs[name]).decompress(data))
+
+    def path(self, name: str) -> Optional[Path]:
+        # the file of a compressed part does not hold the part itself, so it cannot be memory mapped
+        return None if name in self.codecs else self.reader.path(name)
@@ -0,0 +1,160 @@
+import logging
+import re
+
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+from yenta.store.Store import StoreConfigError, entry_owner, open_store, list_pipelines
+
+logger = logging.getLogger(__name__)
+
+
+POLICIES = ['lru', 'age']
+""" `lru` evicts the results that were least recently used by a run, and `age` the results
+    that were written the longest time ago. """
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$', re.IGNORECASE)
+
+
+def parse_size(size: Union[str, int, None]) -> Optional[int]:
+    """ Parse a number of bytes with an optional binary unit, such as `512M`, `10GiB` or `1.5g`.
+
+    :param size: The size, or None.
+    :return: The number of bytes, or None if `size` is None.
+    :rtype: int
+    """
+    if size is None or isinstance(size, int):
+        return size
+
+    match = _SIZE.match(str(size))
+    if not match:
+        raise StoreConfigError(f'Invalid size {size}, expected a number of bytes such as 500M or 10G')
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmgt'.index(unit.lower() or ' '))
+
+
+@dataclass
+class CachedResult:
+    """ The space taken up by the cached result of a task, and how recently it was used. """
+
+    pipeline: str
+    task: str
+    size: int
+    written: Optional[str] = None
+    """ When the result was written, in ISO format."""
+
+    last_used: Optional[str] = None
+    """ When the result was last executed or reused by a run, in ISO format."""
+
+    pinned: bool = False
+    in_latest_run: bool = False
+    """ Whether the latest run of the pipeline executed or reused the result."""
+
+    @property
+    def evictable(self) -> bool:
+        return not self.pinned and not self.in_latest_run
+
+
+def cache_usage(location: Union[str, Path] = None) -> List[CachedResult]:
+    """ List the cached results of every pipeline in a location, with their sizes. How recently
+        each result was used is read from the history of the runs of its pipeline.
+
+    :param location: A `sqlite:///` URL or a directory, as for `open_store`.
+    :return: The cached results.
+    :rtype: List[CachedResult]
+    """
+    results = []
+    for pipeline in list_pipelines(location):
+        store = open_store(pipeline, location)
+        try:
+            runs = store.load_runs()
+            last_used = {}
+            for run in runs:
+                for task_name in run['tasks']:
+                    last_used[task_name] = run['started']
+            latest_run = set(runs[-1]['tasks']) if runs else set()
+
+            entries = store.entries()
+            for task_name, entry in entries.items():
+                # entries without a result were only ignored or pinned
+                if 'parts' not in entry and 'result' not in entry:
+                    continue
+                # the elements of a mapped task and the chunks of a stream are used whenever their task is
+                owner = entry_owner(task_name)
+                written = entry.get('written', None)
+                used = max(filter(None, [last_used.get(owner, None), written]), default=None)
+                pinned = entry.get('pinned', False) or entries.get(owner, {}).get('pinned', False)
+                results.append(CachedResult(pipeline, task_name, entry.get('size', None) or 0, written, used,
+                                            pinned, owner in latest_run))
+        finally:
+            store.close()
+
+    return results
+
+
+def select_evictions(results: List[CachedResult], budget: int, policy: str = 'lru') -> List[CachedResult]:
+    """ Choose which results to evict so that the rest fit a budget. Pinned results and results
+        used by the latest run of their pipeline are never chosen, so the budget may still be
+        exceeded if they alone exceed it.
+
+    :param List[CachedResult] results: The cached results.
+    :param int budget: The number of bytes the results may take up.
+    :param str policy: One of `POLICIES`.
+    :return: The results to evict, in the order in which they should be evicted.
+    :rtype: List[CachedResult]
+    """
+    if policy not in POLICIES:
+        raise StoreConfigError(f'Unknown eviction policy {policy}, expected one of: {", ".join(POLICIES)}')
+
+    # results without timestamps were written before they were recorded, so they are the oldest
+    if policy == 'lru':
+        candidates = sorted((r for r in results if r.evictable), key=lambda r: (r.last_used or '', r.size))
+    else:
+        candidates = sorted((r for r in results if r.evictable), key=lambda r: (r.written or '', r.size))
+
+    total = sum(result.size for result in results)
+    evictions = []
+    for result in candidates:
+        if total <= budget:
+            break
+        evictions.append(result)
+        total -= result.size
+
+    return evictions
+
+
+def collect_garbage(budget: Union[str, int], policy: str = 'lru', location: Union[str, Path] = None,
+                    dry_run: bool = False) -> List[CachedResult]:
+    """ Evict cached results from every pipeline in a location until they fit a budget.
+
+    :param budget: The number of bytes the results may take up, as accepted by `parse_size`.
+    :param str policy: One of `POLICIES`.
+    :param location: A `sqlite:///` URL or a directory, as for `open_store`.
+    :param bool dry_run: If True, only choose the results to evict.
+    :return: The results that were, or would be, evicted.
+    :rtype: List[CachedResult]
+    """
+    evictions = select_evictions(cache_usage(location), parse_size(budget), policy)
+    if dry_run:
+        return evictions
+
+    by_pipeline = defaultdict(list)
+    for result in evictions:
+        by_pipeline[result.pipeline].append(result.task)
+
+    for pipeline, task_names in by_pipeline.items():
+        store = open_store(pipeline, location)
+        try:
+            for task_name in task_names:
+                store.remove(task_name)
+            store.sweep()
+        finally:
+            store.close()
+
+    if evictions:
+        logger.info(f'Evicted {len(evictions)} cached results, '
+                    f'{sum(result.size for result in evictions)} bytes, to fit a budget of {budget}')
+
+    return evictions
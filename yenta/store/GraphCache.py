@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from yenta.utils.files import atomic_write
+
+
+class TaskGraphCache:
+    """ Caches a description of the task graph defined by an entry point, so that commands which
+        only need to know the tasks and their dependencies do not have to execute the entry point
+        and build the graph again. The description is recorded together with the hashes of the
+        entry point and of every other file in which one of its tasks is defined, and is only
+        used while none of these files have changed. """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _entry_path(self, entry_point: Path) -> Path:
+        return self.directory / (hashlib.sha1(str(Path(entry_point).resolve()).encode()).hexdigest() + '.json')
+
+    @staticmethod
+    def source_hash(path: Path) -> Optional[str]:
+        """ The hash of the contents of a source file, or None if it cannot be read. """
+        try:
+            return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+        except OSError:
+            return None
+
+    def load(self, entry_point: Path) -> Optional[Dict[str, Any]]:
+        """ Load the cached description of the task graph of an entry point.
+
+        :param Path entry_point: The entry point.
+        :return: The description saved by `save`, or None if there is none or any of its sources changed.
+        """
+        try:
+            with open(self._entry_path(entry_point), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        for source, digest in entry['sources'].items():
+            if self.source_hash(source) != digest:
+                return None
+
+        return entry['graph']
+
+    def save(self, entry_point: Path, graph: Dict[str, Any], sources: list) -> None:
+        """ Save the description of the task graph of an entry point.
+
+        :param Path entry_point: The entry point.
+        :param dict graph: The description of the task graph; anything that can be stored as JSON.
+        :param list sources: The files in which the tasks are defined, other than the entry point.
+        :return: None
+        """
+        files = {str(Path(source).resolve()) for source in sources} | {str(Path(entry_point).resolve())}
+        entry = {'sources': {source: self.source_hash(source) for source in sorted(files)}, 'graph': graph}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atomic_write(self._entry_path(entry_point), json.dumps(entry).encode())
+
+    def get(self, entry_point: Path, build: Callable[[], tuple]) -> Dict[str, Any]:
+        """ Load the cached description of the task graph of an entry point, or build and cache it.
+
+        :param Path entry_point: The entry point.
+        :param build: A function that returns the description of the task graph and its sources,
+            as passed to `save`.
+        :return: The description of the task graph.
+        """
+        graph = self.load(entry_point)
+        if graph is None:
+            graph, sources = build()
+            self.save(entry_point, graph, sources)
+        return graph
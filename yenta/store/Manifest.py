@@ -0,0 +1,186 @@
+import json
+import threading
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from yenta.utils.files import atomic_write
+
+
+SUMMARY_LENGTH = 80
+
+FLAGS = ['ignored', 'pinned']
+""" The fields of an entry that are set by commands rather than by writing the result, and
+    which are kept when the result is written again. """
+
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= SUMMARY_LENGTH else text[:SUMMARY_LENGTH - 3] + '...'
+
+
+def summarize(value: Any) -> str:
+    """ A short description of a value for the manifest, which is cheap to compute however
+        large the value is: the representation of scalars and short strings, and only the
+        type and size of anything else.
+
+    :param value: The value.
+    :return: The description.
+    :rtype: str
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return _truncate(repr(value))
+
+    kind = type(value).__name__
+    shape = getattr(value, 'shape', None)
+    dtype = getattr(value, 'dtype', None)
+    if shape is not None and dtype is not None:
+        return f'{kind} of {dtype} with shape {tuple(shape)}'
+    try:
+        return f'{kind} of {len(value)} items'
+    except TypeError:
+        return kind
+
+
+def summarize_result(task_result) -> Dict[str, Dict[str, str]]:
+    """ Summarize every value of a task result with `summarize`, and every artifact, which
+        only holds a path and a hash, by its representation.
+
+    :param TaskResult task_result: The result.
+    :return: The summaries of the values and of the artifacts, by name.
+    :rtype: Dict[str, Dict[str, str]]
+    """
+    return {'values': {key: summarize(value) for key, value in task_result.values.items()},
+            'artifacts': {key: _truncate(repr(value)) for key, value in task_result.artifacts.items()}}
+
+
+class Manifest:
+    """ An append-only index of the tasks cached in a pipeline store, kept in `manifest.jsonl`.
+        Every line records a change to the entry of one task: its status, error, fingerprints,
+        sizes and timestamps when its result is written, or whether it was removed or ignored.
+        Replaying the lines gives the current entry of every task, so that commands which only
+        need to know about the cached results never have to read them.
+
+        Before the result of a task is written, its entry is marked as pending, and the mark is
+        only cleared once the result and its metadata are complete; if a write is interrupted,
+        the entry stays pending and its `meta.json` has to be consulted instead. """
+
+    FILE_NAME = 'manifest.jsonl'
+
+    def __init__(self, store_path: Path):
+
+        self.store_path = Path(store_path)
+        self.path = self.store_path / self.FILE_NAME
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def append(self, task_name: str, **fields) -> None:
+        """ Record a change to the entry of a task.
+
+        :param str task_name: The name of the task.
+        :param fields: The fields of the entry to set.
+        :return: None
+        """
+        line = json.dumps({'task': task_name, **fields}) + '\n'
+        with self._lock:
+            if not self.path.exists():
+                # the first line must not hide the tasks cached before there was a manifest
+                self._write(self.scan())
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.records += 1
+
+    def mark_pending(self, task_name: str) -> None:
+        self.append(task_name, pending=True)
+
+    def record_result(self, task_name: str, meta: Dict[str, Any], **details) -> None:
+        """ Record the result of a task once it has been written, along with its metadata.
+
+        :param str task_name: The name of the task.
+        :param dict meta: The metadata written to the task's `meta.json`.
+        :param details: Anything else to record, such as the error and the summary of the result.
+        :return: None
+        """
+        self.append(task_name, pending=False, written=datetime.now().isoformat(), **meta, **details)
+
+    def remove(self, task_name: str) -> None:
+        self.append(task_name, removed=True)
+
+    def ignore(self, task_name: str) -> None:
+        self.append(task_name, ignored=True)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """ Replay the manifest into the current entry of every task. If there is no manifest
+            yet, the entries are read from the task directories of the store instead.
+
+        :return: The entries, by task name.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        if not self.path.exists():
+            return self.scan()
+
+        entries = {}
+        records = 0
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted append
+                    continue
+                records += 1
+                task_name = record.pop('task')
+                if record.get('removed', False):
+                    entries.pop(task_name, None)
+                elif 'written' in record:
+                    # a new result replaces every field recorded with the previous one
+                    previous = entries.get(task_name, {})
+                    entries[task_name] = {**{flag: previous[flag] for flag in FLAGS if flag in previous}, **record}
+                else:
+                    entries.setdefault(task_name, {}).update(record)
+
+        self.records = records
+        return entries
+
+    def scan(self) -> Dict[str, Dict[str, Any]]:
+        """ Build the entry of every task from its directory in the store, for stores that were
+            written before the manifest existed.
+
+        :return: The entries, by task name.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        entries = {}
+        if not self.store_path.exists():
+            return entries
+
+        for task_path in self.store_path.iterdir():
+            if not task_path.is_dir() or task_path.name.startswith('.'):
+                continue
+            try:
+                with open(task_path / 'meta.json', 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            # only metadata that lists its parts was written after the result was complete
+            entry = {**meta, 'pending': False} if 'parts' in meta else {'pending': True}
+            if (task_path / '.ignore').exists():
+                entry['ignored'] = True
+            entries[task_path.name] = entry
+
+        return entries
+
+    def compact(self, entries: Dict[str, Dict[str, Any]] = None) -> None:
+        """ Rewrite the manifest with a single line per task.
+
+        :param dict entries: The current entries, if already loaded.
+        :return: None
+        """
+        with self._lock:
+            self._write(self.load() if entries is None else entries)
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+
+        lines = [json.dumps({'task': task_name, **entry}) + '\n' for task_name, entry in entries.items()]
+        self.store_path.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, ''.join(lines).encode())
+        self.records = len(lines)
@@ -0,0 +1,281 @@
+import copy
+import importlib
+import io
+import json
+import pickle
+import sys
+
+from dataclasses import fields, is_dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from yenta.config import settings
+
+
+Buffer = Any
+""" Anything that supports the buffer protocol, e.g. bytes, bytearray or memoryview. """
+
+Parts = Dict[str, List[Buffer]]
+""" The serialized form of an object: a dictionary whose keys are part names and whose values
+    are the chunks of bytes which, concatenated, make up the part. Each part is stored separately. """
+
+
+class SerializationError(Exception):
+    pass
+
+
+class PartReader:
+    """ Gives a serializer access to the parts of a stored object. """
+
+    def names(self) -> List[str]:
+        """ The names of all of the parts. """
+        raise NotImplementedError
+
+    def read(self, name: str) -> bytearray:
+        """ Read the full contents of the part named `name`. """
+        raise NotImplementedError
+
+    def path(self, name: str) -> Optional[Path]:
+        """ The file holding the part named `name`, if the part is stored as a plain file. """
+        return None
+
+
+class FilePartReader(PartReader):
+    """ Reads parts that are stored as files in a directory. """
+
+    def __init__(self, directory: Path, names: List[str]):
+        self.directory = directory
+        self._names = names
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def read(self, name: str) -> bytearray:
+        path = self.directory / name
+        data = bytearray(path.stat().st_size)
+        with open(path, 'rb') as f:
+            f.readinto(data)
+        return data
+
+    def path(self, name: str) -> Optional[Path]:
+        return self.directory / name
+
+
+class Serializer:
+    """ Base class for the serialization backends of the result store. """
+
+    name: str = None
+
+    def dumps(self, obj: Any) -> Parts:
+        """ Serialize an object into one or more named parts.
+
+        :param Any obj: The object to serialize.
+        :return: The parts.
+        :rtype: Parts
+        """
+        raise NotImplementedError
+
+    def loads(self, parts: PartReader) -> Any:
+        """ Reconstruct an object from its parts.
+
+        :param PartReader parts: A reader for the parts written by `dumps`.
+        :return: The object.
+        """
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    """ Pickles the whole object with the default protocol into a single part. """
+
+    name = 'pickle'
+
+    def dumps(self, obj: Any) -> Parts:
+        return {'result.pk': [pickle.dumps(obj)]}
+
+    def loads(self, parts: PartReader) -> Any:
+        return pickle.loads(parts.read('result.pk'))
+
+
+class Pickle5Serializer(Serializer):
+    """ Pickles the object with protocol 5, storing large buffers such as the contents of
+        NumPy arrays out-of-band in parts of their own, which avoids copying them into
+        the pickle stream. """
+
+    name = 'pickle5'
+
+    def dumps(self, obj: Any) -> Parts:
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        parts = {'result.pk5': [data]}
+        for index, buffer in enumerate(buffers):
+            parts[f'buffer-{index:04d}.bin'] = [buffer.raw()]
+        return parts
+
+    def loads(self, parts: PartReader) -> Any:
+        buffers = [parts.read(name) for name in sorted(parts.names()) if name.startswith('buffer-')]
+        return pickle.loads(parts.read('result.pk5'), buffers=buffers)
+
+
+def _is_array(value: Any) -> bool:
+
+    np = sys.modules.get('numpy', None)
+    return np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject
+
+
+class _ArrayRef:
+    """ Stands in for an array in the pickled part of a result written by the npy serializer. """
+
+    def __init__(self, part: str):
+        self.part = part
+
+
+class NpySerializer(Serializer):
+    """ Stores every NumPy array among the values of a task result as a raw `.npy` part,
+        and pickles the rest of the result. Arrays are written without an intermediate copy,
+        and arrays of at least `settings.YENTA_MMAP_THRESHOLD` bytes are loaded back as
+        read-only memory maps of their files rather than read into memory. """
+
+    name = 'npy'
+
+    @staticmethod
+    def array_parts(obj: Any) -> Iterator[Tuple[str, str, Any]]:
+        """ Find the arrays among the values of a task result.
+
+        :param Any obj: The task result.
+        :return: The key of each array, the name of the part it is stored in, and the array itself.
+        """
+        for index, (key, value) in enumerate(obj.values.items()):
+            if _is_array(value):
+                yield key, f'array-{index:04d}.npy', value
+
+    def dumps(self, obj: Any) -> Parts:
+        parts = {}
+        skeleton = copy.copy(obj)
+        skeleton.values = dict(obj.values)
+        for key, part, value in self.array_parts(obj):
+            # only results with arrays need numpy, which has then already been imported
+            import numpy as np
+
+            array = np.ascontiguousarray(value)
+            header = io.BytesIO()
+            np.lib.format.write_array_header_2_0(header, np.lib.format.header_data_from_array_1_0(array))
+            # viewed as bytes, since the buffer protocol rejects dtypes such as datetime64
+            parts[part] = [header.getvalue(), memoryview(array.reshape(-1).view(np.uint8)) if array.size else b'']
+            skeleton.values[key] = _ArrayRef(part)
+
+        parts['result.pk'] = [pickle.dumps(skeleton)]
+        return parts
+
+    def load_array(self, parts: PartReader, part: str):
+        import numpy as np
+
+        path = parts.path(part)
+        if path is not None:
+            mmap_mode = 'r' if path.stat().st_size >= settings.YENTA_MMAP_THRESHOLD else None
+            return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        return np.lib.format.read_array(io.BytesIO(parts.read(part)), allow_pickle=False)
+
+    def map_arrays(self, obj: Any, parts: PartReader) -> None:
+        """ Replace the large arrays among the values of a task result that was just written
+            with read-only memory maps of the files they were written to, so that the memory
+            they occupy can be released and the tasks that consume them share a single copy.
+
+        :param Any obj: The task result, which is modified in place.
+        :param PartReader parts: A reader for the parts written by `dumps`.
+        :return: None
+        """
+        for key, part, _ in list(self.array_parts(obj)):
+            path = parts.path(part)
+            if path is not None and path.stat().st_size >= settings.YENTA_MMAP_THRESHOLD:
+                obj.values[key] = self.load_array(parts, part)
+
+    def loads(self, parts: PartReader) -> Any:
+        obj = pickle.loads(parts.read('result.pk'))
+        for key, value in obj.values.items():
+            if isinstance(value, _ArrayRef):
+                obj.values[key] = self.load_array(parts, value.part)
+        return obj
+
+
+class JsonSerializer(Serializer):
+    """ Stores the object as JSON. Only suitable for results whose values are small scalars,
+        strings, lists and dictionaries; dataclasses such as artifacts and enums such as the
+        task status are tagged with their type so that they can be reconstructed. """
+
+    name = 'json'
+
+    @staticmethod
+    def _encode(obj: Any) -> Any:
+
+        if obj is None or isinstance(obj, (bool, str)) or type(obj) in (int, float):
+            return obj
+        elif isinstance(obj, Enum):
+            return {'__enum__': f'{type(obj).__module__}.{type(obj).__qualname__}', 'value': obj.value}
+        elif isinstance(obj, Path):
+            return {'__path__': str(obj)}
+        elif isinstance(obj, (list, tuple)):
+            return [JsonSerializer._encode(item) for item in obj]
+        elif isinstance(obj, dict):
+            if not all(isinstance(key, str) for key in obj):
+                raise SerializationError('Only dictionaries with string keys can be serialized as JSON')
+            return {'__dict__': {key: JsonSerializer._encode(value) for key, value in obj.items()}}
+        elif is_dataclass(obj) and not isinstance(obj, type):
+            return {'__dataclass__': f'{type(obj).__module__}.{type(obj).__qualname__}',
+                    'fields': {f.name: JsonSerializer._encode(getattr(obj, f.name)) for f in fields(obj)}}
+        else:
+            raise SerializationError(f'Values of type {type(obj)} cannot be serialized as JSON')
+
+    @staticmethod
+    def _resolve(qualified_name: str) -> type:
+
+        module_name, _, class_name = qualified_name.rpartition('.')
+        if module_name != 'yenta' and not module_name.startswith('yenta.'):
+            raise SerializationError(f'Refusing to load type {qualified_name} from JSON')
+        return getattr(importlib.import_module(module_name), class_name)
+
+    @staticmethod
+    def _decode(obj: Any) -> Any:
+
+        if isinstance(obj, list):
+            return [JsonSerializer._decode(item) for item in obj]
+        elif not isinstance(obj, dict):
+            return obj
+        elif '__enum__' in obj:
+            return JsonSerializer._resolve(obj['__enum__'])(obj['value'])
+        elif '__path__' in obj:
+            return Path(obj['__path__'])
+        elif '__dataclass__' in obj:
+            cls = JsonSerializer._resolve(obj['__dataclass__'])
+            # bypass __init__, which for some artifacts would recompute their hash
+            instance = object.__new__(cls)
+            for key, value in obj['fields'].items():
+                setattr(instance, key, JsonSerializer._decode(value))
+            return instance
+        else:
+            return {key: JsonSerializer._decode(value) for key, value in obj['__dict__'].items()}
+
+    def dumps(self, obj: Any) -> Parts:
+        return {'result.json': [json.dumps(self._encode(obj)).encode()]}
+
+    def loads(self, parts: PartReader) -> Any:
+        return self._decode(json.loads(parts.read('result.json')))
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in
+               (PickleSerializer(), Pickle5Serializer(), NpySerializer(), JsonSerializer())}
+
+DEFAULT_SERIALIZER = PickleSerializer.name
+
+
+def get_serializer(name: str) -> Serializer:
+    """ Look up a serializer by name.
+
+    :param str name: The name of the serializer.
+    :return: The serializer.
+    :rtype: Serializer
+    """
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise SerializationError(f'Unknown serializer {name}, expected one of: {", ".join(SERIALIZERS)}')
@@ -0,0 +1,456 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+from yenta.config import settings
+from yenta.store.Serializer import Buffer, Parts
+from yenta.utils.files import atomic_write
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+LOCK_TTL = 600
+""" How many seconds a worker may hold the lock on an entry before others take it for dead. """
+
+_KEY = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class SharedCacheError(Exception):
+    pass
+
+
+def _check_key(key: str) -> str:
+
+    if not _KEY.match(key):
+        raise SharedCacheError(f'Invalid shared cache key {key}')
+    return key
+
+
+def _token(secret: str) -> str:
+    # the token sent over HTTP is derived from the secret, which signs the entries and so never leaves the machine
+    return hmac.new(secret.encode(), b'yenta-shared-cache-token', hashlib.sha256).hexdigest()
+
+
+def _is_loopback(host: str) -> bool:
+
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Transport:
+    """ Base class for the ways of reaching a shared cache. A transport stores opaque blobs by key,
+        and holds short-lived locks on keys, which only one owner can hold at a time. """
+
+    def get(self, key: str) -> Optional[bytes]:
+        """ The blob stored under a key, or None if there is none. """
+        raise NotImplementedError
+
+    def put(self, key: str, chunks: List[Buffer]) -> None:
+        """ Store a blob, made up of the given chunks, under a key, replacing any previous one. """
+        raise NotImplementedError
+
+    def lock(self, key: str, owner: str, ttl: float = LOCK_TTL) -> bool:
+        """ Try to lock a key.
+
+        :param str key: The key.
+        :param str owner: Identifies the owner of the lock, who alone can release it.
+        :param float ttl: After how many seconds the lock expires, in case its owner never releases it.
+        :return: Whether the lock was acquired.
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def unlock(self, key: str, owner: str) -> None:
+        """ Release the lock on a key, if it is still held by `owner`. """
+        raise NotImplementedError
+
+
+class FileTransport(Transport):
+    """ Keeps the shared cache in a directory, typically on a file system mounted by every machine.
+        Blobs are written atomically, and locks are files created exclusively, which expire once
+        they are older than their time to live. """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def _blob_path(self, key: str) -> Path:
+        return self.directory / 'objects' / _check_key(key)
+
+    def _lock_path(self, key: str) -> Path:
+        return self.directory / 'locks' / (_check_key(key) + '.lock')
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._blob_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, chunks: List[Buffer]) -> None:
+        path = self._blob_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, chunks)
+
+    def _owner(self, path: Path) -> Optional[Tuple[str, float]]:
+        try:
+            owner, expires = path.read_text().split('\n')
+            return owner, float(expires)
+        except (OSError, ValueError):
+            return None
+
+    def lock(self, key: str, owner: str, ttl: float = LOCK_TTL) -> bool:
+        path = self._lock_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                held = self._owner(path)
+                # a lock that cannot be read is still being written by its owner
+                if held is None or held[1] > time.time():
+                    return False
+                logger.debug(f'Breaking the expired lock of {held[0]} on {key}')
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{owner}\n{time.time() + ttl}')
+            return True
+        return False
+
+    def unlock(self, key: str, owner: str) -> None:
+        path = self._lock_path(key)
+        held = self._owner(path)
+        if held is not None and held[0] == owner:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class HTTPTransport(Transport):
+    """ Reaches a shared cache served over HTTP, such as the one served by `serve_shared_cache`.
+        Blobs are read with `GET /objects/<key>` and written with `PUT /objects/<key>`; locks are
+        taken with `POST /locks/<key>`, which answers 409 if the lock is held, and released with
+        `DELETE /locks/<key>`. The owner and time to live of a lock are passed as headers, and so
+        is a token derived from `secret`, if given, with which the server authenticates clients. """
+
+    def __init__(self, url: str, timeout: float = 30, secret: str = None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._headers = {'Authorization': f'Bearer {_token(secret)}'} if secret else {}
+
+    def _request(self, method: str, path: str, data: Any = None, headers: Dict[str, str] = None):
+        import urllib.request
+
+        request = urllib.request.Request(f'{self.url}{path}', data=data, method=method,
+                                         headers={**self._headers, **(headers or {})})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get(self, key: str) -> Optional[bytes]:
+        import urllib.error
+
+        try:
+            with self._request('GET', f'/objects/{_check_key(key)}') as response:
+                return response.read()
+        except urllib.error.HTTPError as ex:
+            if ex.code == 404:
+                return None
+            raise SharedCacheError(f'Could not get {key} from {self.url}: {ex}') from ex
+
+    def put(self, key: str, chunks: List[Buffer]) -> None:
+        import urllib.error
+
+        length = sum(memoryview(chunk).nbytes for chunk in chunks)
+        try:
+            self._request('PUT', f'/objects/{_check_key(key)}', data=iter(chunks),
+                          headers={'Content-Length': str(length)}).close()
+        except urllib.error.HTTPError as ex:
+            raise SharedCacheError(f'Could not put {key} to {self.url}: {ex}') from ex
+
+    def lock(self, key: str, owner: str, ttl: float = LOCK_TTL) -> bool:
+        import urllib.error
+
+        try:
+            self._request('POST', f'/locks/{_check_key(key)}', data=b'',
+                          headers={'X-Lock-Owner': owner, 'X-Lock-TTL': str(ttl)}).close()
+            return True
+        except urllib.error.HTTPError as ex:
+            if ex.code == 409:
+                return False
+            raise SharedCacheError(f'Could not lock {key} on {self.url}: {ex}') from ex
+
+    def unlock(self, key: str, owner: str) -> None:
+        self._request('DELETE', f'/locks/{_check_key(key)}', headers={'X-Lock-Owner': owner}).close()
+
+
+class _SharedCacheHandler:
+    """ The request handling of the shared cache server, mixed into `BaseHTTPRequestHandler` by
+        `serve_shared_cache` so that `http.server` is only imported by the processes that serve. """
+
+    transport: FileTransport = None
+    token: Optional[str] = None
+
+    def _route(self) -> Optional[Tuple[str, str]]:
+        if self.token is not None and \
+                not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            self.send_error(401)
+            return None
+        kind, _, key = self.path.lstrip('/').partition('/')
+        if kind not in ('objects', 'locks') or not _KEY.match(key):
+            self.send_error(404)
+            return None
+        return kind, key
+
+    def _reply(self, code: int, body: bytes = b'') -> None:
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return
+        data = self.transport.get(route[1]) if route[0] == 'objects' else None
+        if data is None:
+            self.send_error(404)
+        else:
+            self._reply(200, data)
+
+    def do_PUT(self):
+        route = self._route()
+        if route is None:
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.transport.put(route[1], [data])
+        self._reply(201)
+
+    def do_POST(self):
+        route = self._route()
+        if route is None:
+            return
+        locked = self.transport.lock(route[1], self.headers.get('X-Lock-Owner', ''),
+                                     float(self.headers.get('X-Lock-TTL', LOCK_TTL)))
+        self._reply(201 if locked else 409)
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None:
+            return
+        self.transport.unlock(route[1], self.headers.get('X-Lock-Owner', ''))
+        self._reply(204)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve_shared_cache(directory: Union[str, Path], host: str = '127.0.0.1', port: int = 0,
+                       secret: str = None) -> 'ThreadingHTTPServer':
+    """ Create a server for a shared cache kept in a directory. The server is not started; call its
+        `serve_forever` method, possibly in a thread, and `shutdown` to stop it.
+
+        Clients deserialize the entries they get, so a server that anyone can write to would let them
+        run code on every client. With a `secret`, only clients that know it are served; without one,
+        the server only listens on the loopback interface.
+
+    :param directory: The directory in which to keep the blobs and locks.
+    :param str host: The address to listen on.
+    :param int port: The port to listen on, or 0 to pick a free one, which is then in `server_address`.
+    :param str secret: The secret shared with the clients, which defaults to `settings.YENTA_SHARED_CACHE_SECRET`.
+    :return: The server.
+    :rtype: ThreadingHTTPServer
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    secret = secret or settings.YENTA_SHARED_CACHE_SECRET
+    if not secret and not _is_loopback(host):
+        raise SharedCacheError(f'Refusing to serve the shared cache on {host} without a secret; '
+                               f'set YENTA_SHARED_CACHE_SECRET')
+    handler = type('SharedCacheHandler', (_SharedCacheHandler, BaseHTTPRequestHandler), {
+        'transport': FileTransport(directory), 'token': _token(secret) if secret else None})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def transport_for(location: Union[str, Path], secret: str = None) -> Transport:
+    """ The transport of a shared cache: an `HTTPTransport` for `http://` and `https://` URLs,
+        and a `FileTransport` for anything else, which is taken to be a directory. """
+
+    if str(location).startswith(('http://', 'https://')):
+        return HTTPTransport(str(location), secret=secret)
+    return FileTransport(location)
+
+
+_HEADER = struct.Struct('>Q')
+_SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+
+def _sign(secret: str, chunks: List[Buffer]) -> bytes:
+
+    signature = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+    for chunk in chunks:
+        signature.update(chunk)
+    return signature.digest()
+
+
+def pack_entry(parts: Parts, meta: Dict[str, Any], details: Dict[str, Any], secret: str = None) -> List[Buffer]:
+    """ Bundle the stored parts of a result, its metadata and details into the chunks of a single blob:
+        the length of a JSON header, the header, the data of every part in the order it lists them and,
+        with a `secret`, an HMAC of all of them. """
+
+    sizes = [[name, sum(memoryview(chunk).nbytes for chunk in chunks)] for name, chunks in parts.items()]
+    header = json.dumps({'meta': meta, 'details': details, 'parts': sizes, 'signed': bool(secret)}).encode()
+    chunks = [_HEADER.pack(len(header)), header, *(chunk for chunks in parts.values() for chunk in chunks)]
+    return [*chunks, _sign(secret, chunks)] if secret else chunks
+
+
+def unpack_entry(blob: bytes, secret: str = None) -> Tuple[Parts, Dict[str, Any], Dict[str, Any]]:
+    """ Split a blob written by `pack_entry` back into the parts, metadata and details of a result.
+        With a `secret`, the blob must have been signed with the same secret. """
+
+    view = memoryview(blob)
+    length, = _HEADER.unpack_from(view)
+    offset = _HEADER.size + length
+    header = json.loads(bytes(view[_HEADER.size:offset]))
+    parts = {}
+    for name, size in header['parts']:
+        parts[name] = [view[offset:offset + size]]
+        offset += size
+    signature = view[offset:offset + _SIGNATURE_SIZE] if header.get('signed', False) else None
+    if offset + (0 if signature is None else _SIGNATURE_SIZE) != len(view):
+        raise SharedCacheError('Truncated shared cache entry')
+    if secret and (signature is None or not hmac.compare_digest(bytes(signature), _sign(secret, [view[:offset]]))):
+        raise SharedCacheError('The shared cache entry is not signed with the secret of this cache')
+    return parts, header['meta'], header['details']
+
+
+class SharedCache:
+    """ A cache of the results of pure tasks that is shared by every machine and every pipeline
+        using it, keyed by the name of the task, a namespace that identifies the task, such as a
+        fingerprint of its pipeline and its code, and the fingerprint of its inputs. Entries hold the
+        parts of a result exactly as they are stored locally, along with their metadata, so they
+        are never serialized or compressed again.
+
+        So that concurrent workers do not compute the same entry twice, a worker that misses an
+        entry locks it while it computes the result; other workers that miss the same entry wait
+        for the result to be published, or for the lock to be released or to expire.
+
+        With a `secret`, which defaults to `settings.YENTA_SHARED_CACHE_SECRET`, entries are signed when
+        they are published, and entries that are not signed with the same secret are never used, since
+        their results would be deserialized. """
+
+    def __init__(self, transport: Transport, lock_ttl: float = LOCK_TTL, poll_interval: float = 0.1,
+                 secret: str = None):
+        self.transport = transport
+        self.secret = secret or settings.YENTA_SHARED_CACHE_SECRET
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.owner = f'{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._locked = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(task_name: str, inputs: str, namespace: str = None) -> str:
+        return f'{task_name}-{namespace}-{inputs}' if namespace else f'{task_name}-{inputs}'
+
+    def get(self, task_name: str, inputs: str,
+            namespace: str = None) -> Optional[Tuple[Parts, Dict[str, Any], Dict[str, Any]]]:
+        """ Look up the result of a task.
+
+        :param str task_name: The name of the task.
+        :param str inputs: The fingerprint of its inputs.
+        :param str namespace: Tells apart tasks of the same name, such as those of different pipelines.
+        :return: The parts, metadata and details of the result, or None if it is not cached.
+        """
+        blob = self.transport.get(self.key(task_name, inputs, namespace))
+        return None if blob is None else unpack_entry(blob, self.secret)
+
+    def acquire(self, task_name: str, inputs: str, timeout: float = None,
+                namespace: str = None) -> Optional[Tuple[Parts, Dict[str, Any], Dict[str, Any]]]:
+        """ Look up the result of a task, waiting for it if another worker is computing it. If the
+            result is not cached and no other worker is computing it, the entry is locked for this
+            worker, which should then compute the result and `publish` or `release` it.
+
+        :param str task_name: The name of the task.
+        :param str inputs: The fingerprint of its inputs.
+        :param float timeout: How long to wait for another worker; defaults to the time to live of locks.
+        :param str namespace: Tells apart tasks of the same name, as for `get`.
+        :return: The parts, metadata and details of the result, or None if it should be computed.
+        """
+        key = self.key(task_name, inputs, namespace)
+        deadline = time.monotonic() + (self.lock_ttl if timeout is None else timeout)
+        while True:
+            entry = self.get(task_name, inputs, namespace)
+            if entry is not None:
+                return entry
+            if self.transport.lock(key, self.owner, self.lock_ttl):
+                with self._lock:
+                    self._locked.add(key)
+                # the result may have been published between looking it up and locking it
+                entry = self.get(task_name, inputs, namespace)
+                if entry is not None:
+                    self.release(task_name, inputs, namespace)
+                return entry
+            if time.monotonic() >= deadline:
+                logger.warning(f'Gave up waiting for another worker to compute {task_name}')
+                return None
+            time.sleep(self.poll_interval)
+
+    def publish(self, task_name: str, inputs: str, parts: Parts, meta: Dict[str, Any],
+                details: Dict[str, Any], namespace: str = None) -> None:
+        """ Store the result of a task, and release the lock on it if this worker holds it.
+
+        :param str task_name: The name of the task.
+        :param str inputs: The fingerprint of its inputs.
+        :param Parts parts: The parts of the result, as stored locally.
+        :param dict meta: The metadata of the result.
+        :param dict details: The other fields of its entry, such as its summary.
+        :param str namespace: Tells apart tasks of the same name, as for `get`.
+        :return: None
+        """
+        try:
+            self.transport.put(self.key(task_name, inputs, namespace), pack_entry(parts, meta, details, self.secret))
+        finally:
+            self.release(task_name, inputs, namespace)
+
+    def release(self, task_name: str, inputs: str, namespace: str = None) -> None:
+        """ Release the lock on the result of a task, if this worker holds it, so that another worker
+            can compute it. """
+
+        key = self.key(task_name, inputs, namespace)
+        with self._lock:
+            if key not in self._locked:
+                return
+            self._locked.discard(key)
+        self.transport.unlock(key, self.owner)
+
+
+def open_shared_cache(location: Union[str, Path, SharedCache, None]) -> Optional[SharedCache]:
+    """ Open a shared cache.
+
+    :param location: A directory, an `http://` URL, a `SharedCache`, or None.
+    :return: The shared cache, or None if `location` is None.
+    :rtype: SharedCache
+    """
+    if location is None or isinstance(location, SharedCache):
+        return location
+    return SharedCache(transport_for(location, settings.YENTA_SHARED_CACHE_SECRET))
@@ -0,0 +1,634 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from yenta.config import settings
+from yenta.store.Manifest import Manifest, FLAGS, summarize_result
+from yenta.store.Serializer import Parts, PartReader, FilePartReader
+from yenta.utils.files import atomic_write
+from yenta.utils.fingerprint import fingerprint, combine_fingerprints
+
+
+SQLITE_SCHEME = 'sqlite:///'
+
+META_FIELDS = ['inputs', 'result', 'serializer', 'status', 'parts', 'size', 'codecs']
+""" The fields of the metadata written with every cached result; an entry of the store
+    holds these and any details recorded along with them. """
+
+SWEEP_GRACE = 3600
+""" Unreferenced data younger than this many seconds is never swept, since a write that will
+    reference it may still be in progress. """
+
+
+class StoreConfigError(Exception):
+    pass
+
+
+def element_entry_name(task_name: str, key: str) -> str:
+    """ The name of the store entry that holds the result of one element of a mapped task.
+
+    :param str task_name: The name of the mapped task.
+    :param str key: The fingerprint of the element and of the other arguments of the task.
+    :return: The name of the entry.
+    :rtype: str
+    """
+    return f'{task_name}[{key[:16]}]'
+
+
+def chunk_entry_name(task_name: str, index: int) -> str:
+    """ The name of the store entry that holds one chunk of the stream of a streaming task.
+
+    :param str task_name: The name of the streaming task.
+    :param int index: The index of the chunk in the stream.
+    :return: The name of the entry.
+    :rtype: str
+    """
+    return f'{task_name}[chunk-{index}]'
+
+
+def is_element_entry(entry_name: str, task_name: str = None) -> bool:
+    """ Whether a store entry holds the result of an element of a mapped task, or a chunk of a stream.
+
+    :param str entry_name: The name of the entry.
+    :param str task_name: If supplied, only the elements of this task count.
+    :return: True or False
+    :rtype: bool
+    """
+    if not entry_name.endswith(']') or '[' not in entry_name:
+        return False
+    return task_name is None or entry_name.startswith(task_name + '[')
+
+
+def entry_owner(entry_name: str) -> str:
+    """ The name of the task that a store entry belongs to, which for the elements of a mapped task
+        and the chunks of a stream is the task itself.
+
+    :param str entry_name: The name of the entry.
+    :return: The name of the task.
+    :rtype: str
+    """
+    return entry_name.partition('[')[0] if is_element_entry(entry_name) else entry_name
+
+
+class Store:
+    """ Base class for the backends in which the results of the tasks of a pipeline are cached.
+        A store keeps, for every task, the parts written by the serializer of its result and an
+        entry holding the metadata of the result, and also the history of the pipeline's runs. """
+
+    path: Path
+    """ Where the store keeps its data."""
+
+    def create(self) -> None:
+        """ Create the store if it does not exist yet. """
+        raise NotImplementedError
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """ The entries of all of the cached tasks, including those that are ignored.
+
+        :return: The entries, by task name.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        raise NotImplementedError
+
+    def reader(self, task_name: str, entry: Dict[str, Any]) -> PartReader:
+        """ A reader for the parts of the cached result of a task.
+
+        :param str task_name: The name of the task.
+        :param dict entry: The entry of the task, as returned by `entries` or passed to `write`.
+        :return: The reader.
+        :rtype: PartReader
+        """
+        raise NotImplementedError
+
+    def write(self, task_name: str, parts: Parts, meta: Dict[str, Any], **details) -> Dict[str, Any]:
+        """ Cache the result of a task, replacing any previous one.
+
+        :param str task_name: The name of the task.
+        :param Parts parts: The serialized result.
+        :param dict meta: The metadata of the result, with the fields listed in `META_FIELDS`.
+        :param details: Anything else to record in the entry of the task.
+        :return: The entry of the task.
+        :rtype: Dict[str, Any]
+        """
+        raise NotImplementedError
+
+    def remove(self, task_name: str) -> bool:
+        """ Remove the cached result of a task.
+
+        :param str task_name: The name of the task.
+        :return: Whether the task was cached.
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def ignore(self, task_name: str) -> None:
+        """ Mark a task as ignored, so that its cached result is not loaded, even once it is written again.
+
+        :param str task_name: The name of the task.
+        :return: None
+        """
+        raise NotImplementedError
+
+    def pin(self, task_name: str, pinned: bool = True) -> None:
+        """ Protect the cached result of a task from eviction, or stop protecting it. Like
+            ignoring, pinning outlasts writing the result again.
+
+        :param str task_name: The name of the task.
+        :param bool pinned: Whether to pin or unpin the task.
+        :return: None
+        """
+        raise NotImplementedError
+
+    def append_run(self, record: Dict[str, Any]) -> None:
+        """ Append a record to the history of the pipeline's runs.
+
+        :param dict record: The record; anything that can be stored as JSON.
+        :return: None
+        """
+        raise NotImplementedError
+
+    def load_runs(self, last: int = None) -> List[Dict[str, Any]]:
+        """ Load the history of the pipeline's runs.
+
+        :param int last: If supplied, only load the last `last` runs.
+        :return: The runs, oldest first.
+        :rtype: List[Dict[str, Any]]
+        """
+        raise NotImplementedError
+
+    def compact(self, task_count: int) -> None:
+        """ Called after every run, so that the store can tidy up its index.
+
+        :param int task_count: The number of tasks cached in the store.
+        :return: None
+        """
+
+    def sweep(self, grace: float = SWEEP_GRACE) -> int:
+        """ Delete any data that no entry refers to anymore.
+
+        :param float grace: Only delete data that is older than this many seconds.
+        :return: The number of bytes freed.
+        :rtype: int
+        """
+        return 0
+
+    def clear(self) -> None:
+        """ Delete everything in the store. """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """ Release anything the store holds open. """
+
+
+class FileStore(Store):
+    """ Keeps the result of every task in its own directory, as one file per part next to a
+        `meta.json` file, indexed by a `Manifest`. This is the default store. """
+
+    def __init__(self, path: Path):
+
+        self.path = Path(path)
+        self.manifest = Manifest(self.path)
+
+    def create(self) -> None:
+
+        self.path.mkdir(exist_ok=True, parents=True)
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+
+        entries = self.manifest.load()
+        for task_name, entry in list(entries.items()):
+            if not entry.get('pending', True):
+                continue
+            # the write of the result was interrupted, so only its metadata can say what is complete
+            task_path = self.path / task_name
+            if not task_path.is_dir():
+                del entries[task_name]
+                continue
+            try:
+                with open(task_path / 'meta.json', 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            entries[task_name] = {**meta, **{flag: entry[flag] for flag in FLAGS if flag in entry}}
+
+        return entries
+
+    def reader(self, task_name: str, entry: Dict[str, Any]) -> PartReader:
+
+        # results cached before serializers were recorded were always plain pickles
+        return FilePartReader(self.path / task_name, entry.get('parts', ['result.pk']))
+
+    def legacy_entry(self, task_name: str) -> Optional[Dict[str, Any]]:
+        """ Describe a result cached before any metadata was written along with it, when the
+            result was pickled to `result.pk` and the full inputs of the task to `inputs.pk`.
+            The result is loaded to find its status, fingerprint and summary.
+
+        :param str task_name: The name of the task.
+        :return: The entry of the result, or None if the task has no result in this layout.
+        :rtype: Dict[str, Any]
+        """
+        task_path = self.path / task_name
+        if not (task_path / 'result.pk').is_file():
+            return None
+
+        with open(task_path / 'result.pk', 'rb') as f:
+            task_result = pickle.load(f)
+        entry = {'result': fingerprint(task_result), 'serializer': 'pickle', 'status': task_result.status,
+                 'parts': ['result.pk'], 'error': task_result.error, 'summary': summarize_result(task_result)}
+        try:
+            with open(task_path / 'inputs.pk', 'rb') as f:
+                inputs = pickle.load(f)
+        except OSError:
+            return entry
+
+        # computed from the results of the dependencies as the pipeline does, so the result can still be reused
+        entry['inputs'] = combine_fingerprints({name: fingerprint(result)
+                                                for name, result in inputs.task_results.items()})
+        return entry
+
+    def write(self, task_name: str, parts: Parts, meta: Dict[str, Any], **details) -> Dict[str, Any]:
+
+        task_path = self.path / task_name
+        self.manifest.mark_pending(task_name)
+        task_path.mkdir(exist_ok=True, parents=True)
+
+        # the metadata is removed first and written last, so that an interrupted write can
+        # never pair the fingerprints of one execution with the result of another
+        meta_file = task_path / 'meta.json'
+        if meta_file.exists():
+            meta_file.unlink()
+
+        for part_name, chunks in parts.items():
+            atomic_write(task_path / part_name, chunks)
+
+        # remove whatever is left over from previous executions, including the full inputs
+        # and separate fingerprints stored by older versions
+        for path in task_path.iterdir():
+            if path.is_file() and path.name not in parts and not path.name.startswith('.'):
+                path.unlink()
+
+        atomic_write(meta_file, json.dumps(meta).encode())
+        self.manifest.record_result(task_name, meta, **details)
+        return {**meta, **details}
+
+    def remove(self, task_name: str) -> bool:
+
+        task_path = self.path / task_name
+        if not task_path.exists():
+            return False
+        shutil.rmtree(task_path)
+        self.manifest.remove(task_name)
+        return True
+
+    def ignore(self, task_name: str) -> None:
+
+        self.manifest.ignore(task_name)
+
+    def pin(self, task_name: str, pinned: bool = True) -> None:
+
+        self.manifest.append(task_name, pinned=pinned)
+
+    def append_run(self, record: Dict[str, Any]) -> None:
+
+        self.path.mkdir(exist_ok=True, parents=True)
+        with open(self.path / 'runs.jsonl', 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def load_runs(self, last: int = None) -> List[Dict[str, Any]]:
+
+        runs_file = self.path / 'runs.jsonl'
+        if not runs_file.exists():
+            return []
+        with open(runs_file, 'r') as f:
+            # the history is read before every run, so only the runs that are needed are parsed
+            lines = deque((line for line in f if line.strip()), maxlen=last or None)
+        return [json.loads(line) for line in lines]
+
+    def compact(self, task_count: int) -> None:
+
+        # every result written appends two lines to the manifest, which is rewritten once
+        # most of its lines are out of date, or written for the first time for older stores
+        if not self.manifest.path.exists() or self.manifest.records > 4 * task_count + 16:
+            self.manifest.compact()
+
+    def clear(self) -> None:
+
+        shutil.rmtree(self.path)
+
+
+class SQLitePartReader(PartReader):
+    """ Reads parts that are stored in a SQLite store, either in the database itself or, if they
+        were spilled, in its directory of blobs. """
+
+    def __init__(self, store: 'SQLiteStore', task_name: str, names: List[str], blobs: Dict[str, str]):
+        self.store = store
+        self.task_name = task_name
+        self._names = names
+        self._blobs = blobs
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def read(self, name: str) -> bytearray:
+        path = self.path(name)
+        if path is not None:
+            return FilePartReader(path.parent, [path.name]).read(path.name)
+        return bytearray(self.store.read_part(self.task_name, name))
+
+    def path(self, name: str) -> Optional[Path]:
+        digest = self._blobs.get(name, None)
+        return self.store.blob_path(digest) if digest else None
+
+
+class SQLiteStore(Store):
+    """ Keeps the entries and the small parts of the results of every pipeline in a single SQLite
+        database, which scales to many more tasks than one directory per task. Parts of at least
+        `blob_threshold` bytes are spilled to files named by the hash of their contents, in the
+        directory `<database>.blobs`, so that they can still be memory mapped and so that identical
+        parts are only stored once. """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS tasks (pipeline TEXT NOT NULL, task TEXT NOT NULL, entry TEXT NOT NULL, '
+        'ignored INTEGER NOT NULL DEFAULT 0, pinned INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (pipeline, task))',
+        'CREATE TABLE IF NOT EXISTS parts (pipeline TEXT NOT NULL, task TEXT NOT NULL, name TEXT NOT NULL, '
+        'data BLOB, PRIMARY KEY (pipeline, task, name))',
+        'CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, pipeline TEXT NOT NULL, '
+        'record TEXT NOT NULL)',
+    ]
+
+    def __init__(self, path: Path, pipeline: str = 'default', blob_threshold: int = None):
+
+        self.path = Path(path)
+        self.pipeline = pipeline
+        self.blob_directory = self.path.with_name(self.path.name + '.blobs')
+        self.blob_threshold = settings.YENTA_MMAP_THRESHOLD if blob_threshold is None else blob_threshold
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def create(self) -> None:
+
+        _ = self.connection
+
+    @property
+    def connection(self):
+
+        if self._connection is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # the connection is shared with the thread that writes the cache behind the pipeline
+            connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            # databases created before tasks could be pinned
+            if 'pinned' not in {row[1] for row in connection.execute('PRAGMA table_info(tasks)')}:
+                connection.execute('ALTER TABLE tasks ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0')
+            self._connection = connection
+
+        return self._connection
+
+    def _execute(self, statements: List[tuple]) -> None:
+
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for statement in statements:
+                    connection.execute(*statement)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def _query(self, sql: str, parameters: tuple) -> list:
+
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def blob_path(self, digest: str) -> Path:
+
+        return self.blob_directory / digest[:2] / digest
+
+    def _spill(self, chunks: List[Any]) -> str:
+
+        digest = hashlib.blake2b()
+        for chunk in chunks:
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        path = self.blob_path(digest)
+        if path.exists():
+            # so that a concurrent sweep does not take it for garbage before the entry referring to it is written
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(path, chunks)
+
+        return digest
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+
+        rows = self._query('SELECT task, entry, ignored, pinned FROM tasks WHERE pipeline = ?', (self.pipeline,))
+        return {task_name: {**json.loads(entry), 'ignored': bool(ignored), 'pinned': bool(pinned)}
+                for task_name, entry, ignored, pinned in rows}
+
+    def reader(self, task_name: str, entry: Dict[str, Any]) -> PartReader:
+
+        return SQLitePartReader(self, task_name, entry.get('parts', ['result.pk']), entry.get('blobs', {}))
+
+    def read_part(self, task_name: str, name: str) -> bytes:
+
+        rows = self._query('SELECT data FROM parts WHERE pipeline = ? AND task = ? AND name = ?',
+                           (self.pipeline, task_name, name))
+        if not rows or rows[0][0] is None:
+            raise FileNotFoundError(f'Part {name} of task {task_name} is missing from {self.path}')
+        return rows[0][0]
+
+    def write(self, task_name: str, parts: Parts, meta: Dict[str, Any], **details) -> Dict[str, Any]:
+
+        blobs = {}
+        statements = [('DELETE FROM parts WHERE pipeline = ? AND task = ?', (self.pipeline, task_name))]
+        for part_name, chunks in parts.items():
+            if sum(memoryview(chunk).nbytes for chunk in chunks) >= self.blob_threshold:
+                blobs[part_name] = self._spill(chunks)
+            else:
+                statements.append(('INSERT INTO parts (pipeline, task, name, data) VALUES (?, ?, ?, ?)',
+                                   (self.pipeline, task_name, part_name, b''.join(chunks))))
+
+        entry = {**meta, **details, 'blobs': blobs, 'written': datetime.now().isoformat()}
+        statements.append(('INSERT INTO tasks (pipeline, task, entry) VALUES (?, ?, ?) '
+                           'ON CONFLICT (pipeline, task) DO UPDATE SET entry = excluded.entry',
+                           (self.pipeline, task_name, json.dumps(entry))))
+        self._execute(statements)
+        return entry
+
+    def remove(self, task_name: str) -> bool:
+
+        # spilled blobs may be shared with other results, so they are left in place
+        exists = bool(self._query('SELECT 1 FROM tasks WHERE pipeline = ? AND task = ?', (self.pipeline, task_name)))
+        self._execute([('DELETE FROM parts WHERE pipeline = ? AND task = ?', (self.pipeline, task_name)),
+                       ('DELETE FROM tasks WHERE pipeline = ? AND task = ?', (self.pipeline, task_name))])
+        return exists
+
+    def ignore(self, task_name: str) -> None:
+
+        self._execute([('INSERT INTO tasks (pipeline, task, entry, ignored) VALUES (?, ?, ?, 1) '
+                        'ON CONFLICT (pipeline, task) DO UPDATE SET ignored = 1',
+                        (self.pipeline, task_name, json.dumps({})))])
+
+    def pin(self, task_name: str, pinned: bool = True) -> None:
+
+        self._execute([('INSERT INTO tasks (pipeline, task, entry, pinned) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (pipeline, task) DO UPDATE SET pinned = excluded.pinned',
+                        (self.pipeline, task_name, json.dumps({}), int(pinned)))])
+
+    def pipelines(self) -> List[str]:
+        """ The names of all of the pipelines cached in the database. """
+
+        rows = self._query('SELECT pipeline FROM tasks UNION SELECT pipeline FROM runs', ())
+        return sorted(pipeline for pipeline, in rows)
+
+    def sweep(self, grace: float = SWEEP_GRACE) -> int:
+
+        # blobs are shared by every pipeline in the database
+        referenced = set()
+        for entry, in self._query('SELECT entry FROM tasks', ()):
+            referenced.update(json.loads(entry).get('blobs', {}).values())
+
+        freed = 0
+        cutoff = time.time() - grace
+        for path in self.blob_directory.glob('*/*') if self.blob_directory.exists() else []:
+            stat = path.stat()
+            if path.name not in referenced and not path.name.startswith('.') and stat.st_mtime < cutoff:
+                path.unlink()
+                freed += stat.st_size
+
+        return freed
+
+    def append_run(self, record: Dict[str, Any]) -> None:
+
+        self._execute([('INSERT INTO runs (pipeline, record) VALUES (?, ?)', (self.pipeline, json.dumps(record)))])
+
+    def load_runs(self, last: int = None) -> List[Dict[str, Any]]:
+
+        if last:
+            rows = self._query('SELECT record FROM runs WHERE pipeline = ? ORDER BY id DESC LIMIT ?',
+                               (self.pipeline, last))[::-1]
+        else:
+            rows = self._query('SELECT record FROM runs WHERE pipeline = ? ORDER BY id', (self.pipeline,))
+        return [json.loads(record) for record, in rows]
+
+    def clear(self) -> None:
+
+        self._execute([(f'DELETE FROM {table} WHERE pipeline = ?', (self.pipeline,))
+                       for table in ['parts', 'tasks', 'runs']])
+
+    def close(self) -> None:
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def is_sqlite_url(location: Union[str, Path, None]) -> bool:
+
+    return isinstance(location, str) and location.startswith(SQLITE_SCHEME)
+
+
+def sqlite_path(url: str) -> Path:
+    """ The database file of a `sqlite:///` URL. As with SQLAlchemy, `sqlite:///cache.db` names a
+        file relative to the working directory and `sqlite:////tmp/cache.db` an absolute one.
+
+    :param str url: The URL.
+    :return: The path of the database.
+    :rtype: Path
+    """
+    if not is_sqlite_url(url):
+        raise StoreConfigError(f'Not a SQLite store URL: {url}, expected {SQLITE_SCHEME}<path>')
+    path = url[len(SQLITE_SCHEME):]
+    if not path:
+        raise StoreConfigError(f'The SQLite store URL {url} does not name a database file')
+    return Path(path)
+
+
+def open_store(pipeline: str = 'default', location: Union[str, Path] = None) -> Store:
+    """ Open the store of a pipeline.
+
+    :param str pipeline: The name of the pipeline.
+    :param location: A `sqlite:///` URL or the directory under which every pipeline has its own
+        directory. Defaults to `settings.YENTA_STORE_URL`, if set, and otherwise to
+        `settings.YENTA_STORE_PATH`.
+    :return: The store.
+    :rtype: Store
+    """
+    location = location or settings.YENTA_STORE_URL or settings.YENTA_STORE_PATH
+    if is_sqlite_url(location):
+        return SQLiteStore(sqlite_path(location), pipeline)
+    return FileStore(Path(location) / pipeline)
+
+
+def list_pipelines(location: Union[str, Path] = None) -> List[str]:
+    """ The names of the pipelines cached in a location.
+
+    :param location: A `sqlite:///` URL or a directory, as for `open_store`.
+    :return: The names of the pipelines.
+    :rtype: List[str]
+    """
+    location = location or settings.YENTA_STORE_URL or settings.YENTA_STORE_PATH
+    if is_sqlite_url(location):
+        store = SQLiteStore(sqlite_path(location))
+        try:
+            return store.pipelines() if store.path.exists() else []
+        finally:
+            store.close()
+
+    path = Path(location)
+    if not path.exists():
+        return []
+    # the caches of file hashes and task graphs are hidden directories
+    return sorted(child.name for child in path.iterdir() if child.is_dir() and not child.name.startswith('.'))
+
+
+def migrate_store(source: Store, destination: Store) -> int:
+    """ Copy every cached result, and the history of runs, from one store to another.
+
+    :param Store source: The store to copy from.
+    :param Store destination: The store to copy to; results it already holds for the same tasks are replaced.
+    :return: The number of results copied.
+    :rtype: int
+    """
+    count = 0
+    for task_name, entry in source.entries().items():
+        if 'parts' not in entry and 'result' not in entry and isinstance(source, FileStore):
+            entry = {**entry, **(source.legacy_entry(task_name) or {})}
+        # entries without a result were only ignored or pinned
+        if 'parts' in entry or 'result' in entry:
+            reader = source.reader(task_name, entry)
+            parts = {name: [reader.read(name)] for name in reader.names()}
+            meta = {key: entry[key] for key in META_FIELDS if key in entry}
+            meta['parts'] = sorted(parts)
+            details = {key: entry[key] for key in ['error', 'summary'] if key in entry}
+            destination.write(task_name, parts, meta, **details)
+            count += 1
+        if entry.get('ignored', False):
+            destination.ignore(task_name)
+        if entry.get('pinned', False):
+            destination.pin(task_name)
+
+    for record in source.load_runs():
+        destination.append_run(record)
+
+    return count
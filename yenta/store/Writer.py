@@ -0,0 +1,95 @@
+import atexit
+import logging
+import queue
+import threading
+import weakref
+
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWriteError(Exception):
+    pass
+
+
+_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_writers():
+    """ Make sure that nothing queued for writing is lost when the interpreter exits. """
+    for writer in list(_writers):
+        try:
+            writer.close()
+        except CacheWriteError as ex:  # pragma: no cover
+            logger.error(f'Failed to write pipeline cache before exiting: {ex}')
+
+
+class CacheWriter:
+    """ Performs cache writes on a background thread, so that the pipeline does not wait on
+        serialization and disk I/O after every task. At most `max_pending` writes can be queued;
+        once the queue is full, submitting another write blocks until there is room for it. """
+
+    def __init__(self, max_pending: int = 16):
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._errors = []
+        self._lock = threading.Lock()
+        _writers.add(self)
+
+    def _run(self):
+
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                func(*args)
+            except Exception as ex:
+                logger.error(f'Caught exception writing pipeline cache: {ex}')
+                self._errors.append(ex)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func: Callable, *args) -> None:
+        """ Queue a call to `func` with `args` on the writer thread.
+
+        :param Callable func: The function performing the write.
+        :param args: The arguments to pass to the function.
+        :return: None
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='yenta-cache-writer', daemon=True)
+                self._thread.start()
+
+        self._queue.put((func, args))
+
+    def flush(self) -> None:
+        """ Block until every queued write has finished.
+
+        :raises CacheWriteError: If any of the writes failed.
+        :return: None
+        """
+        self._queue.join()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise CacheWriteError(f'{len(errors)} pipeline cache write(s) failed, '
+                                  f'the first error was: {errors[0]}') from errors[0]
+
+    def close(self) -> None:
+        """ Flush the pending writes and stop the writer thread.
+
+        :return: None
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+        self.flush()
@@ -0,0 +1,20 @@
+from .Serializer import (
+    Serializer, SerializationError, PartReader, FilePartReader, PickleSerializer, Pickle5Serializer,
+    NpySerializer, JsonSerializer, get_serializer, SERIALIZERS, DEFAULT_SERIALIZER
+)
+from .Compression import (
+    Codec, CompressionError, CompressedPartReader, ZlibCodec, LzmaCodec, Bz2Codec, get_codec, compress_parts, CODECS,
+    NO_COMPRESSION
+)
+from .Writer import CacheWriter, CacheWriteError
+from .GraphCache import TaskGraphCache
+from .Manifest import Manifest, summarize, summarize_result
+from .Store import (
+    Store, FileStore, SQLiteStore, SQLitePartReader, StoreConfigError, open_store, migrate_store, list_pipelines,
+    is_sqlite_url, sqlite_path
+)
+from .SharedCache import (
+    SharedCache, SharedCacheError, Transport, FileTransport, HTTPTransport, serve_shared_cache, open_shared_cache,
+    transport_for, LOCK_TTL
+)
+from .Eviction import CachedResult, cache_usage, select_evictions, collect_garbage, parse_size, POLICIES
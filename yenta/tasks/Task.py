@@ -1,9 +1,19 @@
+import importlib
+import importlib.util
+import inspect
+import sys
+
 from dataclasses import dataclass, field
 from enum import Enum
 from functools import wraps
+from hashlib import sha1
 from inspect import signature
+from pathlib import Path
 from typing import Callable, List, Dict, Optional
 
+from yenta.store.Compression import CompressionError, get_codec
+from yenta.store.Serializer import SERIALIZERS
+
 
 class ParameterType(int, Enum):
 
@@ -15,6 +25,14 @@ class ResultType(str, Enum):
 
     VALUE = 'values'
     ARTIFACT = 'artifacts'
+    STREAM = 'stream'
+
+
+class TaskExecutor(str, Enum):
+
+    THREAD = 'thread'
+    PROCESS = 'process'
+    ASYNC = 'async'
 
 
 @dataclass
@@ -41,13 +59,126 @@ class TaskDef:
     depends_on: Optional[List[str]]
     pure: bool
     param_specs: List[ParameterSpec] = field(default_factory=list)
+    executor: TaskExecutor = TaskExecutor.THREAD
+    serializer: Optional[str] = None
+    compression: Optional[str] = None
+    resources: Dict[str, float] = field(default_factory=dict)
+    """ How much of each resource, such as `cpu` or `mem_gb`, the task needs while it executes. """
+    map_over: Optional[str] = None
+    """ The list, as in `upstream__values__items`, over each element of which the task is called separately. """
+    reduce: Optional[Callable] = None
+    """ Combines the results of the elements of a mapped task into the result of the task. """
+    stream: bool = False
+    """ Whether the task is a generator function, whose chunks downstream tasks can consume as they are yielded. """
+    cache_stream: bool = False
+    """ Whether the chunks of a streaming task are always cached, so that the task can be reused. """
+    stream_buffer: Optional[int] = None
+    """ How many chunks of a streaming task each consumer may fall behind before the task waits for it. """
+
+    @property
+    def map_spec(self) -> Optional[ResultSpec]:
+        """ The list over which the task is mapped, as a `ResultSpec`. """
+        return ResultSpec(*self.map_over.split('__')) if self.map_over else None
+
+    @property
+    def stream_inputs(self) -> List[str]:
+        """ The names of the streaming tasks whose chunks the task consumes. """
+        return [param.result_spec.result_task_name for param in self.param_specs
+                if param.result_spec is not None and param.result_spec.result_type == ResultType.STREAM]
+
+    @property
+    def element_param(self) -> Optional[str]:
+        """ The name of the parameter that receives each element of a mapped task. """
+        spec = self.map_spec
+        return next((param.param_name for param in self.param_specs if param.result_spec == spec), None)
 
 
 class InvalidTaskDefinitionError(Exception):
     pass
 
 
-def build_parameter_spec(func, selectors: Dict[str, Callable] = None):
+@dataclass
+class TaskReference:
+    """ A picklable reference to a task, used to locate the task again in a worker process. """
+
+    module_name: str
+    module_file: Optional[str]
+    task_name: str
+
+    @classmethod
+    def from_task(cls, task: Callable) -> 'TaskReference':
+        """ Build a reference to a task function.
+
+        :param Callable task: The task function.
+        :return: The reference.
+        :rtype: TaskReference
+        """
+        try:
+            module_file = str(Path(inspect.getsourcefile(task.__wrapped__)).resolve())
+        except TypeError:
+            module_file = None
+
+        return cls(task.__module__, module_file, task.task_def.name)
+
+    def _is_importable(self) -> bool:
+
+        if not self.module_file:
+            return True
+        try:
+            spec = importlib.util.find_spec(self.module_name)
+        except (ImportError, ValueError):
+            return False
+
+        return spec is not None and spec.origin is not None and Path(spec.origin).resolve() == Path(self.module_file)
+
+    def _load_module(self):
+
+        module = sys.modules.get(self.module_name, None)
+        loaded_file = getattr(module, '__file__', None)
+        if module is not None and (not self.module_file or
+                                   (loaded_file and Path(loaded_file).resolve() == Path(self.module_file))):
+            return module
+
+        if self._is_importable():
+            return importlib.import_module(self.module_name)
+
+        # the task was defined in a module that was loaded directly from a file, e.g. by `cli.load_tasks`,
+        # so it cannot be imported by name; load it from the file under a name unique to that file
+        private_name = '_yenta_tasks_' + sha1(self.module_file.encode()).hexdigest()
+        module = sys.modules.get(private_name, None)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(private_name, self.module_file)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[private_name] = module
+            spec.loader.exec_module(module)
+
+        return module
+
+    def resolve(self) -> Callable:
+        """ Find the task that this reference points to, importing its module if needed.
+
+        :return: The task function.
+        :rtype: Callable
+        """
+        module = self._load_module()
+        for func in module.__dict__.values():
+            if callable(func) and hasattr(func, '_yenta_task') and func.task_def.name == self.task_name:
+                return func
+
+        raise InvalidTaskDefinitionError(f'Unable to find task {self.task_name} in module {self.module_name}')
+
+
+def _stream_spec(annotation) -> Optional[ResultSpec]:
+
+    if not isinstance(annotation, str):
+        return None
+    parts = annotation.split('__')
+    if len(parts) != 2 or parts[1] != ResultType.STREAM:
+        return None
+    return ResultSpec(parts[0], ResultType.STREAM, None)
+
+
+def build_parameter_spec(func, selectors: Dict[str, Callable] = None, map_over: str = None):
 
     sig = signature(func)
     param_names = list(sig.parameters.keys())
@@ -60,6 +191,8 @@ def build_parameter_spec(func, selectors: Dict[str, Callable] = None):
     #   {parameter_name: callable} where the callable takes the previous state as a
     #   parameter and produces an arbitrary value
     # note the double underbars like in the django query language
+    # the single parameter of a task mapped over a list receives each element of the list instead
+    # a parameter annotated with '<task_name>__stream' receives the chunks yielded by a streaming task
 
     # TODO: fix bug where a single parameter cannot be underbar-referenced
 
@@ -68,7 +201,13 @@ def build_parameter_spec(func, selectors: Dict[str, Callable] = None):
     if len(param_names) == 0:
         spec = []
     elif len(param_names) == 1 and '__' not in param_names[0] and not selectors:
-        spec = [ParameterSpec(param_names[0], ParameterType.PIPELINE_RESULTS)]
+        param = sig.parameters[param_names[0]]
+        if map_over and (not isinstance(param.annotation, str) or param.annotation == map_over):
+            spec = [ParameterSpec(param_names[0], ParameterType.EXPLICIT, ResultSpec(*map_over.split('__')))]
+        elif _stream_spec(param.annotation):
+            spec = [ParameterSpec(param_names[0], ParameterType.EXPLICIT, _stream_spec(param.annotation))]
+        else:
+            spec = [ParameterSpec(param_names[0], ParameterType.PIPELINE_RESULTS)]
     else:
         spec = []
         for name in param_names:
@@ -76,6 +215,8 @@ def build_parameter_spec(func, selectors: Dict[str, Callable] = None):
             if selectors:
                 selector = selectors[name]
                 spec.append(ParameterSpec(name, ParameterType.EXPLICIT, None, selector))
+            elif _stream_spec(param.annotation):
+                spec.append(ParameterSpec(name, ParameterType.EXPLICIT, _stream_spec(param.annotation)))
             elif isinstance(param.annotation, str):
                 annot = param.annotation.split('__')
                 if len(annot) != 3:
@@ -94,20 +235,111 @@ def build_parameter_spec(func, selectors: Dict[str, Callable] = None):
     return spec
 
 
-def task(_func=None, *, depends_on: Optional[List[str]] = None, pure: bool = True, selectors=None):
+def task(_func=None, *, depends_on: Optional[List[str]] = None, pure: bool = True, selectors=None,
+         executor: Optional[str] = None, serializer: Optional[str] = None, compression: Optional[str] = None,
+         resources: Optional[Dict[str, float]] = None, map_over: Optional[str] = None,
+         reduce: Optional[Callable] = None, cache_stream: bool = False, stream_buffer: Optional[int] = None):
+
+    try:
+        task_executor = TaskExecutor(executor) if executor else None
+    except ValueError:
+        raise InvalidTaskDefinitionError(
+            f'Invalid executor {executor}, expected one of: {", ".join(e.value for e in TaskExecutor)}')
+
+    if serializer and serializer not in SERIALIZERS:
+        raise InvalidTaskDefinitionError(
+            f'Invalid serializer {serializer}, expected one of: {", ".join(SERIALIZERS)}')
+
+    try:
+        get_codec(compression)
+    except CompressionError as ex:
+        raise InvalidTaskDefinitionError(str(ex)) from ex
+
+    for resource, amount in (resources or {}).items():
+        if not isinstance(resource, str) or isinstance(amount, bool) or not isinstance(amount, (int, float)) \
+                or amount < 0:
+            raise InvalidTaskDefinitionError(
+                f'Invalid resource declaration {resource}={amount}, expected a name and a non-negative number')
+
+    if map_over is not None and (not isinstance(map_over, str) or len(map_over.split('__')) != 3):
+        raise InvalidTaskDefinitionError(
+            f'Invalid map_over {map_over}, expected <task_name>__<values|artifacts>__<value_name|artifact_name>')
+    if reduce is not None and map_over is None:
+        raise InvalidTaskDefinitionError('Only tasks declared with map_over can have a reduce step')
+
+    if stream_buffer is not None and (isinstance(stream_buffer, bool) or not isinstance(stream_buffer, int)
+                                      or stream_buffer < 1):
+        raise InvalidTaskDefinitionError(f'Invalid stream_buffer {stream_buffer}, expected a positive number of chunks')
 
     def decorator_task(func: Callable):
 
-        @wraps(func)
-        def task_wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+        streaming = inspect.isgeneratorfunction(func)
+        if inspect.isasyncgenfunction(func):
+            raise InvalidTaskDefinitionError(
+                f'Task {func.__name__} is an async generator function, which cannot stream its chunks')
+        if streaming and task_executor not in (None, TaskExecutor.THREAD):
+            raise InvalidTaskDefinitionError(
+                f'Task {func.__name__} is a generator function and can only use the thread executor')
+        if not streaming and (cache_stream or stream_buffer is not None):
+            raise InvalidTaskDefinitionError(
+                f'Only generator functions can set cache_stream or stream_buffer, which {func.__name__} is not')
+
+        if inspect.iscoroutinefunction(func):
+            if task_executor not in (None, TaskExecutor.ASYNC):
+                raise InvalidTaskDefinitionError(
+                    f'Task {func.__name__} is a coroutine function and can only use the async executor')
+
+            @wraps(func)
+            async def task_wrapper(*args, **kwargs):
+                return await func(*args, **kwargs)
+
+            func_executor = TaskExecutor.ASYNC
+        else:
+            if task_executor == TaskExecutor.ASYNC:
+                raise InvalidTaskDefinitionError(
+                    f'Task {func.__name__} must be a coroutine function to use the async executor')
+
+            @wraps(func)
+            def task_wrapper(*args, **kwargs):
+                return func(*args, **kwargs)
+
+            func_executor = task_executor or TaskExecutor.THREAD
 
-        setattr(task_wrapper, 'task_def', TaskDef(
+        task_def = TaskDef(
             name=func.__name__,
             depends_on=depends_on,
             pure=pure,
-            param_specs=build_parameter_spec(func, selectors)
-        ))
+            param_specs=build_parameter_spec(func, selectors, map_over),
+            executor=func_executor,
+            serializer=serializer,
+            compression=compression,
+            resources=dict(resources or {}),
+            map_over=map_over,
+            reduce=reduce,
+            stream=streaming,
+            cache_stream=cache_stream,
+            stream_buffer=stream_buffer
+        )
+        if task_def.stream_inputs and task_def.executor != TaskExecutor.THREAD:
+            raise InvalidTaskDefinitionError(
+                f'Task {func.__name__} consumes a stream, so it can only use the thread executor')
+        # like any other input, a stream can only be consumed by a task that depends on its producer
+        missing = [name for name in task_def.stream_inputs if name not in (task_def.depends_on or [])]
+        if missing:
+            task_def.depends_on = [*(task_def.depends_on or []), *missing]
+        if map_over is not None:
+            if task_def.stream or task_def.stream_inputs:
+                raise InvalidTaskDefinitionError(
+                    f'Task {func.__name__} produces or consumes a stream, so it cannot map over a list')
+            if task_def.element_param is None:
+                raise InvalidTaskDefinitionError(
+                    f'Task {func.__name__} maps over {map_over}, but none of its parameters is annotated with it')
+            # the list to map over has to exist before the task can run
+            upstream = task_def.map_spec.result_task_name
+            if upstream not in (task_def.depends_on or []):
+                task_def.depends_on = [*(task_def.depends_on or []), upstream]
+
+        setattr(task_wrapper, 'task_def', task_def)
 
         setattr(task_wrapper, '_yenta_task', True)
 
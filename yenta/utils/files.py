@@ -1,18 +1,237 @@
-from hashlib import sha1
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from yenta.config import settings
 
 
-def file_hash(path: Path, block_size=65536):
-    s = sha1()
+def file_hash(path: Path, block_size=1 << 20, algorithm: str = 'sha1'):
+    s = hashlib.new(algorithm)
 
     if path.exists():
-        with open(path, 'rb') as f:
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        with open(path, 'rb', buffering=0) as f:
             stop = False
             while not stop:
-                data = f.read(block_size)
-                if len(data) > 0:
-                    s.update(data)
+                size = f.readinto(buffer)
+                if size:
+                    s.update(view[:size])
                 else:
                     stop = True
 
     return s
+
+
+class HashCache:
+    """ A persistent cache of file hashes, which saves reading a file again to hash it if it has
+        not changed since it was last hashed. A file counts as unchanged if its size, modification
+        time and inode are all the same. Each file gets a small JSON entry in `directory`, which
+        records the digests computed with every algorithm that has been used on the file. """
+
+    RACY_WINDOW_NS = 2 * 10 ** 9
+    """ Files modified this recently are not cached, since a write in the same tick of the file
+        system clock as the hash would not change the modification time. """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _entry_path(self, path: Path) -> Path:
+        return self.directory / (hashlib.blake2b(str(path).encode(), digest_size=16).hexdigest() + '.json')
+
+    @staticmethod
+    def _key(stat: os.stat_result) -> list:
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def _load_entry(self, path: Path) -> dict:
+        try:
+            with open(self._entry_path(path), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entry if entry.get('path', None) == str(path) else {}
+
+    def get(self, path: Path, algorithm: str, stat: os.stat_result = None) -> Optional[str]:
+        """ Look up the hash of a file.
+
+        :param Path path: The file.
+        :param str algorithm: The name of the hash algorithm.
+        :param stat: The result of `os.stat` on the file, if already known.
+        :return: The hex digest of the file, or None if the file is not in the cache or has changed.
+        :rtype: Optional[str]
+        """
+        path = Path(path).resolve()
+        stat = stat or path.stat()
+        entry = self._load_entry(path)
+        if entry.get('key', None) != self._key(stat):
+            return None
+        return entry['hashes'].get(algorithm, None)
+
+    def put(self, path: Path, algorithm: str, digest: str, stat: os.stat_result) -> None:
+        """ Record the hash of a file, as it was when `stat` was taken.
+
+        :param Path path: The file.
+        :param str algorithm: The name of the hash algorithm.
+        :param str digest: The hex digest of the file.
+        :param stat: The result of `os.stat` on the file, taken before it was hashed.
+        :return: None
+        """
+        if time.time_ns() - stat.st_mtime_ns < self.RACY_WINDOW_NS:
+            return
+
+        path = Path(path).resolve()
+        entry = self._load_entry(path)
+        if entry.get('key', None) != self._key(stat):
+            entry = {'path': str(path), 'key': self._key(stat), 'hashes': {}}
+        entry['hashes'][algorithm] = digest
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atomic_write(self._entry_path(path), json.dumps(entry).encode())
+
+    def hash(self, path: Path, algorithm: str) -> str:
+        """ Compute the hash of a file, reusing the cached hash if the file has not changed.
+
+        :param Path path: The file.
+        :param str algorithm: The name of the hash algorithm.
+        :return: The hex digest of the file.
+        :rtype: str
+        """
+        stat = os.stat(path)
+        digest = self.get(path, algorithm, stat)
+        if digest is None:
+            digest = file_hash(Path(path), algorithm=algorithm).hexdigest()
+            self.put(path, algorithm, digest, stat)
+        return digest
+
+    def hash_tree(self, root: Path, algorithm: str, max_workers: int = None) -> str:
+        """ Compute a Merkle hash of a directory: the hash of a directory combines the names, types
+            and hashes of its entries, and the hash of a file is the hash of its contents. The stat of
+            every file is recorded along with its hash, so that only the files that changed since the
+            last time the directory was hashed are read again, and those are hashed in parallel.
+
+        :param Path root: The directory.
+        :param str algorithm: The name of the hash algorithm.
+        :param int max_workers: The maximum number of files to hash at the same time.
+        :return: The hex digest of the directory.
+        :rtype: str
+        """
+        root = Path(root).resolve()
+        previous = self._load_entry(root).get('trees', {}).get(algorithm, {})
+
+        def join(relative: str, name: str) -> str:
+            return name if relative == '.' else f'{relative}/{name}'
+
+        directories = {}
+        stats = {}
+        links = {}
+        for dir_path, dir_names, file_names in os.walk(root):
+            relative = Path(dir_path).relative_to(root).as_posix()
+            directories[relative] = (dir_names, file_names)
+            for file_name in file_names:
+                path = Path(dir_path) / file_name
+                try:
+                    stats[join(relative, file_name)] = os.stat(path)
+                except OSError:
+                    if not path.is_symlink():
+                        raise
+                    # dangling or circular symbolic links are hashed by their target
+                    links[join(relative, file_name)] = os.readlink(path)
+
+        digests = {}
+        changed = []
+        for file_path, stat in stats.items():
+            known = previous.get(file_path, None)
+            if known is not None and known[:-1] == self._key(stat):
+                digests[file_path] = known[-1]
+            else:
+                changed.append(file_path)
+
+        if changed or previous.keys() != stats.keys():
+            if changed:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    hashes = executor.map(lambda file_path: file_hash(root / file_path, algorithm=algorithm), changed)
+                    for file_path, h in zip(changed, hashes):
+                        digests[file_path] = h.hexdigest()
+
+            now = time.time_ns()
+            tree = {file_path: self._key(stat) + [digests[file_path]] for file_path, stat in stats.items()
+                    if now - stat.st_mtime_ns >= self.RACY_WINDOW_NS}
+            entry = self._load_entry(root)
+            entry.update({'path': str(root), 'trees': {**entry.get('trees', {}), algorithm: tree}})
+            self.directory.mkdir(parents=True, exist_ok=True)
+            atomic_write(self._entry_path(root), json.dumps(entry).encode())
+
+        def directory_digest(relative: str) -> str:
+            dir_names, file_names = directories[relative]
+            children = []
+            for name in file_names:
+                path = join(relative, name)
+                if path in links:
+                    children.append((name, b'l', links[path].encode()))
+                else:
+                    children.append((name, b'f', bytes.fromhex(digests[path])))
+            for name in dir_names:
+                path = join(relative, name)
+                if path in directories:
+                    children.append((name, b'd', bytes.fromhex(directory_digest(path))))
+                else:
+                    # symbolic links to directories are not followed
+                    children.append((name, b'l', os.readlink(root / path).encode()))
+
+            h = hashlib.new(algorithm)
+            for name, kind, digest in sorted(children):
+                h.update(kind + name.encode() + b'\0' + digest + b'\0')
+            return h.hexdigest()
+
+        return directory_digest('.')
+
+
+def cached_file_hash(path: Path, algorithm: str = None) -> str:
+    """ Compute the hash of a file using the hash cache kept in the store.
+
+    :param Path path: The file.
+    :param str algorithm: The name of the hash algorithm, by default `settings.YENTA_HASH_ALGORITHM`.
+    :return: The hex digest of the file.
+    :rtype: str
+    """
+    return HashCache(settings.YENTA_STORE_PATH / '.hash_cache').hash(path, algorithm or settings.YENTA_HASH_ALGORITHM)
+
+
+def atomic_write(path: Path, data: Union[bytes, Iterable[bytes]]) -> None:
+    """ Write `data` to `path` so that `path` either keeps its old contents or has all
+        of the new ones, even if the process dies in the middle of the write. The data
+        is written to a temporary file in the same directory, which is then renamed.
+
+    :param Path path: The file to write.
+    :param data: The contents of the file, either as a single bytes-like object or as
+        a sequence of bytes-like chunks to be written one after the other.
+    :return: None
+    """
+    chunks = [data] if isinstance(data, (bytes, bytearray, memoryview)) else data
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def cached_directory_hash(path: Path, algorithm: str = None) -> str:
+    """ Compute the Merkle hash of a directory using the hash cache kept in the store.
+
+    :param Path path: The directory.
+    :param str algorithm: The name of the hash algorithm, by default `settings.YENTA_HASH_ALGORITHM`.
+    :return: The hex digest of the directory.
+    :rtype: str
+    """
+    return HashCache(settings.YENTA_STORE_PATH / '.hash_cache').hash_tree(
+        path, algorithm or settings.YENTA_HASH_ALGORITHM)
@@ -0,0 +1,100 @@
+import pickle
+import uuid
+
+from dataclasses import fields, is_dataclass
+from hashlib import blake2b
+from typing import Any
+
+from yenta.artifacts.Artifact import Artifact
+
+
+FINGERPRINT_SIZE = 20
+
+
+def _update(h, obj: Any) -> None:
+    """ Feed a canonical encoding of `obj` into the hash `h`. Objects that compare equal
+        under the rules used by the pipeline must produce the same encoding. """
+
+    if obj is None or isinstance(obj, (bool, int, float, complex)):
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        h.update(f'str:{len(data)}:'.encode())
+        h.update(data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = memoryview(obj).cast('B')
+        h.update(f'bytes:{data.nbytes}:'.encode())
+        h.update(data)
+    elif isinstance(obj, Artifact):
+        # every field but the creation date is covered, so this is stricter than Artifact.__eq__,
+        # which ignores the metadata and the hash algorithm
+        h.update(f'artifact:{type(obj).__name__}:'.encode())
+        _update(h, str(obj.location))
+        for f in fields(obj):
+            if f.name not in ('location', 'date_created'):
+                h.update(f'{f.name}='.encode())
+                _update(h, getattr(obj, f.name))
+    elif isinstance(obj, dict):
+        h.update(f'dict:{len(obj)}:'.encode())
+        for key_digest, value in sorted(((fingerprint(key), value) for key, value in obj.items()),
+                                        key=lambda item: item[0]):
+            h.update(key_digest.encode())
+            _update(h, value)
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}:{len(obj)}:'.encode())
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, (set, frozenset)):
+        h.update(f'set:{len(obj)}:'.encode())
+        for item_digest in sorted(fingerprint(item) for item in obj):
+            h.update(item_digest.encode())
+    elif type(obj).__module__ == 'numpy' and hasattr(obj, 'dtype') and hasattr(obj, 'shape'):
+        import numpy as np
+        if obj.dtype.hasobject:
+            _update(h, obj.tolist())
+        else:
+            h.update(f'ndarray:{obj.dtype.str}:{obj.shape}:'.encode())
+            # viewed as bytes, since the buffer protocol rejects dtypes such as datetime64
+            h.update(np.ascontiguousarray(obj).reshape(-1).view(np.uint8))
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        h.update(f'dataclass:{type(obj).__qualname__}:'.encode())
+        for f in fields(obj):
+            if f.compare:
+                h.update(f'{f.name}='.encode())
+                _update(h, getattr(obj, f.name))
+    else:
+        try:
+            data = pickle.dumps(obj, protocol=4)
+        except Exception:
+            # the content of values that cannot be pickled, such as locks, is unknown, so they
+            # never match anything, including themselves, and whatever depends on them is rerun
+            h.update(f'unpicklable:{type(obj).__qualname__}:{uuid.uuid4().hex};'.encode())
+            return
+        h.update(f'pickle:{len(data)}:'.encode())
+        h.update(data)
+
+
+def fingerprint(obj: Any) -> str:
+    """ Compute a compact digest of the content of an arbitrary object.
+
+    :param Any obj: The object to fingerprint.
+    :return: The hex digest.
+    :rtype: str
+    """
+    h = blake2b(digest_size=FINGERPRINT_SIZE)
+    _update(h, obj)
+    return h.hexdigest()
+
+
+def combine_fingerprints(named_fingerprints: dict) -> str:
+    """ Combine a dictionary of names and fingerprints into a single fingerprint
+        that does not depend on the order of the dictionary.
+
+    :param dict named_fingerprints: A dictionary whose values are fingerprints.
+    :return: The hex digest.
+    :rtype: str
+    """
+    h = blake2b(digest_size=FINGERPRINT_SIZE)
+    for name in sorted(named_fingerprints):
+        h.update(f'{name}={named_fingerprints[name]};'.encode())
+    return h.hexdigest()